@@ -0,0 +1,168 @@
+import numpy as np
+from numba import njit
+
+"""
+Streaming statistics for the observables of a simulation, in O(1) memory.
+An accumulator is a float64 array with the layout
+
+acc: [
+      burn_in, thinning, steps, accepted, E_min, E_max, n_bins, outside,
+      count, mean, M2,           <- energy (Welford)
+      count, mean, M2,           <- diameter (Welford)
+      count, mean, M2,           <- radius of gyration (Welford)
+      count, mean, M2,           <- end-to-end distance (Welford)
+      bin_1, bin_2, ..., bin_n   <- histogram of the energy on [E_min, E_max)
+      ]
+
+Step i (the initial state is step 0) is sampled if i >= burn_in and (i - burn_in) % thinning == 0,
+so with thinning = 1 the statistics equal those of E_array[burn_in:].
+"""
+
+ENERGY = 0
+DIAMETER = 1
+RADIUS_OF_GYRATION = 2
+END_TO_END = 3
+
+_BURN_IN = 0
+_THINNING = 1
+_STEPS = 2
+_ACCEPTED = 3
+_E_MIN = 4
+_E_MAX = 5
+_N_BINS = 6
+_OUTSIDE = 7
+_STATS = 8
+_HISTOGRAM = _STATS + 12
+
+
+@njit(cache=True)
+def new_accumulator(
+    burn_in: int = 0,
+    thinning: int = 1,
+    n_bins: int = 0,
+    E_min: float = 0.0,
+    E_max: float = 0.0,
+) -> np.ndarray:
+    """Makes an empty accumulator
+
+    Args:
+        burn_in: number of steps which are not sampled
+        thinning: sample every thinning-th step after the burn-in
+        n_bins: number of bins of the energy histogram. No histogram if 0
+        E_min: lower edge of the histogram
+        E_max: upper edge of the histogram
+
+    Returns:
+        the accumulator
+    """
+    acc = np.zeros(_HISTOGRAM + n_bins)
+    acc[_BURN_IN] = burn_in
+    acc[_THINNING] = thinning
+    acc[_E_MIN] = E_min
+    acc[_E_MAX] = E_max
+    acc[_N_BINS] = n_bins
+    return acc
+
+
+@njit(cache=True)
+def _welford(acc: np.ndarray, observable: int, x: float) -> None:
+    """Updates the running mean and sum of squared deviations with x"""
+    k = _STATS + 3 * observable
+    acc[k] += 1
+    delta = x - acc[k + 1]
+    acc[k + 1] += delta / acc[k]
+    acc[k + 2] += delta * (x - acc[k + 1])
+
+
+@njit(cache=True)
+def observe(
+    acc: np.ndarray,
+    E: float,
+    d: float,
+    accepted: bool,
+    R_g: float = np.nan,
+    R_ee: float = np.nan,
+) -> None:
+    """Adds one step of the simulation to the accumulator
+
+    Args:
+        acc: the accumulator, updated in place
+        E: energy after the step
+        d: diameter after the step, or nan if it is not tracked
+        accepted: True if the move of the step was accepted
+        R_g: radius of gyration after the step, or nan if it is not tracked
+        R_ee: end-to-end distance after the step, or nan if it is not tracked
+    """
+    step = acc[_STEPS]
+    acc[_STEPS] += 1
+    acc[_ACCEPTED] += accepted
+    if step < acc[_BURN_IN] or (step - acc[_BURN_IN]) % acc[_THINNING] != 0:
+        return
+
+    _welford(acc, ENERGY, E)
+    if not np.isnan(d):
+        _welford(acc, DIAMETER, d)
+    if not np.isnan(R_g):
+        _welford(acc, RADIUS_OF_GYRATION, R_g)
+    if not np.isnan(R_ee):
+        _welford(acc, END_TO_END, R_ee)
+
+    n_bins = int(acc[_N_BINS])
+    if n_bins > 0:
+        b = int(np.floor((E - acc[_E_MIN]) / (acc[_E_MAX] - acc[_E_MIN]) * n_bins))
+        if 0 <= b < n_bins:
+            acc[_HISTOGRAM + b] += 1
+        else:
+            acc[_OUTSIDE] += 1
+
+
+@njit(cache=True)
+def count(acc: np.ndarray, observable: int = ENERGY) -> int:
+    """Number of samples of an observable (ENERGY, DIAMETER, ...)"""
+    return int(acc[_STATS + 3 * observable])
+
+
+@njit(cache=True)
+def mean(acc: np.ndarray, observable: int = ENERGY) -> float:
+    """Mean of the samples of an observable (ENERGY, DIAMETER, ...)"""
+    k = _STATS + 3 * observable
+    if acc[k] == 0:
+        return np.nan
+    return acc[k + 1]
+
+
+@njit(cache=True)
+def variance(acc: np.ndarray, observable: int = ENERGY) -> float:
+    """Variance (population, as np.var) of the samples of an observable (ENERGY, DIAMETER, ...)"""
+    k = _STATS + 3 * observable
+    if acc[k] == 0:
+        return np.nan
+    return acc[k + 2] / acc[k]
+
+
+@njit(cache=True)
+def std(acc: np.ndarray, observable: int = ENERGY) -> float:
+    """Standard deviation (population, as np.std) of the samples of an observable (ENERGY, DIAMETER, ...)"""
+    return np.sqrt(variance(acc, observable))
+
+
+@njit(cache=True)
+def acceptance_rate(acc: np.ndarray) -> float:
+    """Fraction of the steps (after the initial state) where the move was accepted"""
+    if acc[_STEPS] <= 1:
+        return np.nan
+    return acc[_ACCEPTED] / (acc[_STEPS] - 1)
+
+
+def histogram(acc: np.ndarray) -> tuple[np.ndarray, np.ndarray, int]:
+    """The energy histogram of the accumulator
+
+    Args:
+        acc: the accumulator
+
+    Returns:
+        (counts, bin_edges, number of samples outside the edges), as with np.histogram
+    """
+    n_bins = int(acc[_N_BINS])
+    edges = np.linspace(acc[_E_MIN], acc[_E_MAX], n_bins + 1)
+    return acc[_HISTOGRAM:].copy(), edges, int(acc[_OUTSIDE])
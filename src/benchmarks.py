@@ -1,131 +1,242 @@
-import numpy as np
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime, timezone
 from time import perf_counter
 from typing import Callable
+
+import numba
+import numpy as np
+import lattice
 import polymer
 import simulation as sim
 import utilities as utils
 
+"""
+Benchmarks of the hot functions for polymers of increasing length.
 
-def benchmark(iterations: int = 10, setup_func=lambda x: None, warmup=1) -> Callable:
-    def decorator(func):
-        if setup_func is None:
-            _ = [func() for _ in range(warmup)]
-
-            def none_wrapper():
-                stime = perf_counter()
-                results = [0] * iterations
-                for i in range(iterations):
-                    results[i] = func()
-                tot_time = perf_counter() - stime
-                avg_time = tot_time / iterations
-                return avg_time, results
-
-            return none_wrapper
-        else:
-            _ = [func(*setup_func()) for _ in range(warmup)]
-
-            def wrapper():
-                init_setup = setup_func()
-                stime = perf_counter()
-                results = [0] * iterations
-                for i in range(iterations):
-                    results[i] = func(*init_setup)
-                tot_time = perf_counter() - stime
-                avg_time = tot_time / iterations
-                return avg_time, results
-
-            return wrapper
-
-    return decorator
-
-
-def calculate_energy_setup():
-    V = np.array(
-        [
-            [0, 0, 1, 1, 1, 1, 1, 1, 1, 1, 1],
-            [0, 0, 0, 1, 1, 1, 1, 1, 1, 1, 1],
-            [1, 0, 0, 0, 1, 1, 1, 1, 1, 1, 1],
-            [1, 1, 0, 0, 0, 1, 1, 1, 1, 1, 1],
-            [1, 1, 1, 0, 0, 0, 1, 1, 1, 1, 1],
-            [1, 1, 1, 1, 0, 0, 0, 1, 1, 1, 1],
-            [1, 1, 1, 1, 1, 0, 0, 0, 1, 1, 1],
-            [1, 1, 1, 1, 1, 1, 0, 0, 0, 1, 1],
-            [1, 1, 1, 1, 1, 1, 1, 0, 0, 0, 1],
-            [1, 1, 1, 1, 1, 1, 1, 1, 0, 0, 0],
-            [1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 0],
-        ]
-    )
-
-    a = np.array(
-        [
-            [0, 0],
-            [1, 0],
-            [1, 1],
-            [0, 1],
-            [-1, 1],
-            [-2, 1],
-            [-2, 0],
-            [-1, 0],
-            [-2, -1],
-            [-2, -2],
-            [-2, -3],
-        ]
-    )
-    return a, V
-
-
-def bench_rotate_polymer_setup():
-    return (polymer.generate_flat_polymer(35), )
+Every benchmark has a setup function, which makes the arguments for a given N,
+and a function which is timed. The first call is timed separately, since it includes
+the JIT-compilation by numba. The results can be written as JSON, to compare runs.
 
+The startup benchmark times new processes which import the simulation and call simulation.warmup,
+i.e. the time until the first simulation can start. The first process compiles and fills the
+on-disk cache of numba (if it is not already filled), the later ones load from it.
 
-@benchmark(iterations=1000, setup_func=calculate_energy_setup, warmup=1)
-def bench_calculate_energy(a: np.ndarray, V: np.ndarray):
-    return polymer.calculate_energy(a, V)
+Usage:
+    python benchmarks.py --Ns 10 100 1000 10000 --output results.json
+    python benchmarks.py --startup --only metropolis
+"""
 
+# Number of Monte Carlo steps in the metropolis benchmark
+METROPOLIS_STEPS = 1_000
+# Larger polymers use the O(1) memory interaction matrix, as the dense one is N x N
+DENSE_V_MAX_N = 1_000
 
-@benchmark(iterations=1000, setup_func=calculate_energy_setup, warmup=1)
-def bench_calculate_energy_2(a: np.ndarray, V: np.ndarray):
-    return polymer.calculate_energy_2(a, V)
 
-@benchmark(iterations=1000, setup_func=calculate_energy_setup, warmup=1)
-def bench_calculate_energy_3(a: np.ndarray, V: np.ndarray):
-    return polymer.calculate_energy_3(a, V)
+def _random_polymer(N: int) -> np.ndarray:
+    """A polymer which is not flat, so that the checks can not exit early"""
+    pol, _ = sim.alg1(N, 1_000, seed=0)
+    return pol
 
-@benchmark(iterations=1000, setup_func=bench_rotate_polymer_setup)
-def bench_rotate_polymer(pol: np.ndarray):
-    a = polymer.rotate_polymer(pol, 15)
-    a = polymer.rotate_polymer(a, 10)
-    a = polymer.rotate_polymer(a, 3, False)
-    a = polymer.rotate_polymer(a, 20)
-    a = polymer.rotate_polymer(a, 15, False)
-    a = polymer.rotate_polymer(a, 25)
 
-def metropolis_setup():
-    pol = polymer.generate_flat_polymer(35)
-    N_s = 100
-    V = utils.gen_V_matrix(35)
-    T = 293
-    return pol, N_s, V, T
+def _V(N: int) -> np.ndarray | utils.StructuredV:
+    if N <= DENSE_V_MAX_N:
+        return utils.gen_V_matrix(N)
+    return utils.gen_V_uniform(N)
 
 
+def check_if_intact_setup(N: int) -> tuple:
+    pol = _random_polymer(N)
+    return pol, N
 
-@benchmark(iterations=100, setup_func=metropolis_setup, warmup=5)
-def bench_metropolis(pol: np.ndarray, N_s: int, V: np.ndarray, T: float):
-    return sim.metropolis(pol, N_s, V, T)
+
+def check_if_intact_rotated_setup(N: int) -> tuple:
+    pol = _random_polymer(N)
+    return pol, N // 2, True, lattice.build_lattice(pol)
+
+
+def rotate_polymer_setup(N: int) -> tuple:
+    return _random_polymer(N), N // 2, True
+
+
+def calculate_energy_setup(N: int) -> tuple:
+    return _random_polymer(N), _V(N)
+
+
+def calculate_diameter_setup(N: int) -> tuple:
+    return (_random_polymer(N),)
+
+
+def metropolis_setup(N: int) -> tuple:
+    return polymer.generate_flat_polymer(N), METROPOLIS_STEPS, _V(N), 293.0
+
+
+# name: (function, setup function, Monte Carlo steps per call)
+BENCHMARKS: dict[str, tuple[Callable, Callable, int]] = {
+    "check_if_intact": (polymer.check_if_intact, check_if_intact_setup, 1),
+    "check_if_intact_rotated": (
+        polymer.check_if_intact_rotated,
+        check_if_intact_rotated_setup,
+        1,
+    ),
+    "rotate_polymer": (polymer.rotate_polymer, rotate_polymer_setup, 1),
+    "calculate_energy": (polymer.calculate_energy, calculate_energy_setup, 1),
+    "calculate_diameter": (utils.calculate_diameter, calculate_diameter_setup, 1),
+    "metropolis": (sim.metropolis, metropolis_setup, METROPOLIS_STEPS),
+}
+
+
+def run_benchmark(name: str, N: int, iterations: int = 20) -> dict:
+    """Times one of the BENCHMARKS for a polymer of length N
+
+    Args:
+        name: name of the benchmark
+        N: length of the polymer
+        iterations: number of timed calls after the first call
+
+    Returns:
+        dict with the timings in seconds:
+            first_call: the first call, including JIT-compilation (if not already compiled)
+            compile_time: first_call - median
+            median, p10, p90, min, mean: statistics of the steady state calls
+            steps_per_second: Monte Carlo steps (or calls) per second at the median
+    """
+    func, setup_func, steps = BENCHMARKS[name]
+    args = setup_func(N)
+
+    start = perf_counter()
+    func(*args)
+    first_call = perf_counter() - start
+
+    times = np.zeros(iterations)
+    for i in range(iterations):
+        start = perf_counter()
+        func(*args)
+        times[i] = perf_counter() - start
+
+    median = float(np.median(times))
+    return {
+        "name": name,
+        "N": N,
+        "iterations": iterations,
+        "first_call": first_call,
+        "compile_time": max(first_call - median, 0.0),
+        "median": median,
+        "p10": float(np.percentile(times, 10)),
+        "p90": float(np.percentile(times, 90)),
+        "min": float(np.min(times)),
+        "mean": float(np.mean(times)),
+        "steps_per_second": steps / median,
+    }
+
+
+def run_suite(
+    names: list[str] | None = None,
+    Ns: tuple[int, ...] = (10, 100, 1_000, 10_000),
+    iterations: int = 20,
+    verbose: bool = False,
+) -> dict:
+    """Runs the benchmarks for all the polymer lengths
+
+    Args:
+        names: the benchmarks to run. All of BENCHMARKS if None
+        Ns: polymer lengths
+        iterations: number of timed calls for every benchmark and N
+        verbose: print every result when it is done
+
+    Returns:
+        {"metadata": information about the machine and versions, "results": list of run_benchmark results}
+    """
+    if names is None:
+        names = list(BENCHMARKS)
+    results = []
+    for name in names:
+        for N in Ns:
+            result = run_benchmark(name, N, iterations)
+            results.append(result)
+            if verbose:
+                print(format_result(result))
+    return {"metadata": metadata(), "results": results}
+
+
+def measure_startup(repeats: int = 3, parallel: bool = True) -> dict:
+    """Times the startup of new processes, from the import of the simulation
+    until simulation.warmup has returned
+
+    Args:
+        repeats: number of processes. The first one may compile, the others load the cache
+        parallel: also warm up the parallel drivers
+
+    Returns:
+        dict with the timings in seconds:
+            first: the first process, which compiles if the cache is empty or out of date
+            cached: median of the later processes, which load the compiled code from the cache
+    """
+    command = [
+        sys.executable,
+        "-c",
+        f"import simulation; simulation.warmup(parallel={parallel})",
+    ]
+    src = os.path.dirname(os.path.abspath(__file__))
+    times = np.zeros(repeats)
+    for i in range(repeats):
+        start = perf_counter()
+        subprocess.run(command, cwd=src, check=True)
+        times[i] = perf_counter() - start
+
+    return {
+        "repeats": repeats,
+        "parallel": parallel,
+        "first": float(times[0]),
+        "cached": float(np.median(times[1:])) if repeats > 1 else np.nan,
+    }
+
+
+def metadata() -> dict:
+    """Information needed to compare benchmark runs"""
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "numba": numba.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "threads": numba.config.NUMBA_NUM_THREADS,
+    }
+
+
+def format_result(result: dict) -> str:
+    return (
+        f"{result['name']:<24} N = {result['N']:>6}: "
+        f"median {result['median']:>10.3e} s "
+        f"[p10 {result['p10']:.3e}, p90 {result['p90']:.3e}], "
+        f"first call {result['first_call']:.3e} s, "
+        f"{result['steps_per_second']:.3e} steps/s"
+    )
 
 
 if __name__ == "__main__":
-    # time1, results1 = bench_calculate_energy()
-    # time2, results2 = bench_calculate_energy_2()
-    # time3, results3 = bench_calculate_energy_3()
-    #
-    # print(f"func: bench_calculate_energy\ntime: {time1:>10.5e}\nresults[0]: {results1[0]}\n")
-    # print(f"func: bench_calculate_energy2\ntime: {time2:>10.5e}\nresults[0]: {results2[0]}\n")
-    # print(f"func: bench_calculate_energy3\ntime: {time3:>10.5e}\nresults[0]: {results3[0]}\n")
-
-    time, res = bench_metropolis()
-    print(f"Time: {time}")
-    # benchmarks = [bench_calculate_energy]
-    # for b in benchmarks:
-    #     time, results = b()
-    #     print(f"function:{b.__name__}\ntime: {time:>10.5e}")
+    parser = argparse.ArgumentParser(description="Benchmarks of the hot functions")
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), default=None)
+    parser.add_argument("--Ns", nargs="+", type=int, default=[10, 100, 1_000, 10_000])
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument(
+        "--startup", action="store_true", help="also time the startup of new processes"
+    )
+    args = parser.parse_args()
+
+    suite = run_suite(args.only, tuple(args.Ns), args.iterations, verbose=True)
+    if args.startup:
+        suite["startup"] = measure_startup()
+        print(
+            f"startup: first {suite['startup']['first']:.3e} s, "
+            f"cached {suite['startup']['cached']:.3e} s"
+        )
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            json.dump(suite, file, indent=2)
@@ -0,0 +1,306 @@
+import functools
+import hashlib
+import importlib
+import inspect
+import os
+import shutil
+import sys
+
+import numpy as np
+import utilities
+
+"""
+Cache of simulation results on disk, so that rerunning a notebook or a script only
+computes the results whose inputs have changed.
+
+The results are stored under a key, which is a hash of:
+    the name of the function
+    all the arguments (with the defaults filled in), arrays by their dtype, shape and content,
+        which includes a digest of the interaction matrix V, dense or structured
+    the kernel version: a digest of the source of the module of the function and of the
+        modules of this directory which it imports (directly or through other modules),
+        so that a change of the code does not return results computed by the old code
+
+Only seeded calls are cached, since a call without a seed is not meant to be reproducible.
+
+Every result is a directory <key>/ with one .npy file per returned array, which can be
+memory-mapped when read, and a file "type" with the type of the result: "single" for one
+array or number, "tuple", or "<module> <name>" of a namedtuple, which is rebuilt when read. The entries are written to a temporary directory and renamed,
+so an entry on disk is always complete. When the cache is larger than max_bytes, the least
+recently used entries are removed (the time of the last use is the modification time of
+the entry, which is updated on every hit).
+
+Usage:
+    results = cache.ResultCache("results")
+    metropolis = results.cached(simulation.metropolis)
+    pol, E_array = metropolis(pol, N_s, V, T, seed=1)   # computed
+    pol, E_array = metropolis(pol, N_s, V, T, seed=1)   # read from disk
+
+    # Only the temperatures which are not in the cache are simulated
+    points = [{"T": T} for T in T_array]
+    runs = results.map(simulation.metropolis, points, pol=pol, N_s=N_s, V=V, seed=1)
+"""
+
+# The directory of the simulation modules. The modules in it make up the kernel version
+SOURCE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+# Changed if the layout of the entries changes
+FORMAT_VERSION = 2
+# Rows of a large array hashed at a time, so that memory-mapped matrices are not read at once
+_HASH_BLOCK_BYTES = 2**24
+
+
+def _is_local(module) -> bool:
+    """Whether a module is one of the simulation modules in SOURCE_DIRECTORY"""
+    path = getattr(module, "__file__", None)
+    return path is not None and os.path.dirname(os.path.abspath(path)) == SOURCE_DIRECTORY
+
+
+def _local_modules(module, found: dict) -> None:
+    """Adds a module and the local modules it imports, recursively, to found (name: module)"""
+    found[module.__name__] = module
+    for value in list(vars(module).values()):
+        # Imported modules, and functions and classes imported with from ... import
+        imported = value if inspect.ismodule(value) else inspect.getmodule(value)
+        if imported is not None and imported.__name__ not in found and _is_local(imported):
+            _local_modules(imported, found)
+
+
+@functools.lru_cache(maxsize=None)
+def _module_version(name: str) -> str:
+    """Digest of the source files of a module and of the local modules it imports"""
+    found = {}
+    _local_modules(sys.modules[name], found)
+    hasher = hashlib.blake2b(digest_size=16)
+    for module_name in sorted(found):
+        hasher.update(module_name.encode())
+        path = getattr(found[module_name], "__file__", None)
+        if path is not None:
+            with open(path, "rb") as file:
+                hasher.update(file.read())
+    return hasher.hexdigest()
+
+
+def kernel_version(function) -> str:
+    """Digest of the source files of the module of a function and of the local modules it imports
+
+    Args:
+        function: the simulation function
+
+    Returns:
+        hexadecimal digest
+    """
+    return _module_version(inspect.getmodule(function).__name__)
+
+
+def _update(hasher, value) -> None:
+    """Adds a value (an argument of a simulation) to a hash"""
+    if isinstance(value, utilities.StructuredV):
+        hasher.update(b"StructuredV")
+        for field in value:
+            _update(hasher, field)
+    elif isinstance(value, np.ndarray):
+        hasher.update(f"ndarray {value.dtype.str} {value.shape}".encode())
+        if value.ndim == 0:
+            hasher.update(value.tobytes())
+            return
+        rows = max(1, _HASH_BLOCK_BYTES // max(value[:1].nbytes, 1))
+        for start in range(0, len(value), rows):
+            hasher.update(np.ascontiguousarray(value[start : start + rows]).tobytes())
+    elif isinstance(value, (tuple, list)):
+        hasher.update(f"{type(value).__name__} {len(value)}".encode())
+        for item in value:
+            _update(hasher, item)
+    elif isinstance(value, (bool, np.bool_)):
+        hasher.update(f"bool {bool(value)}".encode())
+    elif isinstance(value, (int, float, np.integer, np.floating)):
+        # T = 150 and T = 150.0 are the same argument
+        value = float(value)
+        hasher.update(f"number {int(value) if value.is_integer() else value!r}".encode())
+    elif value is None or isinstance(value, str):
+        hasher.update(f"{type(value).__name__} {value!r}".encode())
+    else:
+        raise TypeError(f"Can not hash an argument of type {type(value).__name__}")
+
+
+def digest(value) -> str:
+    """Hash of a value, e.g. the interaction matrix V
+
+    Args:
+        value: array, utilities.StructuredV, number, string, None, or tuple/list of these
+
+    Returns:
+        hexadecimal digest
+    """
+    hasher = hashlib.blake2b(digest_size=20)
+    _update(hasher, value)
+    return hasher.hexdigest()
+
+
+class ResultCache:
+    """Cache of the results of the simulation functions in a directory, see the top of the file"""
+
+    def __init__(self, directory: str, max_bytes: int = 2**30, mmap: bool = False):
+        """
+        Args:
+            directory: where the entries are stored. Created if it does not exist
+            max_bytes: largest total size of the entries
+            mmap: if True, the arrays of a hit are memory-mapped (read-only) instead of read
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.mmap = mmap
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, function, *args, **kwargs) -> str:
+        """The key of a call of a function
+
+        Args:
+            function: the simulation function
+            args, kwargs: the arguments of the call
+
+        Returns:
+            the key of the entry
+        """
+        arguments = inspect.signature(function).bind(*args, **kwargs)
+        arguments.apply_defaults()
+        hasher = hashlib.blake2b(digest_size=20)
+        _update(hasher, (f"{function.__module__}.{function.__name__}", FORMAT_VERSION))
+        hasher.update(kernel_version(function).encode())
+        for name, value in arguments.arguments.items():
+            _update(hasher, name)
+            _update(hasher, value)
+        return hasher.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def get(self, key: str):
+        """The result stored under a key, or None if there is none
+
+        Returns:
+            the result as it was given to put
+        """
+        path = self._path(key)
+        try:
+            names = sorted(name for name in os.listdir(path) if name.endswith(".npy"))
+            with open(os.path.join(path, "type")) as file:
+                result_type = file.read()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        mmap_mode = "r" if self.mmap else None
+        items = []
+        for name in names:
+            item = np.load(os.path.join(path, name), mmap_mode=mmap_mode)
+            # Scalars are stored as 0-dimensional arrays
+            items.append(item[()] if item.ndim == 0 else item)
+        if result_type == "single":
+            return items[0]
+        if result_type == "tuple":
+            return tuple(items)
+        # A namedtuple, e.g. wang_landau.WangLandauResult
+        module_name, name = result_type.split()
+        result_class = importlib.import_module(module_name)
+        for part in name.split("."):
+            result_class = getattr(result_class, part)
+        return result_class._make(items)
+
+    def put(self, key: str, result) -> None:
+        """Stores a result (an array, a number, or a tuple or namedtuple of these) under a key,
+        and removes the least recently used entries if the cache is too large"""
+        path = self._path(key)
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        os.makedirs(tmp_path, exist_ok=True)
+        items = result if isinstance(result, tuple) else (result,)
+        for k, item in enumerate(items):
+            np.save(os.path.join(tmp_path, f"{k:03d}.npy"), np.asarray(item))
+        if not isinstance(result, tuple):
+            result_type = "single"
+        elif hasattr(result, "_fields"):
+            result_type = f"{type(result).__module__} {type(result).__qualname__}"
+        else:
+            result_type = "tuple"
+        with open(os.path.join(tmp_path, "type"), "w") as file:
+            file.write(result_type)
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # Another process stored the same result first
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        self.evict()
+
+    def entries(self) -> list[tuple[str, float, int]]:
+        """(key, time of the last use, size in bytes) of every entry, least recently used first"""
+        entries = []
+        for key in os.listdir(self.directory):
+            path = self._path(key)
+            if ".tmp" in key or not os.path.isdir(path):
+                continue
+            try:
+                size = sum(entry.stat().st_size for entry in os.scandir(path))
+                entries.append((key, os.stat(path).st_mtime, size))
+            except FileNotFoundError:
+                # Removed by another process
+                continue
+        return sorted(entries, key=lambda entry: entry[1])
+
+    def size(self) -> int:
+        """Total size of the entries in bytes"""
+        return sum(size for _, _, size in self.entries())
+
+    def evict(self) -> None:
+        """Removes the least recently used entries until the cache is at most max_bytes"""
+        entries = self.entries()
+        total = sum(size for _, _, size in entries)
+        for key, _, size in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(self._path(key), ignore_errors=True)
+            total -= size
+
+    def clear(self) -> None:
+        """Removes every entry"""
+        for key, _, _ in self.entries():
+            shutil.rmtree(self._path(key), ignore_errors=True)
+
+    def call(self, function, *args, **kwargs):
+        """Calls a simulation function, or reads its result from the cache.
+        Calls with seed=None are not cached."""
+        arguments = inspect.signature(function).bind(*args, **kwargs)
+        arguments.apply_defaults()
+        if arguments.arguments.get("seed", None) is None:
+            return function(*args, **kwargs)
+        key = self.key(function, *args, **kwargs)
+        result = self.get(key)
+        if result is not None:
+            self.hits += 1
+            return result
+        self.misses += 1
+        result = function(*args, **kwargs)
+        self.put(key, result)
+        return result
+
+    def cached(self, function):
+        """The function with its results cached, see call"""
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            return self.call(function, *args, **kwargs)
+
+        return wrapper
+
+    def map(self, function, points: list[dict], **common) -> list:
+        """Calls a function for every point of a sweep, computing only the points
+        which are not in the cache
+
+        Args:
+            function: the simulation function
+            points: the arguments which vary, one dict for every point
+            common: the arguments which are the same for every point
+
+        Returns:
+            the result of every point
+        """
+        return [self.call(function, **common, **point) for point in points]
@@ -0,0 +1,161 @@
+import os
+
+import numpy as np
+import accumulator
+import cache
+import lattice
+import polymer
+import rng
+import simulation
+import utilities
+
+"""
+Checkpointing of long Metropolis runs.
+
+The run is split into segments of simulation.metropolis_segment. After every segment the full
+state of the chain is written to a checkpoint file, so a run which is stopped (crash, preemption)
+can be resumed from the last checkpoint, with exactly the same result as an uninterrupted run.
+
+checkpoint (uncompressed .npz): {
+    polymer:     the current polymer
+    E:           the current energy, which is updated incrementally and therefore stored
+    state:       the state of the random number stream, including its buffers of pre-drawn
+                 numbers and the position in them, see rng.py
+    step:        number of steps done, including the initial state (step 0)
+    accumulator: the accumulated observables, see accumulator.py
+    T, diameter: parameters of the run, checked when resuming
+    V:           digest of the interaction matrix (see cache.digest), checked when resuming
+    }
+
+Usage:
+    pol, acc = checkpoint.run_metropolis("run.npz", pol, 10**8, V, T, seed=1)
+"""
+
+
+def save(
+    path: str,
+    pol: np.ndarray,
+    E: float,
+    state: np.ndarray,
+    step: int,
+    acc: np.ndarray,
+    T: float,
+    diameter: bool,
+    V_digest: str,
+) -> None:
+    """Writes a checkpoint atomically: the file is written next to the checkpoint
+    and then renamed, so the checkpoint on disk is always complete, even after a crash.
+
+    Args:
+        path: path of the checkpoint
+        pol: the polymer
+        E: energy of the polymer
+        state: state of the random number stream
+        step: number of steps done
+        acc: the accumulator
+        T: temperature (Kelvin)
+        diameter: True if the shape of the polymer is tracked
+        V_digest: digest of the interaction matrix, see cache.digest
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as file:
+        np.savez(
+            file,
+            polymer=pol,
+            E=np.float64(E),
+            state=state,
+            step=np.int64(step),
+            accumulator=acc,
+            T=np.float64(T),
+            diameter=np.bool_(diameter),
+            V=np.str_(V_digest),
+        )
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+
+
+def load(path: str) -> dict:
+    """Reads a checkpoint
+
+    Args:
+        path: path of the checkpoint
+
+    Returns:
+        dict with the entries of the checkpoint (see the top of the file), as written by save
+    """
+    with np.load(path) as data:
+        return {
+            "polymer": data["polymer"],
+            "E": float(data["E"]),
+            "state": data["state"],
+            "step": int(data["step"]),
+            "accumulator": data["accumulator"],
+            "T": float(data["T"]),
+            "diameter": bool(data["diameter"]),
+            "V": str(data["V"]),
+        }
+
+
+def run_metropolis(
+    path: str,
+    pol: np.ndarray,
+    N_s: int,
+    V: np.ndarray | utilities.StructuredV,
+    T: float,
+    acc: np.ndarray | None = None,
+    diameter: bool = False,
+    seed: int | None = None,
+    segment_steps: int = 1_000_000,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Runs the Metropolis-algorithm in segments, writing a checkpoint after every segment.
+    If the checkpoint already exists, the run is resumed from it instead, and pol, acc and seed
+    are ignored. A finished run can be extended by calling again with a larger N_s.
+
+    Args:
+        path: path of the checkpoint
+        pol: Polymer initial state
+        N_s: Rotation attempts in total, including those done before the checkpoint
+        V: Interaction forces between two monomers, dense or utilities.StructuredV
+        T: Temperature (Kelvin)
+        acc: Accumulator for the observables. A new one (no burn-in, no histogram) if None
+        diameter: Also track the diameter, radius of gyration and end-to-end distance of the polymer
+        seed: seed of the random number stream. Not reproducible if None
+        segment_steps: number of steps between the checkpoints
+
+    Returns:
+        (last polymer, accumulator)
+    """
+    V_digest = cache.digest(V)
+    if os.path.exists(path):
+        checkpoint = load(path)
+        if checkpoint["T"] != T or checkpoint["diameter"] != diameter:
+            raise ValueError(
+                f"The checkpoint {path} was made with T = {checkpoint['T']} and "
+                f"diameter = {checkpoint['diameter']}, not T = {T} and diameter = {diameter}"
+            )
+        if checkpoint["V"] != V_digest:
+            raise ValueError(f"The checkpoint {path} was made with another interaction matrix V")
+        if checkpoint["state"].shape != (rng.STATE_SIZE,):
+            raise ValueError(f"The checkpoint {path} was made with another layout of rng.py")
+        pol = checkpoint["polymer"]
+        E = checkpoint["E"]
+        state = checkpoint["state"]
+        step = checkpoint["step"]
+        acc = checkpoint["accumulator"]
+    else:
+        pol = pol.copy()
+        E = polymer.calculate_energy(pol, V)
+        state = rng.seed_from_global() if seed is None else rng.chain_state(seed, 0)
+        step = 0
+        if acc is None:
+            acc = accumulator.new_accumulator()
+
+    table = lattice.build_lattice(pol)
+    while step < N_s:
+        stop = min(step + segment_steps, N_s)
+        E = simulation.metropolis_segment(pol, E, table, state, step, stop, V, T, acc, diameter)
+        step = stop
+        save(path, pol, E, state, step, acc, T, diameter, V_digest)
+
+    return pol, acc
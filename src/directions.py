@@ -0,0 +1,184 @@
+import numpy as np
+import polymer
+import simulation
+import utilities
+from numba import njit
+
+"""
+Direction (turn) representation of a polymer: the direction of every bond as a uint8 array,
+instead of the coordinates of every monomer. It takes 1 byte per monomer instead of 8,
+and a rotation is a modular add on the bonds of the rotated tail.
+The representation does not store where the polymer is, only its shape.
+
+directions: [d_0, d_1, ..., d_{N-2}], d_k is the direction of the bond from monomer k to k + 1
+direction: 0 = +x, 1 = +y, 2 = -x, 3 = -y
+
+A rotation in the positive direction turns +x into +y, i.e. adds 1 mod 4 to the rotated bonds,
+and a rotation in the negative direction adds 3.
+"""
+
+# Change in coordinates along a bond for each direction
+DIRECTIONS = np.array([[1, 0], [0, 1], [-1, 0], [0, -1]], dtype=np.int32)
+
+
+@njit(cache=True)
+def direction_of(dx: int, dy: int) -> int:
+    """The direction of a bond (dx, dy), which must be one of the unit vectors"""
+    if dx == 1:
+        return 0
+    if dy == 1:
+        return 1
+    if dx == -1:
+        return 2
+    return 3
+
+
+@njit(cache=True)
+def to_directions(polymer: np.ndarray) -> np.ndarray:
+    """Converts the coordinates of a polymer to the direction representation
+
+    Args:
+        polymer: A 2D numpy array with monomer coordinates. Must be intact.
+
+    Returns:
+        array of N - 1 uint8 with the direction of every bond
+    """
+    directions = np.empty(max(len(polymer) - 1, 0), dtype=np.uint8)
+    for k in range(len(directions)):
+        directions[k] = direction_of(
+            polymer[k + 1, 0] - polymer[k, 0], polymer[k + 1, 1] - polymer[k, 1]
+        )
+    return directions
+
+
+@njit(cache=True)
+def to_polymer(directions: np.ndarray, x_0: int = 0, y_0: int = 0) -> np.ndarray:
+    """Converts the direction representation to the coordinates of a polymer
+
+    Args:
+        directions: the direction of every bond
+        x_0: x-coordinate of the first monomer
+        y_0: y-coordinate of the first monomer
+
+    Returns:
+        (N, 2) int32 array with the monomer coordinates
+    """
+    pol = np.empty((len(directions) + 1, 2), dtype=np.int32)
+    pol[0, 0] = x_0
+    pol[0, 1] = y_0
+    for k in range(len(directions)):
+        pol[k + 1, 0] = pol[k, 0] + DIRECTIONS[directions[k], 0]
+        pol[k + 1, 1] = pol[k, 1] + DIRECTIONS[directions[k], 1]
+    return pol
+
+
+@njit(cache=True)
+def generate_flat_directions(polymer_length: int) -> np.ndarray:
+    """The direction representation of polymer.generate_flat_polymer"""
+    return np.zeros(max(polymer_length - 1, 0), dtype=np.uint8)
+
+
+@njit(cache=True)
+def bond_range(polymer_length: int, rotation_center: int) -> tuple[int, int]:
+    """Finds the bonds that turn when rotating around a monomer,
+    the bonds of the monomers given by polymer.rotation_range
+
+    Args:
+        polymer_length: Length of the polymer
+        rotation_center: Which monomer to rotate around
+        `Note: It is not the index, but the monomer_number. [1, N]`
+
+    Returns:
+        (start, stop): the indices [start, stop) of the bonds that turn
+    """
+    start, stop = polymer.rotation_range(polymer_length, rotation_center)
+    if start == 0:
+        return 0, stop
+    return rotation_center - 1, polymer_length - 1
+
+
+@njit(cache=True)
+def rotate_directions_mut(
+    directions: np.ndarray, rotation_center: int, positive_direction: bool = True
+) -> np.ndarray:
+    """Rotates a polymer in the direction representation in place, see polymer.rotate_polymer_mut
+
+    Args:
+        directions: the direction of every bond
+
+        rotation_center: Which monomer to rotate around
+        `Note: It is not the index, but the monomer_number. [1, N]`
+
+        positive_direction: Rotate in the positive direction if True, or negative direction if False
+
+    Returns:
+        the same directions, rotated
+    """
+    start, stop = bond_range(len(directions) + 1, rotation_center)
+    turn = np.uint8(1 if positive_direction else 3)
+    for k in range(start, stop):
+        directions[k] = (directions[k] + turn) & 3
+    return directions
+
+
+@njit(cache=True)
+def rotate_directions(
+    directions: np.ndarray, rotation_center: int, positive_direction: bool = True
+) -> np.ndarray:
+    """Rotates a polymer in the direction representation, see polymer.rotate_polymer
+
+    Returns:
+        a rotated copy of the directions
+    """
+    return rotate_directions_mut(directions.copy(), rotation_center, positive_direction)
+
+
+@njit(cache=True)
+def check_if_intact(directions: np.ndarray) -> bool:
+    """Checks if a polymer in the direction representation is intact. Every bond has length 1,
+    so it is intact if no monomers overlap, which is checked as in polymer.check_if_intact
+
+    Args:
+        directions: the direction of every bond
+
+    Returns:
+        bool: True if polymer is intact
+    """
+    for k in range(len(directions)):
+        if directions[k] > 3:
+            return False
+    return polymer.check_if_intact(to_polymer(directions), len(directions) + 1)
+
+
+@njit(cache=True)
+def calculate_energy(
+    directions: np.ndarray, V: np.ndarray | utilities.StructuredV
+) -> float:
+    """Calculates the energy of a polymer in the direction representation, see polymer.calculate_energy"""
+    return polymer.calculate_energy(to_polymer(directions), V)
+
+
+@njit(cache=True)
+def metropolis(
+    directions: np.ndarray,
+    N_s: int,
+    V: np.ndarray | utilities.StructuredV,
+    T: float,
+    seed: int | None = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Runs the Metropolis-algorithm from a polymer in the direction representation.
+    The moves are checked on the coordinates and the occupancy table (see simulation.metropolis),
+    which only needs the rotated tail, so the polymer is converted once at each end of the run.
+
+    Args:
+        directions: the direction of every bond of the initial polymer
+        N_s: Rotation attempts
+        V: Interaction forces between two monomers
+        T: Temperature (Kelvin)
+        seed: seed of the random number stream. Not reproducible if None
+
+    Returns:
+        (directions of the last polymer created, array with all simulated energies)
+    """
+    pol, E_array = simulation.metropolis(to_polymer(directions), N_s, V, T, seed)
+    return to_directions(pol), E_array
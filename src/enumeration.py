@@ -0,0 +1,335 @@
+from collections import namedtuple
+
+import numpy as np
+import directions
+import reweighting
+import utilities
+from scipy.constants import Boltzmann
+from numba import njit, prange
+
+"""
+Exact enumeration of all the conformations (self-avoiding walks) of short polymers,
+giving the exact density of states and exact thermal averages to check the simulations against.
+
+Symmetry reduction: rotating or mirroring a polymer does not change its energy or diameter.
+Only the walks whose first bond is +x, and whose first turn (if any) is +y are enumerated.
+The straight walk stands for its 4 rotations, every other walk for its 4 rotations and their mirror images.
+
+The walks are split into prefixes (the first bonds), and the walks from every prefix are
+enumerated in parallel, with a depth first search which updates the energy and the diameter
+of the partial walk for every new monomer.
+
+There are about 4 * 2.64^(N - 1) conformations, e.g. 1.3 * 10^9 / 8 for N = 20 after the reduction.
+"""
+
+# The density of states: every (energy, diameter) that occurs, and the number of conformations with it
+DensityOfStates = namedtuple("DensityOfStates", ["energies", "diameters", "degeneracy"])
+
+# Number of bonds in the prefixes, which are enumerated in parallel
+PREFIX_BONDS = 8
+# Largest number of walks which are held in memory at once, before they are merged
+MAX_BUFFER = 2**23
+
+
+def _prefixes(n_bonds: int) -> np.ndarray:
+    """All the symmetry reduced self-avoiding walks with n_bonds bonds
+
+    Returns:
+        (number of walks, n_bonds) uint8 array with the direction of every bond
+    """
+    prefixes = []
+
+    def extend(walk, sites, turned):
+        if len(walk) == n_bonds:
+            prefixes.append(list(walk))
+            return
+        x, y = sites[-1]
+        for d in range(4) if turned else (0, 1):
+            site = (x + directions.DIRECTIONS[d, 0], y + directions.DIRECTIONS[d, 1])
+            if site not in sites:
+                walk.append(d)
+                sites.append(site)
+                extend(walk, sites, turned or d != 0)
+                walk.pop()
+                sites.pop()
+
+    # The first bond is +x
+    extend([0], [(0, 0), (1, 0)], False)
+    return np.array(prefixes, dtype=np.uint8).reshape(-1, n_bonds)
+
+
+@njit(cache=True)
+def _place(
+    grid: np.ndarray,
+    xs: np.ndarray,
+    ys: np.ndarray,
+    E: np.ndarray,
+    D2: np.ndarray,
+    V: np.ndarray | utilities.StructuredV,
+    k: int,
+    x: int,
+    y: int,
+    observables: bool,
+) -> None:
+    """Puts monomer k at (x, y), and finds the energy and squared diameter of monomers 0, ..., k"""
+    grid[x, y] = k
+    xs[k] = x
+    ys[k] = y
+    if not observables:
+        return
+    E[k] = E[k - 1]
+    for d in range(4):
+        j = grid[x + directions.DIRECTIONS[d, 0], y + directions.DIRECTIONS[d, 1]]
+        # Every neighbour on the lattice counts, including the bonded monomer before,
+        # as in polymer.calculate_energy
+        if j != -1:
+            E[k] += utilities.interaction(V, k, j)
+    D2[k] = D2[k - 1]
+    for j in range(k):
+        D2[k] = max(D2[k], (x - xs[j]) ** 2 + (y - ys[j]) ** 2)
+
+
+@njit(cache=True)
+def _enumerate_prefix(
+    prefix: np.ndarray,
+    N: int,
+    V: np.ndarray | utilities.StructuredV,
+    observables: bool,
+    out_E: np.ndarray,
+    out_D2: np.ndarray,
+    out_weight: np.ndarray,
+) -> int:
+    """Enumerates the walks of N monomers which start with a prefix
+
+    Args:
+        prefix: the direction of the first bonds
+        N: number of monomers
+        V: the interaction matrix
+        observables: find the energy and squared diameter of the walks, or only count them
+        out_E: filled with the energy of every walk, if observables
+        out_D2: filled with the squared diameter of every walk, if observables
+        out_weight: filled with the number of conformations every walk stands for, if observables
+
+    Returns:
+        number of walks
+    """
+    # The walk can not leave the grid, and the border stays empty so neighbours can always be looked up
+    grid = np.full((2 * N + 3, 2 * N + 3), -1, dtype=np.int32)
+    xs = np.zeros(N, dtype=np.int64)
+    ys = np.zeros(N, dtype=np.int64)
+    E = np.zeros(N)
+    D2 = np.zeros(N, dtype=np.int64)
+    # turned[k]: the bonds up to monomer k are not all +x
+    turned = np.zeros(N, dtype=np.bool_)
+    # next_direction[k]: the next direction to try for the bond to monomer k
+    next_direction = np.zeros(N + 1, dtype=np.int64)
+
+    xs[0] = ys[0] = N + 1
+    grid[N + 1, N + 1] = 0
+    for k in range(1, len(prefix) + 1):
+        d = prefix[k - 1]
+        x = xs[k - 1] + directions.DIRECTIONS[d, 0]
+        y = ys[k - 1] + directions.DIRECTIONS[d, 1]
+        _place(grid, xs, ys, E, D2, V, k, x, y, observables)
+        turned[k] = turned[k - 1] or d != 0
+
+    depth = len(prefix) + 1
+    n_walks = 0
+    if depth == N:
+        if observables:
+            out_E[0] = E[N - 1]
+            out_D2[0] = D2[N - 1]
+            out_weight[0] = 8 if turned[N - 1] else 4
+        return 1
+
+    k = depth
+    next_direction[k] = 0
+    while True:
+        if next_direction[k] == 4:
+            # Every direction has been tried, so backtrack
+            k -= 1
+            if k < depth:
+                break
+            grid[xs[k], ys[k]] = -1
+            continue
+        d = next_direction[k]
+        next_direction[k] += 1
+        # Mirror symmetry: the first turn is +y
+        if not turned[k - 1] and d > 1:
+            continue
+        x = xs[k - 1] + directions.DIRECTIONS[d, 0]
+        y = ys[k - 1] + directions.DIRECTIONS[d, 1]
+        if grid[x, y] != -1:
+            continue
+        _place(grid, xs, ys, E, D2, V, k, x, y, observables)
+        turned[k] = turned[k - 1] or d != 0
+        if k == N - 1:
+            if observables:
+                out_E[n_walks] = E[k]
+                out_D2[n_walks] = D2[k]
+                out_weight[n_walks] = 8 if turned[k] else 4
+            n_walks += 1
+            grid[x, y] = -1
+        else:
+            k += 1
+            next_direction[k] = 0
+    return n_walks
+
+
+@njit(cache=True)
+def _compact(E: np.ndarray, D2: np.ndarray, weight: np.ndarray) -> int:
+    """Merges the walks with the same energy and diameter, in place
+
+    Returns:
+        number of distinct (energy, squared diameter), which are moved to the front of the arrays
+    """
+    if len(E) == 0:
+        return 0
+    order = np.argsort(D2, kind="mergesort")
+    order = order[np.argsort(E[order], kind="mergesort")]
+    E_sorted = E[order]
+    D2_sorted = D2[order]
+    weight_sorted = weight[order]
+    n = 0
+    E[0] = E_sorted[0]
+    D2[0] = D2_sorted[0]
+    weight[0] = weight_sorted[0]
+    for i in range(1, len(E)):
+        if E_sorted[i] == E[n] and D2_sorted[i] == D2[n]:
+            weight[n] += weight_sorted[i]
+        else:
+            n += 1
+            E[n] = E_sorted[i]
+            D2[n] = D2_sorted[i]
+            weight[n] = weight_sorted[i]
+    return n + 1
+
+
+@njit(parallel=True, cache=True)
+def _count_walks(prefixes: np.ndarray, N: int) -> np.ndarray:
+    """Number of walks from every prefix"""
+    counts = np.zeros(len(prefixes), dtype=np.int64)
+    empty_float = np.zeros(0)
+    empty_int = np.zeros(0, dtype=np.int64)
+    for p in prange(len(prefixes)):
+        counts[p] = _enumerate_prefix(
+            prefixes[p], N, np.zeros((0, 0)), False, empty_float, empty_int, empty_int
+        )
+    return counts
+
+
+@njit(parallel=True, cache=True)
+def _enumerate_batch(
+    prefixes: np.ndarray,
+    offsets: np.ndarray,
+    N: int,
+    V: np.ndarray | utilities.StructuredV,
+    E: np.ndarray,
+    D2: np.ndarray,
+    weight: np.ndarray,
+) -> np.ndarray:
+    """Enumerates the walks from every prefix into E[offsets[p]:offsets[p + 1]], ...,
+    and merges those with the same energy and diameter
+
+    Returns:
+        number of distinct (energy, squared diameter) of every prefix
+    """
+    n_distinct = np.zeros(len(prefixes), dtype=np.int64)
+    for p in prange(len(prefixes)):
+        a = offsets[p]
+        b = offsets[p + 1]
+        _enumerate_prefix(prefixes[p], N, V, True, E[a:b], D2[a:b], weight[a:b])
+        n_distinct[p] = _compact(E[a:b], D2[a:b], weight[a:b])
+    return n_distinct
+
+
+def _merge(
+    E: np.ndarray, D2: np.ndarray, weight: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Merges the entries with the same energy and squared diameter"""
+    order = np.lexsort((D2, E))
+    E, D2, weight = E[order], D2[order], weight[order]
+    starts = np.flatnonzero(
+        np.concatenate(([True], (E[1:] != E[:-1]) | (D2[1:] != D2[:-1])))
+    )
+    return E[starts], D2[starts], np.add.reduceat(weight, starts)
+
+
+def density_of_states(
+    N: int, V: np.ndarray | utilities.StructuredV
+) -> DensityOfStates:
+    """Enumerates all the conformations of a polymer of length N. Feasible up to N of about 20.
+
+    Args:
+        N: length of polymer
+        V: Interaction forces between two monomers, dense or utilities.StructuredV
+
+    Returns:
+        DensityOfStates: every (energy, diameter) of a conformation, and the number
+        of conformations (counting rotations and mirror images) with it
+    """
+    if N <= 1:
+        return DensityOfStates(np.zeros(N), np.zeros(N), np.ones(N, dtype=np.int64))
+
+    prefixes = _prefixes(min(PREFIX_BONDS, N - 1))
+    counts = _count_walks(prefixes, N)
+
+    parts = []
+    start = 0
+    while start < len(prefixes):
+        # The prefixes of the batch, such that the walks fit into the buffer
+        cumulative = np.cumsum(counts[start:])
+        stop = start + max(int(np.searchsorted(cumulative, MAX_BUFFER, side="right")), 1)
+        offsets = np.concatenate(([0], cumulative[: stop - start]))
+        E = np.zeros(offsets[-1])
+        D2 = np.zeros(offsets[-1], dtype=np.int64)
+        weight = np.zeros(offsets[-1], dtype=np.int64)
+        n_distinct = _enumerate_batch(prefixes[start:stop], offsets, N, V, E, D2, weight)
+        keep = np.concatenate(
+            [np.arange(a, a + n) for a, n in zip(offsets[:-1], n_distinct)]
+        )
+        parts.append(_merge(E[keep], D2[keep], weight[keep]))
+        start = stop
+
+    E, D2, weight = _merge(*(np.concatenate(arrays) for arrays in zip(*parts)))
+    return DensityOfStates(E, np.sqrt(D2), weight)
+
+
+def exact_averages(
+    dos: DensityOfStates, T_array: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Exact thermal averages from the density of states
+
+    Args:
+        dos: the density of states, see density_of_states
+        T_array: temperatures (Kelvin)
+
+    Returns:
+        (E_mean, E_std, d_mean, d_std, C_v): arrays with the mean and standard deviation
+        of the energy and the diameter, and the heat capacity, at every temperature
+    """
+    T_array = np.atleast_1d(np.asarray(T_array, dtype=np.float64))
+    weights = reweighting.canonical_weights(np.log(dos.degeneracy), dos.energies, T_array)
+
+    E_mean = weights @ dos.energies
+    E_var = np.maximum(weights @ dos.energies**2 - E_mean**2, 0)
+    d_mean = weights @ dos.diameters
+    d_var = np.maximum(weights @ dos.diameters**2 - d_mean**2, 0)
+    C_v = E_var / (Boltzmann * T_array**2)
+    return E_mean, np.sqrt(E_var), d_mean, np.sqrt(d_var), C_v
+
+
+def log_partition_function(dos: DensityOfStates, T_array: np.ndarray) -> np.ndarray:
+    """The logarithm of the exact partition function, ln Z(T) = ln sum_E g(E) exp(-E / (k_B T))
+
+    Args:
+        dos: the density of states, see density_of_states
+        T_array: temperatures (Kelvin)
+
+    Returns:
+        ln Z at every temperature
+    """
+    T_array = np.atleast_1d(np.asarray(T_array, dtype=np.float64))
+    log_terms = np.log(dos.degeneracy) - dos.energies / (Boltzmann * T_array[:, None])
+    largest = log_terms.max(axis=1)
+    return largest + np.log(np.exp(log_terms - largest[:, None]).sum(axis=1))
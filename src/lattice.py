@@ -0,0 +1,144 @@
+import numpy as np
+from numba import njit
+
+"""
+Occupancy table for the lattice sites of a polymer.
+It is an open-addressing hash table (linear probing) which maps
+a lattice site (x, y) to the index of the monomer occupying it.
+
+table: [
+        key1, index1
+        key2, index2
+        .
+        .
+        .
+        keyM, indexM
+        ]
+
+key = (x, y) packed into one int64. Empty slots have key == EMPTY.
+"""
+
+EMPTY = np.iinfo(np.int64).min
+# Odd 64-bit constant (2^64 / golden ratio) used for multiplicative hashing
+_MULTIPLIER = -7046029254386353131
+
+
+@njit(cache=True)
+def pack(x: int, y: int) -> int:
+    """Packs the coordinates of a lattice site into a single int64
+
+    Args:
+        x: x-coordinate
+        y: y-coordinate
+
+    Returns:
+        the packed key
+    """
+    return (np.int64(x) << 32) | (np.int64(y) & 0xFFFFFFFF)
+
+
+@njit(cache=True)
+def _home_slot(key: int, mask: int) -> int:
+    """The slot a key would occupy if there were no collisions"""
+    return ((key * _MULTIPLIER) >> 32) & mask
+
+
+@njit(cache=True)
+def new_table(N: int) -> np.ndarray:
+    """An empty occupancy table with room for N monomers at a load factor of at most 1/4"""
+    size = 4
+    while size < 4 * N:
+        size *= 2
+    return np.full((size, 2), EMPTY, dtype=np.int64)
+
+
+@njit(cache=True)
+def build_lattice(polymer: np.ndarray) -> np.ndarray:
+    """Builds the occupancy table for a polymer
+
+    Args:
+        polymer: A 2D numpy array with monomer coordinates
+
+    Returns:
+        the occupancy table, with room for all the monomers at a load factor of at most 1/4
+    """
+    N = len(polymer)
+    table = new_table(N)
+    for i in range(N):
+        insert(table, polymer[i, 0], polymer[i, 1], i)
+    return table
+
+
+@njit(cache=True)
+def lookup(table: np.ndarray, x: int, y: int) -> int:
+    """Finds the monomer occupying a lattice site
+
+    Args:
+        table: occupancy table
+        x: x-coordinate of the site
+        y: y-coordinate of the site
+
+    Returns:
+        index of the monomer at (x, y), or -1 if the site is empty
+    """
+    key = pack(x, y)
+    mask = len(table) - 1
+    slot = _home_slot(key, mask)
+    while table[slot, 0] != EMPTY:
+        if table[slot, 0] == key:
+            return table[slot, 1]
+        slot = (slot + 1) & mask
+    return -1
+
+
+@njit(cache=True)
+def insert(table: np.ndarray, x: int, y: int, index: int) -> None:
+    """Marks a lattice site as occupied by a monomer.
+    If the site is already occupied, the monomer index is overwritten.
+
+    Args:
+        table: occupancy table
+        x: x-coordinate of the site
+        y: y-coordinate of the site
+        index: index of the monomer
+    """
+    key = pack(x, y)
+    mask = len(table) - 1
+    slot = _home_slot(key, mask)
+    while table[slot, 0] != EMPTY and table[slot, 0] != key:
+        slot = (slot + 1) & mask
+    table[slot, 0] = key
+    table[slot, 1] = index
+
+
+@njit(cache=True)
+def remove(table: np.ndarray, x: int, y: int) -> None:
+    """Marks a lattice site as empty
+
+    Args:
+        table: occupancy table
+        x: x-coordinate of the site
+        y: y-coordinate of the site
+    """
+    key = pack(x, y)
+    mask = len(table) - 1
+    hole = _home_slot(key, mask)
+    while table[hole, 0] != key:
+        if table[hole, 0] == EMPTY:
+            return
+        hole = (hole + 1) & mask
+
+    # Backward shift deletion: move later entries of the probe sequence into the hole,
+    # so that lookups never stop too early. No tombstones are needed.
+    slot = (hole + 1) & mask
+    while table[slot, 0] != EMPTY:
+        home = _home_slot(table[slot, 0], mask)
+        # The entry can be moved if the hole lies (cyclically) between its home slot and its slot
+        if ((slot - home) & mask) >= ((slot - hole) & mask):
+            table[hole, 0] = table[slot, 0]
+            table[hole, 1] = table[slot, 1]
+            hole = slot
+        slot = (slot + 1) & mask
+    table[hole, 0] = EMPTY
+    table[hole, 1] = EMPTY
+
@@ -0,0 +1,424 @@
+import numpy as np
+import accumulator
+import lattice
+import polymer
+import rng
+import utilities
+from scipy.constants import Boltzmann
+from numba import njit
+
+"""
+Local moves and a move scheduler for the Metropolis-algorithm.
+
+The rotations (pivots) of polymer.py move a whole tail, and most of them break a long polymer.
+The local moves only move a few monomers, so they are cheap to check and are mostly valid:
+
+    END:        moves an end monomer to another free site next to its neighbour
+    CORNER:     flips a monomer in a corner (i - 1 and i + 1 diagonal) to the opposite corner
+    CRANKSHAFT: flips two monomers in a U-turn (i - 1 and i + 2 adjacent) to the other side
+    PULL:       moves a monomer to a free site diagonal to it, next to one of its neighbours,
+                and pulls the chain behind it along until it is connected again (Lesh et al. 2003).
+                The pull moves alone can reach every conformation.
+
+Every step, the scheduler draws a move type with the given weights, draws a move of that type,
+and rejects it if it breaks the polymer, or else accepts it with the Metropolis criterion.
+A move which breaks the polymer is a rejected step (and not drawn again), so that the moves
+sample the Boltzmann distribution exactly. Statistics of every move type are kept in an array
+
+stats: [
+        [attempted, valid, accepted]   <- PIVOT
+        [attempted, valid, accepted]   <- END
+        ...
+        ]
+"""
+
+PIVOT = 0
+END = 1
+CORNER = 2
+CRANKSHAFT = 3
+PULL = 4
+MOVE_NAMES = ("pivot", "end", "corner", "crankshaft", "pull")
+N_MOVES = len(MOVE_NAMES)
+
+ATTEMPTED = 0
+VALID = 1
+ACCEPTED = 2
+
+# Pivots change the shape of the polymer fast, the local moves keep the acceptance high
+DEFAULT_WEIGHTS = np.array([0.1, 0.1, 0.2, 0.2, 0.4])
+
+_NEIGHBOURS = np.array([[1, 0], [0, 1], [-1, 0], [0, -1]], dtype=np.int64)
+
+
+@njit(cache=True)
+def _is_free(table: np.ndarray, x: int, y: int) -> bool:
+    return lattice.lookup(table, x, y) == -1
+
+
+@njit(cache=True)
+def _range_energy(
+    pol: np.ndarray, V: np.ndarray | utilities.StructuredV, table: np.ndarray, a: int, b: int
+) -> float:
+    """Energy of all the contacts of the monomers [a, b), counting the contacts within the range once"""
+    energy = 0.0
+    for i in range(a, b):
+        for k in range(4):
+            j = lattice.lookup(table, pol[i, 0] + _NEIGHBOURS[k, 0], pol[i, 1] + _NEIGHBOURS[k, 1])
+            if j != -1 and (j < a or j >= b or j > i):
+                energy += utilities.interaction(V, i, j)
+    return energy
+
+
+@njit(cache=True)
+def _set_range(
+    pol: np.ndarray, table: np.ndarray, a: int, b: int, sites: np.ndarray
+) -> None:
+    """Moves the monomers [a, b) to sites[a:b], and updates the occupancy table"""
+    for i in range(a, b):
+        lattice.remove(table, pol[i, 0], pol[i, 1])
+    for i in range(a, b):
+        pol[i, 0] = sites[i, 0]
+        pol[i, 1] = sites[i, 1]
+        lattice.insert(table, pol[i, 0], pol[i, 1], i)
+
+
+@njit(cache=True)
+def _local_metropolis(
+    pol: np.ndarray,
+    V: np.ndarray | utilities.StructuredV,
+    T: float,
+    table: np.ndarray,
+    state: np.ndarray,
+    a: int,
+    b: int,
+    new_sites: np.ndarray,
+    old_sites: np.ndarray,
+) -> tuple[bool, float]:
+    """Moves the monomers [a, b) to new_sites[a:b], and moves them back if the Metropolis criterion
+    rejects the move. The new sites must keep the polymer intact.
+
+    Returns:
+        (True if the move was accepted, change in energy)
+    """
+    E_old = _range_energy(pol, V, table, a, b)
+    old_sites[a:b] = pol[a:b]
+    _set_range(pol, table, a, b, new_sites)
+    delta_E = _range_energy(pol, V, table, a, b) - E_old
+    if delta_E < 0 or rng.draw_acceptance(state) < np.exp(-delta_E / (T * Boltzmann)):
+        return True, delta_E
+    _set_range(pol, table, a, b, old_sites)
+    return False, 0.0
+
+
+@njit(cache=True)
+def propose_end(
+    pol: np.ndarray, table: np.ndarray, state: np.ndarray, new_sites: np.ndarray
+) -> tuple[int, int]:
+    """Draws an end move
+
+    Returns:
+        (a, b): the monomers [a, b) which move, to new_sites[a:b], or (0, 0) if the move breaks the polymer
+    """
+    N = len(pol)
+    end = 0 if rng.uniform(state) < 0.5 else N - 1
+    neighbour = 1 if end == 0 else N - 2
+    k = rng.randint(state, 0, 4)
+    x = pol[neighbour, 0] + _NEIGHBOURS[k, 0]
+    y = pol[neighbour, 1] + _NEIGHBOURS[k, 1]
+    if not _is_free(table, x, y):
+        return 0, 0
+    new_sites[end, 0] = x
+    new_sites[end, 1] = y
+    return end, end + 1
+
+
+@njit(cache=True)
+def propose_corner(
+    pol: np.ndarray, table: np.ndarray, state: np.ndarray, new_sites: np.ndarray
+) -> tuple[int, int]:
+    """Draws a corner flip. See propose_end"""
+    i = rng.randint(state, 1, len(pol) - 1)
+    if pol[i - 1, 0] == pol[i + 1, 0] or pol[i - 1, 1] == pol[i + 1, 1]:
+        # The neighbours are on a straight line, so monomer i is not in a corner
+        return 0, 0
+    x = pol[i - 1, 0] + pol[i + 1, 0] - pol[i, 0]
+    y = pol[i - 1, 1] + pol[i + 1, 1] - pol[i, 1]
+    if not _is_free(table, x, y):
+        return 0, 0
+    new_sites[i, 0] = x
+    new_sites[i, 1] = y
+    return i, i + 1
+
+
+@njit(cache=True)
+def propose_crankshaft(
+    pol: np.ndarray, table: np.ndarray, state: np.ndarray, new_sites: np.ndarray
+) -> tuple[int, int]:
+    """Draws a crankshaft move of monomers i and i + 1. See propose_end"""
+    i = rng.randint(state, 1, len(pol) - 2)
+    # The U-turn i - 1, i, i + 1, i + 2: both monomers are one step v away from the ends of the U
+    vx = pol[i, 0] - pol[i - 1, 0]
+    vy = pol[i, 1] - pol[i - 1, 1]
+    if pol[i + 1, 0] - pol[i + 2, 0] != vx or pol[i + 1, 1] - pol[i + 2, 1] != vy:
+        return 0, 0
+    if abs(pol[i + 2, 0] - pol[i - 1, 0]) + abs(pol[i + 2, 1] - pol[i - 1, 1]) != 1:
+        return 0, 0
+    for j in (i, i + 1):
+        new_sites[j, 0] = pol[j, 0] - 2 * vx
+        new_sites[j, 1] = pol[j, 1] - 2 * vy
+        if not _is_free(table, new_sites[j, 0], new_sites[j, 1]):
+            return 0, 0
+    return i, i + 2
+
+
+@njit(cache=True)
+def _pull(
+    pol: np.ndarray, table: np.ndarray, i: int, step: int, side: int, new_sites: np.ndarray
+) -> tuple[int, int]:
+    """The pull move of monomer i, see propose_pull
+
+    Args:
+        i: the monomer which moves to L
+        step: direction along the chain (1 or -1) of the monomers which are pulled
+        side: which of the two sites next to the neighbour k = i - step is L (1 or -1)
+
+    Returns:
+        (a, b): the monomers [a, b) which move, to new_sites[a:b], or (0, 0) if the move breaks the polymer
+    """
+    N = len(pol)
+    k = i - step
+    if k < 0 or k >= N:
+        return 0, 0
+    # u: perpendicular to the bond from k to i
+    ux = -(pol[i, 1] - pol[k, 1]) * side
+    uy = (pol[i, 0] - pol[k, 0]) * side
+    if not _is_free(table, pol[k, 0] + ux, pol[k, 1] + uy):
+        return 0, 0
+    new_sites[i, 0] = pol[k, 0] + ux
+    new_sites[i, 1] = pol[k, 1] + uy
+
+    previous = i + step
+    if previous < 0 or previous >= N:
+        # An end monomer is pulled, nothing follows
+        return i, i + 1
+    C_x = pol[i, 0] + ux
+    C_y = pol[i, 1] + uy
+    if pol[previous, 0] == C_x and pol[previous, 1] == C_y:
+        return i, i + 1
+    if not _is_free(table, C_x, C_y):
+        return 0, 0
+    new_sites[previous, 0] = C_x
+    new_sites[previous, 1] = C_y
+
+    j = previous + step
+    while 0 <= j < N:
+        if abs(pol[j, 0] - new_sites[j - step, 0]) + abs(pol[j, 1] - new_sites[j - step, 1]) == 1:
+            break
+        new_sites[j, 0] = pol[j - 2 * step, 0]
+        new_sites[j, 1] = pol[j - 2 * step, 1]
+        j += step
+    # The moved monomers are i, i + step, ..., j - step
+    if step == 1:
+        return i, j
+    return j + 1, i + 1
+
+
+@njit(cache=True)
+def propose_pull(
+    pol: np.ndarray,
+    table: np.ndarray,
+    state: np.ndarray,
+    new_sites: np.ndarray,
+    old_sites: np.ndarray,
+    reverse_sites: np.ndarray,
+) -> tuple[int, int]:
+    """Draws a pull move. See propose_end
+
+    Monomer i moves to a free site L, next to its neighbour k (i + 1 or i - 1) and diagonal to i.
+    The site C next to both L and the old site of i must be free, or be the site of the monomer
+    before i (seen from k), in which case only i moves. Otherwise the monomer before i moves to C,
+    and every monomer further back moves to the old site of the monomer two places ahead of it,
+    until the chain is connected again.
+
+    The pull in the opposite direction from the last pulled monomer usually undoes the move,
+    but not always (e.g. if the pull reaches the end of the chain). The moves which can not be
+    undone are rejected, so that every move is as likely as its reverse, as detailed balance needs.
+    """
+    i = rng.randint(state, 0, len(pol))
+    step = -1 if rng.uniform(state) < 0.5 else 1
+    side = 1 if rng.uniform(state) < 0.5 else -1
+    a, b = _pull(pol, table, i, step, side, new_sites)
+    if b - a <= 1:
+        # A single monomer is moved back by the same kind of move
+        return a, b
+
+    last = a if step == -1 else b - 1
+    old_sites[a:b] = pol[a:b]
+    _set_range(pol, table, a, b, new_sites)
+    reversible = False
+    for reverse_side in (1, -1):
+        reverse_a, reverse_b = _pull(pol, table, last, -step, reverse_side, reverse_sites)
+        if reverse_a == a and reverse_b == b and np.all(reverse_sites[a:b] == old_sites[a:b]):
+            reversible = True
+    _set_range(pol, table, a, b, old_sites)
+    if not reversible:
+        return 0, 0
+    return a, b
+
+
+@njit(cache=True)
+def move_step(
+    pol: np.ndarray,
+    V: np.ndarray | utilities.StructuredV,
+    T: float,
+    E: float,
+    table: np.ndarray,
+    state: np.ndarray,
+    cumulative_weights: np.ndarray,
+    stats: np.ndarray,
+    new_sites: np.ndarray,
+    old_sites: np.ndarray,
+    reverse_sites: np.ndarray,
+) -> tuple[bool, float]:
+    """Performs one step of the Metropolis-algorithm with a move drawn by the scheduler, in place
+
+    Args:
+        pol: Polymer, changed in place if the move is accepted
+        V: Interaction forces between two monomers, dense or utilities.StructuredV
+        T: Temperature (Kelvin)
+        E: Energy of the polymer
+        table: Occupancy table of the polymer, see lattice.build_lattice
+        state: Random number stream of the chain, see rng.py
+        cumulative_weights: cumulative probabilities of the move types, ending with 1
+        stats: (N_MOVES, 3) statistics of the move types, updated in place
+        new_sites, old_sites, reverse_sites: (N, 2) scratch arrays
+
+    Returns:
+        (True if the move was accepted, energy of the polymer after the step)
+    """
+    N = len(pol)
+    r = rng.uniform(state)
+    move = 0
+    while move < N_MOVES - 1 and r >= cumulative_weights[move]:
+        move += 1
+    stats[move, ATTEMPTED] += 1
+
+    if move == PIVOT:
+        rotation_center = rng.draw_pivot(state, 2, N)
+        positive_direction = rng.draw_direction(state)
+        if not polymer.check_if_intact_rotated(pol, rotation_center, positive_direction, table):
+            return False, E
+        stats[move, VALID] += 1
+        delta_E = polymer.energy_delta(pol, V, rotation_center, positive_direction, table)
+        if delta_E < 0 or rng.draw_acceptance(state) < np.exp(-delta_E / (T * Boltzmann)):
+            polymer.apply_rotation(pol, rotation_center, positive_direction, table)
+            stats[move, ACCEPTED] += 1
+            return True, E + delta_E
+        return False, E
+
+    if move == END:
+        a, b = propose_end(pol, table, state, new_sites)
+    elif move == CORNER:
+        a, b = propose_corner(pol, table, state, new_sites)
+    elif move == CRANKSHAFT:
+        a, b = propose_crankshaft(pol, table, state, new_sites)
+    else:
+        a, b = propose_pull(pol, table, state, new_sites, old_sites, reverse_sites)
+    if a == b:
+        return False, E
+    stats[move, VALID] += 1
+    accepted, delta_E = _local_metropolis(pol, V, T, table, state, a, b, new_sites, old_sites)
+    stats[move, ACCEPTED] += accepted
+    return accepted, E + delta_E
+
+
+@njit(cache=True)
+def _metropolis_moves(
+    pol: np.ndarray,
+    N_s: int,
+    V: np.ndarray | utilities.StructuredV,
+    T: float,
+    cumulative_weights: np.ndarray,
+    state: np.ndarray,
+    acc: np.ndarray,
+    E_trace: np.ndarray | None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """See metropolis_moves"""
+    pol = pol.copy()
+    table = lattice.build_lattice(pol)
+    E = polymer.calculate_energy(pol, V)
+    stats = np.zeros((N_MOVES, 3), dtype=np.int64)
+    new_sites = np.zeros((len(pol), 2), dtype=np.int64)
+    old_sites = np.zeros((len(pol), 2), dtype=np.int64)
+    reverse_sites = np.zeros((len(pol), 2), dtype=np.int64)
+    accepted = False
+    for i in range(N_s):
+        if i > 0:
+            accepted, E = move_step(
+                pol,
+                V,
+                T,
+                E,
+                table,
+                state,
+                cumulative_weights,
+                stats,
+                new_sites,
+                old_sites,
+                reverse_sites,
+            )
+        accumulator.observe(acc, E, np.nan, accepted)
+        if E_trace is not None:
+            E_trace[i] = E
+    return pol, stats
+
+
+def metropolis_moves(
+    pol: np.ndarray,
+    N_s: int,
+    V: np.ndarray | utilities.StructuredV,
+    T: float,
+    weights: np.ndarray = DEFAULT_WEIGHTS,
+    seed: int | None = None,
+    acc: np.ndarray | None = None,
+    E_trace: np.ndarray | None = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Runs the Metropolis-algorithm with pivots and local moves,
+    streaming the observables into an accumulator. Only O(N) memory is used,
+    unless the full trace is asked for.
+
+    Args:
+        pol: Polymer initial state
+        N_s: Number of steps, including the initial state as in simulation.metropolis
+        V: Interaction forces between two monomers, dense or utilities.StructuredV
+        T: Temperature (Kelvin)
+        weights: relative probabilities of PIVOT, END, CORNER, CRANKSHAFT and PULL
+        seed: seed of the random number stream. Not reproducible if None
+        acc: Accumulator for the observables, updated in place. A new one if None
+        E_trace: Optional array of length N_s which is filled with the energy of every step
+
+    Returns:
+        (last polymer, (N_MOVES, 3) statistics of the moves)
+    """
+    if len(pol) < 4:
+        raise ValueError("The moves need a polymer of at least 4 monomers")
+    weights = np.asarray(weights, dtype=np.float64)
+    if len(weights) != N_MOVES or np.any(weights < 0) or weights.sum() == 0:
+        raise ValueError(f"weights must be {N_MOVES} non-negative numbers, not all 0")
+    state = rng.seed_from_global() if seed is None else rng.chain_state(seed, 0)
+    if acc is None:
+        acc = accumulator.new_accumulator()
+    return _metropolis_moves(
+        pol, N_s, V, T, np.cumsum(weights) / weights.sum(), state, acc, E_trace
+    )
+
+
+def move_statistics(stats: np.ndarray) -> str:
+    """A table of the number of attempts, and the fraction which were valid and accepted, of every move type"""
+    lines = [f"{'move':<12}{'attempted':>12}{'valid':>10}{'accepted':>10}"]
+    for name, (attempted, valid, accepted) in zip(MOVE_NAMES, stats):
+        attempted_ = max(attempted, 1)
+        lines.append(
+            f"{name:<12}{attempted:>12}{valid / attempted_:>10.3f}{accepted / attempted_:>10.3f}"
+        )
+    return "\n".join(lines)
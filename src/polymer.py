@@ -1,5 +1,6 @@
 import numpy as np
 from numba import njit
+import lattice
 import utilities
 import visualization
 
@@ -15,6 +16,10 @@ polymer: [
           ]
 """
 
+# Largest bounding box (in cells per monomer) which check_if_intact marks on a bitmap.
+# A bitmap cell takes 1 byte and the occupancy table 64 bytes per monomer
+BITMAP_CELLS_PER_MONOMER = 64
+
 
 def check_if_intact_1(polymer: np.ndarray, polymer_length: int) -> bool:
     """Checks if polymer is intact
@@ -91,8 +96,8 @@ def check_if_intact_2(polymer: np.ndarray, polymer_length: int) -> bool:
     return True
 
 
-@njit
-def check_if_intact(polymer: np.ndarray, polymer_length: int) -> bool:
+@njit(cache=True)
+def check_if_intact_4(polymer: np.ndarray, polymer_length: int) -> bool:
     """Checks if polymer is intact
 
     Args:
@@ -136,62 +141,151 @@ def check_if_intact(polymer: np.ndarray, polymer_length: int) -> bool:
     return True
 
 
-@njit
-def rotate_polymer(
-    polymer: np.ndarray, rotation_center: int, positive_direction: bool = True
-) -> np.ndarray:
-    """Rotates a polymer in the given direction around a monomer
+@njit(cache=True)
+def check_if_intact(polymer: np.ndarray, polymer_length: int) -> bool:
+    """Checks if polymer is intact.
+    Overlaps are found by marking the monomers on a bitmap of the bounding box of the polymer
+    if the bounding box has at most BITMAP_CELLS_PER_MONOMER * N cells (compact polymers),
+    and on an occupancy table (see lattice.py) otherwise, so the work and the memory are
+    proportional to the length of the polymer for any shape.
 
     Args:
-        polymer: A 2D numpy array with monomer coordinates
+        polymer (np.ndarray): polymer that is checked
+        polymer_length (int): length of the polymer
+
+    Returns:
+        bool: True if polymer is intact
+    """
+    if len(polymer) != polymer_length:
+        return False
+    if polymer_length == 0:
+        return True
+
+    x_min = x_max = polymer[0, 0]
+    y_min = y_max = polymer[0, 1]
+    for i in range(1, polymer_length):
+        if (
+            abs(polymer[i, 0] - polymer[i - 1, 0])
+            + abs(polymer[i, 1] - polymer[i - 1, 1])
+            != 1
+        ):
+            return False
+        x_min = min(x_min, polymer[i, 0])
+        x_max = max(x_max, polymer[i, 0])
+        y_min = min(y_min, polymer[i, 1])
+        y_max = max(y_max, polymer[i, 1])
+
+    width = np.int64(x_max - x_min + 1)
+    height = np.int64(y_max - y_min + 1)
+    if width * height > BITMAP_CELLS_PER_MONOMER * polymer_length:
+        # The bounding box of a stretched polymer can have up to N^2 / 4 cells
+        table = lattice.new_table(polymer_length)
+        for i in range(polymer_length):
+            if lattice.lookup(table, polymer[i, 0], polymer[i, 1]) != -1:
+                return False
+            lattice.insert(table, polymer[i, 0], polymer[i, 1], i)
+        return True
+
+    occupied = np.zeros((width, height), dtype=np.bool_)
+    for i in range(polymer_length):
+        x = polymer[i, 0] - x_min
+        y = polymer[i, 1] - y_min
+        if occupied[x, y]:
+            return False
+        occupied[x, y] = True
+    return True
+
+
+@njit(cache=True)
+def rotation_range(polymer_length: int, rotation_center: int) -> tuple[int, int]:
+    """Finds the monomers that move when rotating around a monomer
+
+    Args:
+        polymer_length: Length of the polymer
+        rotation_center: Which monomer to rotate around
+        `Note: It is not the index, but the monomer_number. [1, N]`
+
+    Returns:
+        (start, stop): the indices [start, stop) of the monomers that move
+    """
+    # The shortest tail of the polymer is rotated
+    if rotation_center >= polymer_length / 2:
+        return rotation_center, polymer_length
+    # The rotation center itself does not move
+    return 0, rotation_center - 1
+
+
+@njit(cache=True)
+def _rotate_site(
+    x: int, y: int, x_s: int, y_s: int, direction: int
+) -> tuple[int, int]:
+    """Rotates the lattice site (x, y) a quarter turn around (x_s, y_s). See rotate_polymer"""
+    return x_s - (y - y_s) * direction, y_s + (x - x_s) * direction
+
+
+@njit(cache=True)
+def check_if_intact_rotated(
+    polymer: np.ndarray,
+    rotation_center: int,
+    positive_direction: bool,
+    table: np.ndarray,
+) -> bool:
+    """Checks if an intact polymer is still intact after a rotation, without rotating it.
+    A rotation keeps the bonds and the shape of the tail, so only the new sites of the tail
+    have to be checked against the rest of the polymer. Stops at the first overlap.
+
+    Args:
+        polymer: A 2D numpy array with monomer coordinates. Must be intact.
 
         rotation_center: Which monomer to rotate around
         `Note: It is not the index, but the monomer_number. [1, N]`
 
         positive_direction: Rotate in the positive direction if True, or negative direction if False
 
+        table: The occupancy table of the polymer, see lattice.build_lattice
+
     Returns:
-        a rotated copy of the polymer
+        bool: True if the rotated polymer is intact
     """
-    # Make a slicing array to rotate the correct end of the polymer
-    rotation_slice = np.full(len(polymer), False)
+    start, stop = rotation_range(len(polymer), rotation_center)
+    direction = 1 if positive_direction else -1
+    x_s = polymer[rotation_center - 1, 0]
+    y_s = polymer[rotation_center - 1, 1]
+    for i in range(start, stop):
+        new_x, new_y = _rotate_site(polymer[i, 0], polymer[i, 1], x_s, y_s, direction)
+        j = lattice.lookup(table, new_x, new_y)
+        # The new site may only be occupied by a monomer which is rotated away from it
+        if j != -1 and (j < start or j >= stop):
+            return False
+    return True
 
-    # Choose to rotate the shortest tail of the polymer
-    if rotation_center >= len(polymer) / 2:
-        rotation_slice[rotation_center:] = True
-    else:
-        rotation_slice[:rotation_center] = True
 
-    if positive_direction:
-        direction = 1
-    else:
-        direction = -1
+@njit(cache=True)
+def rotate_polymer(
+    polymer: np.ndarray, rotation_center: int, positive_direction: bool = True
+) -> np.ndarray:
+    """Rotates a polymer in the given direction around a monomer
 
-    # The coordinates in space of the rotation center
-    rotation_position = polymer[rotation_center - 1]
+    Args:
+        polymer: A 2D numpy array with monomer coordinates
 
-    # Where _rel means the position relative to the rotation center
-    # new_x = x_s + new_x_rel
-    # new_y = y_s + new_y_rel
-    # new_x_rel = - (y - y_s) * direction
-    # new_y_rel = (x - x_s) * direction
-    new_pos_rel = ((polymer[rotation_slice] - rotation_position) * direction)[:, ::-1]
-    new_pos_rel[:, 0] *= -1  # Changes the sign of the x-values
+        rotation_center: Which monomer to rotate around
+        `Note: It is not the index, but the monomer_number. [1, N]`
 
-    # Makes a copy of the polymer
-    # TODO: om lettere å mutere for så å mutere tilbake igjen
-    # new_polymer = polymer[:]
-    new_polymer = polymer.copy()
+        positive_direction: Rotate in the positive direction if True, or negative direction if False
 
-    new_polymer[rotation_slice] = rotation_position + new_pos_rel
-    return new_polymer
+    Returns:
+        a rotated copy of the polymer
+    """
+    return rotate_polymer_mut(polymer.copy(), rotation_center, positive_direction)
 
 
-@njit
+@njit(cache=True)
 def rotate_polymer_mut(
     polymer: np.ndarray, rotation_center: int, positive_direction: bool = True
 ) -> np.ndarray:
-    """Rotates a polymer in the given direction around a monomer
+    """Rotates a polymer in the given direction around a monomer, in place.
+    Rotating around the same monomer in the opposite direction undoes the rotation.
 
     Args:
         polymer: A 2D numpy array with monomer coordinates
@@ -202,16 +296,10 @@ def rotate_polymer_mut(
         positive_direction: Rotate in the positive direction if True, or negative direction if False
 
     Returns:
-        a rotated copy of the polymer
+        the same polymer, rotated
     """
-    # Make a slicing array to rotate the correct end of the polymer
-    rotation_slice = np.full(len(polymer), False)
-
     # Choose to rotate the shortest tail of the polymer
-    if rotation_center >= len(polymer) / 2:
-        rotation_slice[rotation_center:] = True
-    else:
-        rotation_slice[:rotation_center] = True
+    start, stop = rotation_range(len(polymer), rotation_center)
 
     if positive_direction:
         direction = 1
@@ -219,45 +307,78 @@ def rotate_polymer_mut(
         direction = -1
 
     # The coordinates in space of the rotation center
-    rotation_position = polymer[rotation_center - 1]
+    x_s = polymer[rotation_center - 1, 0]
+    y_s = polymer[rotation_center - 1, 1]
+
+    # new_x = x_s - (y - y_s) * direction
+    # new_y = y_s + (x - x_s) * direction
+    for i in range(start, stop):
+        polymer[i, 0], polymer[i, 1] = _rotate_site(
+            polymer[i, 0], polymer[i, 1], x_s, y_s, direction
+        )
+    return polymer
 
-    # Where _rel means the position relative to the rotation center
-    # new_x = x_s + new_x_rel
-    # new_y = y_s + new_y_rel
-    # new_x_rel = - (y - y_s) * direction
-    # new_y_rel = (x - x_s) * direction
-    new_pos_rel = ((polymer[rotation_slice] - rotation_position) * direction)[:, ::-1]
-    new_pos_rel[:, 0] *= -1  # Changes the sign of the x-values
 
-    polymer[rotation_slice] = rotation_position + new_pos_rel
-    return polymer
+@njit(cache=True)
+def apply_rotation(
+    polymer: np.ndarray,
+    rotation_center: int,
+    positive_direction: bool,
+    table: np.ndarray,
+) -> None:
+    """Rotates a polymer in place and updates its occupancy table.
+    Meant to be used after check_if_intact_rotated (and energy_delta) has accepted the move,
+    so that rejected moves never touch the polymer and do not have to be undone.
+
+    Args:
+        polymer: A 2D numpy array with monomer coordinates
 
+        rotation_center: Which monomer to rotate around
+        `Note: It is not the index, but the monomer_number. [1, N]`
+
+        positive_direction: Rotate in the positive direction if True, or negative direction if False
+
+        table: The occupancy table of the polymer, see lattice.build_lattice
+    """
+    start, stop = rotation_range(len(polymer), rotation_center)
+    # Everything is removed before inserting, since a new site can be the old site of another rotated monomer
+    for i in range(start, stop):
+        lattice.remove(table, polymer[i, 0], polymer[i, 1])
+    rotate_polymer_mut(polymer, rotation_center, positive_direction)
+    for i in range(start, stop):
+        lattice.insert(table, polymer[i, 0], polymer[i, 1], i)
 
-@njit
+
+@njit(cache=True)
 def generate_flat_polymer(
-    polymer_length: int, mid_of_polymer: np.ndarray = np.zeros(2)
+    polymer_length: int, mid_of_polymer: np.ndarray | None = None
 ) -> np.ndarray:
     """Generates a horizontal polymer with N (polymer_length) monomers
 
     Args:
         polymer_length (int): Number of monomers
-        mid_of_polymer (np.ndarray, optional): The coordinates of the center monomer. Defaults to np.zeros(2).
+        mid_of_polymer (np.ndarray, optional): The coordinates of the center monomer. Defaults to the origin.
 
     Returns:
         np.ndarray: the generated polymer
     """
+    # A None default instead of an array, since numba can not reuse the on-disk cache
+    # for array defaults and would compile the function again in every process
+    mid_x, mid_y = 0, 0
+    if mid_of_polymer is not None:
+        mid_x, mid_y = int(mid_of_polymer[0]), int(mid_of_polymer[1])
     polymer_array = np.zeros((polymer_length, 2), dtype=np.int32)
-    polymer_start = -int(polymer_length / 2) + mid_of_polymer[0]
+    polymer_start = -int(polymer_length / 2) + mid_x
     # + 1/2 to handle even numbers
-    polymer_end = int((polymer_length + 1) / 2) + mid_of_polymer[0]
-    polymer_array[:, 1] = mid_of_polymer[1]
+    polymer_end = int((polymer_length + 1) / 2) + mid_x
+    polymer_array[:, 1] = mid_y
     polymer_array[:, 0] = np.arange(polymer_start, polymer_end, 1, dtype=np.int32)
 
     return polymer_array
 
 
 # The function can, (and should?), be JIT-compiled by numba.
-@njit()
+@njit(cache=True)
 def calculate_energy_1(polymer: np.ndarray, V: np.ndarray) -> float:
     """Calculates the energy of the given polymer.
 
@@ -287,8 +408,8 @@ def calculate_energy_1(polymer: np.ndarray, V: np.ndarray) -> float:
     return float(np.sum(V * b))
 
 
-@njit
-def calculate_energy(polymer: np.ndarray, V: np.ndarray) -> float:
+@njit(cache=True)
+def calculate_energy_2(polymer: np.ndarray, V: np.ndarray) -> float:
     """Calculates the energy of the given polymer.
 
      Args:
@@ -310,6 +431,90 @@ def calculate_energy(polymer: np.ndarray, V: np.ndarray) -> float:
     return 0.5 * (np.sum(V * b))
 
 
+@njit(cache=True)
+def calculate_energy(
+    polymer: np.ndarray, V: np.ndarray | utilities.StructuredV
+) -> float:
+    """Calculates the energy of the given polymer.
+    Neighbours are found with the occupancy table of the polymer, so the work is proportional to N,
+    and the full V matrix is never touched.
+
+    Args:
+        polymer: A 2D numpy array with monomer coordinates
+
+        V: A matrix with the bonding energies for the monomers of the given polymer,
+        either dense or a utilities.StructuredV.
+        V[i, j] = V[j, i] = bonding energy for the bond between monomer number (i+1) and (j+1).
+
+    Returns:
+        The energy of the polymer"""
+    return utilities.energy_from_table(polymer, V, lattice.build_lattice(polymer))
+
+
+@njit(cache=True)
+def _contact_energy(
+    V: np.ndarray | utilities.StructuredV,
+    table: np.ndarray,
+    i: int,
+    x: int,
+    y: int,
+    start: int,
+    stop: int,
+) -> float:
+    """Interaction energy between monomer i placed at (x, y) and
+    the monomers outside [start, stop) on the neighbouring lattice sites"""
+    energy = 0.0
+    for dx, dy in ((1, 0), (-1, 0), (0, 1), (0, -1)):
+        j = lattice.lookup(table, x + dx, y + dy)
+        if j != -1 and (j < start or j >= stop):
+            energy += utilities.interaction(V, i, j)
+    return energy
+
+
+@njit(cache=True)
+def energy_delta(
+    polymer: np.ndarray,
+    V: np.ndarray | utilities.StructuredV,
+    rotation_center: int,
+    positive_direction: bool,
+    table: np.ndarray,
+) -> float:
+    """Calculates the change in energy if the polymer is rotated, without rotating it.
+    Only the interactions between the rotated tail and the rest of the polymer change,
+    so the work is proportional to the length of the tail.
+
+    Args:
+        polymer: A 2D numpy array with monomer coordinates. The rotated polymer must be intact.
+
+        V: A matrix with the bonding energies for the monomers of the given polymer,
+        either dense or a utilities.StructuredV.
+
+        rotation_center: Which monomer to rotate around
+        `Note: It is not the index, but the monomer_number. [1, N]`
+
+        positive_direction: Rotate in the positive direction if True, or negative direction if False
+
+        table: The occupancy table of the polymer, see lattice.build_lattice
+
+    Returns:
+        E_rotated - E
+    """
+    start, stop = rotation_range(len(polymer), rotation_center)
+    direction = 1 if positive_direction else -1
+    x_s = polymer[rotation_center - 1, 0]
+    y_s = polymer[rotation_center - 1, 1]
+
+    delta = 0.0
+    for i in range(start, stop):
+        x = polymer[i, 0]
+        y = polymer[i, 1]
+        new_x, new_y = _rotate_site(x, y, x_s, y_s, direction)
+        # Contacts within the tail are unchanged by the rotation, so they are skipped
+        delta -= _contact_energy(V, table, i, x, y, start, stop)
+        delta += _contact_energy(V, table, i, new_x, new_y, start, stop)
+    return delta
+
+
 if __name__ == "__main__":
     pol = np.array(
         [
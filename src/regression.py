@@ -0,0 +1,135 @@
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+import benchmarks
+
+"""
+Performance regression gate on top of benchmarks.py.
+
+The first run stores the results as a baseline. Later runs are compared against it, and the
+process exits with status 1 if a benchmark got slower than the noise allows, or if the time
+of a benchmark grows faster with N than expected.
+
+Usage:
+    python regression.py --baseline benchmark_baseline.json           (compare, or create the baseline)
+    python regression.py --baseline benchmark_baseline.json --update  (overwrite the baseline)
+"""
+
+# Expected exponent p in time ~ N^p for every benchmark
+EXPECTED_ORDER = {
+    "check_if_intact": 1.0,
+    "check_if_intact_rotated": 1.0,
+    "rotate_polymer": 1.0,
+    "calculate_energy": 1.0,
+    "calculate_diameter": 1.0,
+    "metropolis": 1.0,
+}
+# The overhead of a call dominates for smaller polymers, so they are left out of the fit
+SCALING_MIN_N = 100
+
+
+def _key(result: dict) -> tuple[str, int]:
+    return result["name"], result["N"]
+
+
+def compare(baseline: dict, current: dict, tolerance: float = 0.25) -> list[str]:
+    """Finds the benchmarks which are slower than in the baseline.
+    A benchmark is slower if its median is larger than the baseline median by more than
+    the relative tolerance plus the spread (p90 - p10) of the two runs.
+
+    Args:
+        baseline: results from benchmarks.run_suite
+        current: results from benchmarks.run_suite
+        tolerance: allowed relative increase of the median
+
+    Returns:
+        a description of every regression
+    """
+    baseline_results = {_key(result): result for result in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        old = baseline_results.get(_key(result))
+        if old is None:
+            continue
+        noise = (old["p90"] - old["p10"]) + (result["p90"] - result["p10"])
+        limit = old["median"] * (1 + tolerance) + noise
+        if result["median"] > limit:
+            regressions.append(
+                f"{result['name']} (N = {result['N']}): median {result['median']:.3e} s, "
+                f"baseline {old['median']:.3e} s (limit {limit:.3e} s)"
+            )
+    return regressions
+
+
+def scaling_exponents(suite: dict) -> dict[str, float]:
+    """Fits time ~ N^p to the medians of every benchmark
+
+    Args:
+        suite: results from benchmarks.run_suite
+
+    Returns:
+        {benchmark name: p}, for the benchmarks with at least two N >= SCALING_MIN_N
+    """
+    exponents = {}
+    names = {result["name"] for result in suite["results"]}
+    for name in names:
+        points = [
+            (result["N"], result["median"])
+            for result in suite["results"]
+            if result["name"] == name and result["N"] >= SCALING_MIN_N
+        ]
+        if len(points) < 2:
+            continue
+        Ns, medians = np.array(points).T
+        exponents[name] = float(np.polyfit(np.log(Ns), np.log(medians), 1)[0])
+    return exponents
+
+
+def check_scaling(suite: dict, slack: float = 0.3) -> list[str]:
+    """Finds the benchmarks whose time grows faster with N than EXPECTED_ORDER
+
+    Args:
+        suite: results from benchmarks.run_suite
+        slack: allowed excess of the fitted exponent
+
+    Returns:
+        a description of every benchmark that scales too badly
+    """
+    problems = []
+    for name, exponent in scaling_exponents(suite).items():
+        expected = EXPECTED_ORDER.get(name)
+        if expected is not None and exponent > expected + slack:
+            problems.append(
+                f"{name}: time grows as N^{exponent:.2f}, expected at most N^{expected:.2f}"
+            )
+    return problems
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Performance regression gate")
+    parser.add_argument("--baseline", default="benchmark_baseline.json")
+    parser.add_argument("--update", action="store_true", help="overwrite the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--only", nargs="+", choices=list(benchmarks.BENCHMARKS), default=None)
+    parser.add_argument("--Ns", nargs="+", type=int, default=[10, 100, 1_000, 10_000])
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    suite = benchmarks.run_suite(args.only, tuple(args.Ns), args.iterations, verbose=True)
+
+    if args.update or not os.path.exists(args.baseline):
+        with open(args.baseline, "w") as file:
+            json.dump(suite, file, indent=2)
+        print(f"Stored the baseline in {args.baseline}")
+        problems = check_scaling(suite)
+    else:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        problems = compare(baseline, suite, args.tolerance) + check_scaling(suite)
+
+    for problem in problems:
+        print(f"REGRESSION: {problem}")
+    sys.exit(1 if problems else 0)
@@ -0,0 +1,187 @@
+import numpy as np
+import accumulator
+from scipy.constants import Boltzmann
+
+"""
+Histogram reweighting: thermal averages at any temperature from the energy histograms
+of simulations at a few temperatures.
+
+A simulation at temperature T_k samples the energies with probability g(E) exp(-E / (k_B T_k)) / Z_k,
+so its histogram H_k(E) is an estimate of the density of states g(E), up to a constant.
+The multiple histogram method (WHAM) combines the histograms of all the runs into the estimate
+
+    ln g(E) = ln sum_k H_k(E) - ln sum_k N_k exp(f_k - E / (k_B T_k)),   f_k = -ln Z_k,
+
+which is solved self-consistently for the f_k. With one run this is single histogram reweighting.
+The averages are only reliable at temperatures whose energy distribution is covered by the histograms.
+
+The histograms are those of the accumulators (see accumulator.py), which must all have the same bins.
+Samples outside the range of the histograms are ignored, and every bin stands for its centre,
+so the range should contain all the energies and the bins should be narrow (or centred on the
+possible energies, if the energies are multiples of the same number).
+
+The uncertainties are found by a bootstrap: the histograms are resampled from the multinomial
+distribution of their counts. The samples of a Markov chain are correlated, which is taken into
+account by dividing the number of samples by the statistical inefficiency (1 + 2 * tau_int).
+"""
+
+
+def canonical_weights(
+    log_g: np.ndarray, energies: np.ndarray, T_array: np.ndarray
+) -> np.ndarray:
+    """The probability of every energy at every temperature, g(E) exp(-E / (k_B T)) / Z
+
+    Args:
+        log_g: ln g(E), up to a constant. -inf for the energies which do not occur
+        energies: the energies
+        T_array: temperatures (Kelvin)
+
+    Returns:
+        (len(T_array), len(energies)) array with the probabilities
+    """
+    T_array = np.atleast_1d(np.asarray(T_array, dtype=np.float64))
+    occurring = np.isfinite(log_g)
+    beta = 1 / (Boltzmann * T_array[:, None])
+    log_weights = np.full((len(T_array), len(energies)), -np.inf)
+    # Shifting by the lowest energy keeps the Boltzmann factors from underflowing
+    log_weights[:, occurring] = log_g[occurring] - beta * (
+        energies[occurring] - energies[occurring].min()
+    )
+    weights = np.exp(log_weights - log_weights.max(axis=1, keepdims=True))
+    return weights / weights.sum(axis=1, keepdims=True)
+
+
+def _log_sum_exp(values: np.ndarray, axis: int) -> np.ndarray:
+    """ln(sum(exp(values))) along an axis, without overflow"""
+    largest = np.max(values, axis=axis, keepdims=True)
+    largest = np.where(np.isfinite(largest), largest, 0)
+    return np.squeeze(largest, axis) + np.log(np.exp(values - largest).sum(axis=axis))
+
+
+def _histograms(accs: list[np.ndarray]) -> tuple[np.ndarray, np.ndarray]:
+    """The histograms of the accumulators, and the centres of their bins"""
+    counts = []
+    edges = None
+    for acc in accs:
+        counts_k, edges_k, _ = accumulator.histogram(acc)
+        if len(counts_k) == 0:
+            raise ValueError("The accumulators must have an energy histogram")
+        if edges is not None and not np.array_equal(edges, edges_k):
+            raise ValueError("The histograms of the accumulators must have the same bins")
+        counts.append(counts_k)
+        edges = edges_k
+    return np.array(counts), (edges[1:] + edges[:-1]) / 2
+
+
+def solve_wham(
+    counts: np.ndarray,
+    energies: np.ndarray,
+    T_runs: np.ndarray,
+    tol: float = 1e-10,
+    max_iterations: int = 100_000,
+    f: np.ndarray | None = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Solves the WHAM equations for the density of states
+
+    Args:
+        counts: (number of runs, number of bins) array with the histogram of every run
+        energies: the energy of every bin
+        T_runs: the temperature of every run (Kelvin)
+        tol: stop when the largest change of the f_k is below this
+        max_iterations: largest number of iterations
+        f: initial guess of the f_k
+
+    Returns:
+        (ln g(E), normalised such that the g sum to 1 and -inf where no run has samples, f_k)
+    """
+    T_runs = np.asarray(T_runs, dtype=np.float64)
+    # Energies relative to the mean keep the exponents small
+    beta_E = np.outer(1 / (Boltzmann * T_runs), energies - energies.mean())
+    with np.errstate(divide="ignore"):
+        log_counts = np.log(counts.sum(axis=0))
+        log_N = np.log(counts.sum(axis=1))
+    f = np.zeros(len(T_runs)) if f is None else f.copy()
+
+    for _ in range(max_iterations):
+        log_g = log_counts - _log_sum_exp(log_N[:, None] + f[:, None] - beta_E, axis=0)
+        new_f = -_log_sum_exp(log_g[None, :] - beta_E, axis=1)
+        # Only the differences of the f_k matter
+        new_f -= new_f[0]
+        converged = np.max(np.abs(new_f - f)) < tol
+        f = new_f
+        if converged:
+            break
+
+    log_g = log_counts - _log_sum_exp(log_N[:, None] + f[:, None] - beta_E, axis=0)
+    finite = np.isfinite(log_g)
+    log_g[finite] -= _log_sum_exp(log_g[finite], axis=0)
+    return log_g, f
+
+
+def _averages(
+    log_g: np.ndarray, energies: np.ndarray, T_array: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """(E_mean, C_v) at every temperature"""
+    weights = canonical_weights(log_g, energies, T_array)
+    E_mean = weights @ energies
+    E_var = np.maximum(weights @ energies**2 - E_mean**2, 0)
+    return E_mean, E_var / (Boltzmann * T_array**2)
+
+
+def wham(
+    accs: list[np.ndarray],
+    T_runs,
+    T_array: np.ndarray,
+    n_bootstrap: int = 100,
+    inefficiency: float = 1.0,
+    seed: int | None = None,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Multiple histogram reweighting of several runs to a grid of temperatures
+
+    Args:
+        accs: the accumulators of the runs, with histograms on the same bins
+        T_runs: the temperature of every run (Kelvin)
+        T_array: temperatures to find the averages at (Kelvin)
+        n_bootstrap: number of bootstrap resamples for the uncertainties. None if 0
+        inefficiency: statistical inefficiency 1 + 2 * tau_int of the samples
+        seed: seed of the bootstrap
+
+    Returns:
+        (E_mean, E_err, C_v, C_v_err): arrays with the mean energy and the heat capacity at every
+        temperature, and their standard errors (nan if n_bootstrap is 0)
+    """
+    T_array = np.atleast_1d(np.asarray(T_array, dtype=np.float64))
+    counts, energies = _histograms(accs)
+    log_g, f = solve_wham(counts, energies, T_runs)
+    E_mean, C_v = _averages(log_g, energies, T_array)
+
+    E_err = np.full(len(T_array), np.nan)
+    C_v_err = np.full(len(T_array), np.nan)
+    if n_bootstrap > 0:
+        generator = np.random.default_rng(seed)
+        E_samples = np.zeros((n_bootstrap, len(T_array)))
+        C_v_samples = np.zeros((n_bootstrap, len(T_array)))
+        n_effective = np.maximum(np.round(counts.sum(axis=1) / inefficiency), 1).astype(np.int64)
+        probabilities = counts / counts.sum(axis=1, keepdims=True)
+        for b in range(n_bootstrap):
+            resampled = np.array(
+                [generator.multinomial(n, p) for n, p in zip(n_effective, probabilities)]
+            )
+            log_g_b, _ = solve_wham(resampled, energies, T_runs, f=f)
+            E_samples[b], C_v_samples[b] = _averages(log_g_b, energies, T_array)
+        E_err = E_samples.std(axis=0, ddof=1)
+        C_v_err = C_v_samples.std(axis=0, ddof=1)
+    return E_mean, E_err, C_v, C_v_err
+
+
+def single_histogram(
+    acc: np.ndarray,
+    T: float,
+    T_array: np.ndarray,
+    n_bootstrap: int = 100,
+    inefficiency: float = 1.0,
+    seed: int | None = None,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Single histogram reweighting of one run to a grid of temperatures near its temperature.
+    See wham for the arguments and the results."""
+    return wham([acc], [T], T_array, n_bootstrap, inefficiency, seed)
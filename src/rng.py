@@ -0,0 +1,250 @@
+import numpy as np
+from numba import njit
+
+"""
+Random number streams for the simulations, based on SplitMix64.
+Every stream is a uint64 array which is advanced in place,
+so every chain can have its own stream, independent of numba's global random state.
+The stream of a chain is keyed by the seed and the number of the chain, so a chain draws
+the same numbers however many chains there are, and whichever thread runs it.
+
+The numbers every rotation needs (the pivot, the direction and the acceptance uniform of the
+Metropolis-algorithm) are drawn a block of BLOCK_SIZE at a time into buffers which are part of
+the state (draw_pivot, draw_direction, draw_acceptance). The position in every buffer is stored
+in the state as well, so a chain which is saved and restored (see checkpoint.py) continues with
+the same numbers. Other numbers are drawn one at a time (uniform, randint).
+
+state (STATE_SIZE,): [
+    counter,
+    position in the pivots, position in the directions, position in the uniforms,
+    pivots (BLOCK_SIZE), directions (BLOCK_SIZE, 0 for the positive direction),
+    uniforms (BLOCK_SIZE, the bits of float64s)
+    ]
+"""
+
+# Number of numbers drawn at a time into every buffer
+BLOCK_SIZE = 512
+# The buffers
+PIVOTS = 0
+DIRECTIONS = 1
+UNIFORMS = 2
+_N_BUFFERS = 3
+_BUFFERS_START = 1 + _N_BUFFERS
+STATE_SIZE = _BUFFERS_START + _N_BUFFERS * BLOCK_SIZE
+
+_GAMMA = np.uint64(0x9E3779B97F4A7C15)
+_MIX_1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX_2 = np.uint64(0x94D049BB133111EB)
+
+
+@njit(cache=True)
+def _mix(z: np.uint64) -> np.uint64:
+    """The SplitMix64 output function, a bijective scrambling of 64 bits"""
+    z = (z ^ (z >> np.uint64(30))) * _MIX_1
+    z = (z ^ (z >> np.uint64(27))) * _MIX_2
+    return z ^ (z >> np.uint64(31))
+
+
+@njit(cache=True)
+def seed_states(seed: int, n_streams: int) -> np.ndarray:
+    """Makes independent streams from one seed
+
+    Args:
+        seed: the seed
+        n_streams: number of streams
+
+    Returns:
+        (n_streams, STATE_SIZE) array with the state of every stream. Use states[i] for stream i.
+    """
+    states = np.empty((n_streams, STATE_SIZE), dtype=np.uint64)
+    for i in range(n_streams):
+        states[i] = chain_state(seed, i)
+    return states
+
+
+@njit(cache=True)
+def chain_state(seed: int, chain: int) -> np.ndarray:
+    """The stream of one chain, the same as seed_states(seed, n_streams)[chain]
+
+    Args:
+        seed: the seed
+        chain: number of the chain
+
+    Returns:
+        the state of the stream
+    """
+    key = _mix(np.uint64(seed) + _GAMMA)
+    state = np.zeros(STATE_SIZE, dtype=np.uint64)
+    # Streams far apart in the sequence of counters, keyed by the stream number
+    state[0] = _mix(key ^ _mix(np.uint64(chain) * _GAMMA + _GAMMA))
+    # The buffers are empty, so they are filled by the first draw
+    state[1:_BUFFERS_START] = BLOCK_SIZE
+    return state
+
+
+@njit(cache=True)
+def seed_from_global() -> np.ndarray:
+    """Makes a stream seeded from numba's global random state. This state is separate from
+    NumPy's, so np.random.seed called from Python does not affect it: a simulation is only
+    reproducible if it is given a seed
+
+    Returns:
+        the state of the stream
+    """
+    return chain_state(np.random.randint(0, 2**62), 0)
+
+
+@njit(cache=True)
+def next_uint64(state: np.ndarray) -> np.uint64:
+    """Advances the stream
+
+    Args:
+        state: the state of the stream, updated in place
+
+    Returns:
+        64 random bits
+    """
+    state[0] += _GAMMA
+    return _mix(state[0])
+
+
+@njit(cache=True)
+def uniform(state: np.ndarray) -> float:
+    """Draws from the uniform distribution on [0, 1)
+
+    Args:
+        state: the state of the stream, updated in place
+
+    Returns:
+        the random number
+    """
+    # The 53 most significant bits fill the mantissa of a float64
+    return (next_uint64(state) >> np.uint64(11)) * (1.0 / 9007199254740992.0)
+
+
+@njit(cache=True)
+def randint(state: np.ndarray, low: int, high: int) -> int:
+    """Draws an integer from [low, high)
+
+    Args:
+        state: the state of the stream, updated in place
+        low: lowest possible integer
+        high: one past the highest possible integer
+
+    Returns:
+        the random integer
+    """
+    return low + int(uniform(state) * (high - low))
+
+
+@njit(cache=True)
+def fill_uniform(state: np.ndarray, out: np.ndarray) -> np.ndarray:
+    """Fills an array with draws from the uniform distribution on [0, 1),
+    the same numbers as drawing them one by one with uniform
+
+    Args:
+        state: the state of the stream, updated in place
+        out: the array to fill
+
+    Returns:
+        out
+    """
+    for k in range(len(out)):
+        out[k] = uniform(state)
+    return out
+
+
+@njit(cache=True)
+def fill_randint(state: np.ndarray, low: int, high: int, out: np.ndarray) -> np.ndarray:
+    """Fills an array with integers drawn from [low, high),
+    the same numbers as drawing them one by one with randint
+
+    Args:
+        state: the state of the stream, updated in place
+        low: lowest possible integer
+        high: one past the highest possible integer
+        out: the array to fill
+
+    Returns:
+        out
+    """
+    for k in range(len(out)):
+        out[k] = randint(state, low, high)
+    return out
+
+
+@njit(cache=True)
+def _buffer(state: np.ndarray, buffer: int) -> np.ndarray:
+    """The numbers of a buffer, a view of the state"""
+    start = _BUFFERS_START + buffer * BLOCK_SIZE
+    return state[start : start + BLOCK_SIZE]
+
+
+@njit(cache=True)
+def _next_position(state: np.ndarray, buffer: int) -> tuple[int, bool]:
+    """Advances the position in a buffer
+
+    Returns:
+        (position of the next number, True if the buffer is used up and has to be filled first)
+    """
+    position = np.int64(state[1 + buffer])
+    empty = position == BLOCK_SIZE
+    if empty:
+        position = 0
+    state[1 + buffer] = position + 1
+    return position, empty
+
+
+@njit(cache=True)
+def draw_pivot(state: np.ndarray, low: int, high: int) -> int:
+    """Draws a pivot (rotation center) from [low, high), a block at a time.
+    A stream must always be given the same low and high
+
+    Args:
+        state: the state of the stream, updated in place
+        low: lowest possible pivot
+        high: one past the highest possible pivot
+
+    Returns:
+        the pivot
+    """
+    pivots = _buffer(state, PIVOTS)
+    position, empty = _next_position(state, PIVOTS)
+    if empty:
+        fill_randint(state, low, high, pivots)
+    return int(pivots[position])
+
+
+@njit(cache=True)
+def draw_direction(state: np.ndarray) -> bool:
+    """Draws a rotation direction, a block at a time
+
+    Args:
+        state: the state of the stream, updated in place
+
+    Returns:
+        True for the positive direction, with probability 1/2
+    """
+    directions = _buffer(state, DIRECTIONS)
+    position, empty = _next_position(state, DIRECTIONS)
+    if empty:
+        # randint(0, 2) is 0 when uniform < 0.5
+        fill_randint(state, 0, 2, directions)
+    return directions[position] == 0
+
+
+@njit(cache=True)
+def draw_acceptance(state: np.ndarray) -> float:
+    """Draws a uniform on [0, 1) for the acceptance of a rotation, a block at a time
+
+    Args:
+        state: the state of the stream, updated in place
+
+    Returns:
+        the random number
+    """
+    uniforms = _buffer(state, UNIFORMS).view(np.float64)
+    position, empty = _next_position(state, UNIFORMS)
+    if empty:
+        fill_uniform(state, uniforms)
+    return uniforms[position]
@@ -1,17 +1,23 @@
 import numpy as np
+import accumulator
+import lattice
 import polymer
+import rng
+import utilities
 import visualization
 from scipy.constants import Boltzmann
-from numba import njit
+from scipy.stats import t as student_t
+from numba import njit, prange
 
 
-@njit
-def alg1(N: int, Ns: int) -> tuple[np.ndarray, int]:
+@njit(cache=True)
+def alg1(N: int, Ns: int, seed: int | None = None) -> tuple[np.ndarray, int]:
     """Implementation of algorithm 1.
     ---
     Args:
         N: length of polymer.
         Ns: number of twists (attempts) to be performed.
+        seed: seed of the random number stream. Not reproducible if None
 
     Returns:
         (polymer, counter)
@@ -20,23 +26,260 @@ def alg1(N: int, Ns: int) -> tuple[np.ndarray, int]:
     """
     counter = 1
     pol = polymer.generate_flat_polymer(N)
-    for i in range(Ns):
+    table = lattice.build_lattice(pol)
+    if seed is None:
+        state = rng.seed_from_global()
+    else:
+        state = rng.chain_state(seed, 0)
+    counter += _twists(pol, table, state, Ns)
+    return pol, counter
+
+
+@njit(cache=True)
+def _twists(pol: np.ndarray, table: np.ndarray, state: np.ndarray, Ns: int) -> int:
+    """Performs Ns twists of algorithm 1 in place
+
+    Returns:
+        number of successful twists
+    """
+    N = len(pol)
+    counter = 0
+    for _ in range(Ns):
         # random monomer and random twisting direction
-        rnd_monomer = np.random.randint(2, N)
-        rnd_rotate = bool(int(np.random.uniform() + 0.5))
+        rnd_monomer = rng.draw_pivot(state, 2, N)
+        rnd_rotate = rng.draw_direction(state)
 
-        # TODO: possible to mutate the same array instead of copying?
-        twisted_pol = polymer.rotate_polymer(pol, rnd_monomer, rnd_rotate)
-        if polymer.check_if_intact_4(twisted_pol, N):
+        # The move is checked before rotating, so the polymer is mutated only when it stays intact
+        if polymer.check_if_intact_rotated(pol, rnd_monomer, rnd_rotate, table):
             counter += 1
-            pol = twisted_pol
+            polymer.apply_rotation(pol, rnd_monomer, rnd_rotate, table)
+    return counter
 
-    return pol, counter
 
+@njit(parallel=True, cache=True)
+def _valid_rotation_counts(
+    N_array: np.ndarray, checkpoints: np.ndarray, replicas: int, seed: int
+) -> np.ndarray:
+    """See valid_rotation_map
+
+    Returns:
+        (len(N_array), replicas, len(checkpoints)) array with the number of successful twists
+        after every checkpoint (sorted) of every chain
+    """
+    n_N = len(N_array)
+    counts = np.zeros((n_N, replicas, len(checkpoints)), dtype=np.int64)
+    # N varies fastest, so that the long and short polymers are spread evenly over the threads
+    for chain in prange(n_N * replicas):
+        i = chain % n_N
+        r = chain // n_N
+        pol = polymer.generate_flat_polymer(N_array[i])
+        table = lattice.build_lattice(pol)
+        state = rng.chain_state(seed, chain)
+        counter = 0
+        done = 0
+        for k in range(len(checkpoints)):
+            counter += _twists(pol, table, state, checkpoints[k] - done)
+            done = checkpoints[k]
+            counts[i, r, k] = counter
+    return counts
+
+
+def valid_rotation_map(
+    N_array,
+    Ns_array,
+    replicas: int = 1,
+    confidence: float = 0.95,
+    seed: int | None = None,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """The fraction of valid twists of algorithm 1 for every length N and number of twists Ns.
+    One chain per N and replica is run to the largest Ns, and the number of valid twists
+    is read off after every Ns, instead of running a chain from the flat polymer for every Ns.
+    The chains run in parallel on all cores.
+
+    Args:
+        N_array: lengths of the polymers, at least 3
+        Ns_array: numbers of twists, at least 1
+        replicas: number of independent chains for every N
+        confidence: confidence level of the intervals
+        seed: seed of the random number streams. Seeded from np.random if None
+
+    Returns:
+        (mean, lower, upper): arrays of shape (len(Ns_array), len(N_array)) with the mean fraction
+        over the replicas, and the confidence interval of the mean (Student's t).
+        The interval is nan if there is only one replica
+    """
+    N_array = np.asarray(N_array, dtype=np.int64)
+    Ns_array = np.asarray(Ns_array, dtype=np.int64)
+    if np.any(N_array < 3):
+        raise ValueError("The polymers must have at least 3 monomers to be twisted")
+    if np.any(Ns_array < 1):
+        raise ValueError("Every Ns must be at least 1")
+    if seed is None:
+        seed = np.random.randint(0, 2**62)
+    checkpoints, positions = np.unique(Ns_array, return_inverse=True)
+    counts = _valid_rotation_counts(N_array, checkpoints, replicas, seed)
+    # (Ns, N, replicas)
+    fractions = counts[:, :, positions].transpose(2, 0, 1) / Ns_array[:, None, None]
 
-@njit
+    mean = fractions.mean(axis=2)
+    if replicas < 2:
+        half_width = np.full(mean.shape, np.nan)
+    else:
+        standard_error = fractions.std(axis=2, ddof=1) / np.sqrt(replicas)
+        half_width = student_t.ppf((1 + confidence) / 2, replicas - 1) * standard_error
+    return mean, mean - half_width, mean + half_width
+
+
+@njit(cache=True)
+def metropolis_step(
+    pol: np.ndarray,
+    V: np.ndarray | utilities.StructuredV,
+    T: float,
+    E: float,
+    table: np.ndarray,
+    state: np.ndarray,
+) -> tuple[bool, float]:
+    """Performs one step of the Metropolis-algorithm, in place.
+    Rotations are drawn until one keeps the polymer intact, which is then accepted or rejected.
+
+    Args:
+        pol: Polymer, rotated in place if the rotation is accepted
+        V: Interaction forces between two monomers, dense or utilities.StructuredV
+        T: Temperature (Kelvin)
+        E: Energy of the polymer
+        table: Occupancy table of the polymer, see lattice.build_lattice
+        state: Random number stream of the chain, see rng.py
+
+    Returns:
+        (True if the rotation was accepted, energy of the polymer after the step)
+    """
+    N = len(pol)
+    while True:
+        # random monomer and random twisting direction
+        rnd_monomer = rng.draw_pivot(state, 2, N)
+        rnd_rotate = rng.draw_direction(state)
+
+        if polymer.check_if_intact_rotated(pol, rnd_monomer, rnd_rotate, table):
+            break
+
+    delta_E = polymer.energy_delta(pol, V, rnd_monomer, rnd_rotate, table)
+
+    # TODO: Bruke en annen distribusjon enn uniform?
+    # TODO: Boltzmann-konstanten er liten. Sjekk at python håndterer det.
+    if delta_E < 0 or rng.draw_acceptance(state) < np.exp(-delta_E / (T * Boltzmann)):
+        polymer.apply_rotation(pol, rnd_monomer, rnd_rotate, table)
+        return True, E + delta_E
+    return False, E
+
+
+@njit(cache=True)
+def metropolis_segment(
+    pol: np.ndarray,
+    E: float,
+    table: np.ndarray,
+    state: np.ndarray,
+    start: int,
+    stop: int,
+    V: np.ndarray | utilities.StructuredV,
+    T: float,
+    acc: np.ndarray,
+    diameter: bool = False,
+    E_trace: np.ndarray | None = None,
+    d_trace: np.ndarray | None = None,
+) -> float:
+    """Runs the steps start, ..., stop - 1 of the Metropolis-algorithm, in place.
+    All the state of the chain is passed in, so a run can be split into segments
+    (e.g. to checkpoint it) with the same result as running it in one go.
+
+    Args:
+        pol: Polymer, rotated in place
+        E: Energy of the polymer
+        table: Occupancy table of the polymer, updated in place
+        state: Random number stream of the chain, updated in place
+        start: index of the first step. Step 0 is the initial state, which is only observed
+        stop: one past the index of the last step
+        V: Interaction forces between two monomers, dense or utilities.StructuredV
+        T: Temperature (Kelvin)
+        acc: Accumulator for the observables and the acceptance, see accumulator.py. Updated in place.
+        diameter: Also track the diameter, radius of gyration and end-to-end distance of the polymer
+        E_trace: Optional array of length stop - start which is filled with the energy of every step
+        d_trace: Optional array of length stop - start which is filled with the diameter of every step,
+            if diameter is True
+
+    Returns:
+        Energy of the polymer after the last step
+    """
+    if diameter:
+        d, R_g, R_ee = utilities.calculate_shape(pol)
+    else:
+        d = R_g = R_ee = np.nan
+
+    accepted = False
+    for i in range(start, stop):
+        if i > 0:
+            accepted, E = metropolis_step(pol, V, T, E, table, state)
+            # The shape only changes when the polymer does
+            if diameter and accepted:
+                d, R_g, R_ee = utilities.calculate_shape(pol)
+        accumulator.observe(acc, E, d, accepted, R_g, R_ee)
+        if E_trace is not None:
+            E_trace[i - start] = E
+        if d_trace is not None:
+            if diameter:
+                d_trace[i - start] = d
+
+    return E
+
+
+@njit(cache=True)
+def metropolis_stream(
+    pol: np.ndarray,
+    N_s: int,
+    V: np.ndarray | utilities.StructuredV,
+    T: float,
+    acc: np.ndarray,
+    diameter: bool = False,
+    E_trace: np.ndarray | None = None,
+    d_trace: np.ndarray | None = None,
+    seed: int | None = None,
+) -> np.ndarray:
+    """Runs the Metropolis-algorithm, streaming the observables into an accumulator.
+    Only O(1) memory is used, unless the full traces are asked for.
+
+    Args:
+        pol: Polymer initial state
+        N_s: Rotation attempts
+        V: Interaction forces between two monomers, dense or utilities.StructuredV
+        T: Temperature (Kelvin)
+        acc: Accumulator for the observables and the acceptance, see accumulator.py. Updated in place.
+        diameter: Also track the diameter, radius of gyration and end-to-end distance of the polymer
+        E_trace: Optional array of length N_s which is filled with the energy of every step
+        d_trace: Optional array of length N_s which is filled with the diameter of every step
+        seed: seed of the random number stream. Not reproducible if None
+
+    Returns:
+        Last polymer created
+    """
+    # The polymer is rotated in place, so the initial state given by the caller is left untouched
+    pol = pol.copy()
+    E = polymer.calculate_energy(pol, V)
+    # Occupancy table, so that only the rotated tail is needed to find the change in energy
+    table = lattice.build_lattice(pol)
+    if seed is None:
+        state = rng.seed_from_global()
+    else:
+        state = rng.chain_state(seed, 0)
+    metropolis_segment(pol, E, table, state, 0, N_s, V, T, acc, diameter, E_trace, d_trace)
+    return pol
+
+
+@njit(cache=True)
 def metropolis(
-    pol: np.ndarray, N_s: int, V: np.ndarray, T: float
+    pol: np.ndarray,
+    N_s: int,
+    V: np.ndarray | utilities.StructuredV,
+    T: float,
+    seed: int | None = None,
 ) -> tuple[np.ndarray, np.ndarray]:
     """Runs the Metropolis-algorithm
 
@@ -45,46 +288,428 @@ def metropolis(
         N_s: Rotation attempts
         V: Interaction forces between two monomers
         T: Temperature (Kelvin)
+        seed: seed of the random number stream. Not reproducible if None
 
     Returns:
         (Last polymer created, array with all simulated energies)
     """
     E_array = np.zeros(N_s)
+    pol = metropolis_stream(
+        pol, N_s, V, T, accumulator.new_accumulator(), False, E_array, seed=seed
+    )
+    return pol, E_array
+
+
+@njit(cache=True)
+def acceptance_table(unit: float, T: float, max_delta: int) -> np.ndarray:
+    """The acceptance probabilities exp(-delta_E / (k_B T)) of the Metropolis-algorithm in reduced units
+
+    Args:
+        unit: the energy unit (Joule), see utilities.reduced_V
+        T: Temperature (Kelvin)
+        max_delta: the largest change in energy, in units
+
+    Returns:
+        array with the probability of accepting a change in energy of k units at index k
+    """
+    return np.exp(-np.arange(max_delta + 1) * (unit / (T * Boltzmann)))
+
+
+@njit(cache=True)
+def metropolis_step_reduced(
+    pol: np.ndarray,
+    V: np.ndarray | utilities.StructuredV,
+    acceptance: np.ndarray,
+    E: int,
+    table: np.ndarray,
+    state: np.ndarray,
+) -> tuple[bool, int]:
+    """metropolis_step in reduced units. The changes in energy are integers,
+    so the acceptance probability is looked up in a table instead of calling exp.
+
+    Args:
+        pol: Polymer, rotated in place if the rotation is accepted
+        V: Interaction forces between two monomers in reduced units, see utilities.reduced_V
+        acceptance: the acceptance probabilities, see acceptance_table
+        E: Energy of the polymer in units
+        table: Occupancy table of the polymer, see lattice.build_lattice
+        state: Random number stream of the chain, see rng.py
+
+    Returns:
+        (True if the rotation was accepted, energy of the polymer in units after the step)
+    """
     N = len(pol)
-    E = polymer.calculate_energy(pol, V)
-    i = 0
-    while i < N_s - 1:
+    while True:
         # random monomer and random twisting direction
-        rnd_monomer = np.random.randint(2, N)
-        rnd_rotate = bool(int(np.random.uniform() + 0.5))
-
-        # TODO: possible to mutate the same array instead of copying?
-        twisted_pol = polymer.rotate_polymer(pol, rnd_monomer, rnd_rotate)
-        if polymer.check_if_intact_4(twisted_pol, N):
-            i += 1
-            E_new = polymer.calculate_energy(twisted_pol, V)
-
-            if E_new < E:
-                pol = twisted_pol
-                E = E_new
-            # TODO: Bruke en annen distribusjon enn uniform?
-            # TODO: Boltzmann-konstanten er liten. Sjekk at python håndterer det.
-            elif np.random.uniform() < np.exp(-(E_new - E) / (T * Boltzmann)):
-                pol = twisted_pol
-                E = E_new
-            E_array[i] = E
+        rnd_monomer = rng.draw_pivot(state, 2, N)
+        rnd_rotate = rng.draw_direction(state)
 
-    return pol, E_array
+        if polymer.check_if_intact_rotated(pol, rnd_monomer, rnd_rotate, table):
+            break
+
+    # The sum of integers is exact, so rounding only removes the sign of a zero
+    delta_E = int(np.rint(polymer.energy_delta(pol, V, rnd_monomer, rnd_rotate, table)))
+    if delta_E < 0 or rng.draw_acceptance(state) < acceptance[delta_E]:
+        polymer.apply_rotation(pol, rnd_monomer, rnd_rotate, table)
+        return True, E + delta_E
+    return False, E
+
+
+@njit(cache=True)
+def _metropolis_reduced(
+    pol: np.ndarray,
+    N_s: int,
+    V: np.ndarray | utilities.StructuredV,
+    acceptance: np.ndarray,
+    unit: float,
+    state: np.ndarray,
+    acc: np.ndarray,
+    E_trace: np.ndarray | None,
+) -> np.ndarray:
+    """See metropolis_reduced"""
+    pol = pol.copy()
+    E = int(np.rint(polymer.calculate_energy(pol, V)))
+    table = lattice.build_lattice(pol)
+    accepted = False
+    for i in range(N_s):
+        if i > 0:
+            accepted, E = metropolis_step_reduced(pol, V, acceptance, E, table, state)
+        accumulator.observe(acc, E * unit, np.nan, accepted)
+        if E_trace is not None:
+            E_trace[i] = E
+    return pol
+
+
+def metropolis_reduced(
+    pol: np.ndarray,
+    N_s: int,
+    V: np.ndarray | utilities.StructuredV,
+    T: float,
+    seed: int | None = None,
+    acc: np.ndarray | None = None,
+    E_trace: np.ndarray | None = None,
+) -> tuple[np.ndarray, float]:
+    """Runs the Metropolis-algorithm in reduced units: V is written as integer multiples of
+    a unit (see utilities.reduced_V), the energy is tracked as an integer, and the acceptance
+    probabilities are looked up in a table. The energy does not drift, and the decisions only
+    depend on the integers, not on how exp and the floating point sums are done on the platform.
+
+    Args:
+        pol: Polymer initial state
+        N_s: Rotation attempts
+        V: Interaction forces between two monomers, dense or utilities.StructuredV.
+            The values must be integer multiples of a common unit
+        T: Temperature (Kelvin)
+        seed: seed of the random number stream. Not reproducible if None
+        acc: Accumulator for the observables (in Joule), updated in place. A new one if None
+        E_trace: Optional int64 array of length N_s which is filled with the energy of every step,
+            in units
+
+    Returns:
+        (Last polymer created, the unit in Joule)
+    """
+    V_reduced, unit = utilities.reduced_V(V)
+    if isinstance(V_reduced, utilities.StructuredV):
+        largest = np.abs(np.concatenate((V_reduced.offsets, V_reduced.pair_values))).max()
+    else:
+        largest = np.abs(V_reduced).max()
+    # A polymer has at most N + 1 contacts, so the energy changes by at most 2 (N + 1) |V|
+    acceptance = acceptance_table(unit, T, int(2 * (len(pol) + 1) * largest))
+    state = rng.seed_from_global() if seed is None else rng.chain_state(seed, 0)
+    if acc is None:
+        acc = accumulator.new_accumulator()
+    pol = _metropolis_reduced(pol, N_s, V_reduced, acceptance, unit, state, acc, E_trace)
+    return pol, unit
+
+
+@njit(cache=True)
+def metropolis_diameter(
+    pol: np.ndarray,
+    N_s: int,
+    V: np.ndarray | utilities.StructuredV,
+    T: float,
+    seed: int | None = None,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Metropolis algorithm with diameter calculation
+
+    Args:
+        pol: polymer start shape
+        N_s: Number of attempts at rotation
+        V: Interaction between monomers
+        T: temperature in kelvin
+        seed: seed of the random number stream. Not reproducible if None
+
+    Returns:
+        (output array, array with all energies, array with all diameters)
+    """
+    E_array = np.zeros(N_s)
+    d_array = np.zeros(N_s)
+    pol = metropolis_stream(
+        pol, N_s, V, T, accumulator.new_accumulator(), True, E_array, d_array, seed
+    )
+    return pol, E_array, d_array
+
+
+@njit(parallel=True, cache=True)
+def metropolis_batch(
+    pols: np.ndarray,
+    N_s: int,
+    V: np.ndarray | utilities.StructuredV,
+    T: float,
+    seed: int,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Runs the Metropolis-algorithm for R independent polymers in one call.
+    Every chain has its own random number stream, so the result only depends on the seed,
+    not on the number of threads. The chains run in parallel.
+
+    Args:
+        pols: (R, N, 2) array with the initial state of every polymer,
+            e.g. np.repeat(polymer.generate_flat_polymer(N)[None], R, axis=0)
+        N_s: Rotation attempts for every chain
+        V: Interaction forces between two monomers
+        T: Temperature (Kelvin)
+        seed: seed of the random number streams
+
+    Returns:
+        (polymers, E_array, accepted)
+            polymers: (R, N, 2) array with the last polymer of every chain
+            E_array: (R, N_s) array with the simulated energies of every chain
+            accepted: number of accepted rotations in every chain
+    """
+    R = len(pols)
+    pols = pols.copy()
+    states = rng.seed_states(seed, R)
+    E_array = np.zeros((R, N_s))
+    accepted = np.zeros(R, dtype=np.int64)
+    for r in prange(R):
+        pol = pols[r]
+        table = lattice.build_lattice(pol)
+        state = states[r]
+        E = polymer.calculate_energy(pol, V)
+        E_array[r, 0] = E
+        for i in range(1, N_s):
+            is_accepted, E = metropolis_step(pol, V, T, E, table, state)
+            accepted[r] += is_accepted
+            E_array[r, i] = E
+
+    return pols, E_array, accepted
+
+
+@njit(parallel=True, cache=True)
+def parallel_tempering(
+    pol: np.ndarray,
+    N_s: int,
+    V: np.ndarray | utilities.StructuredV,
+    T_array: np.ndarray,
+    swap_interval: int = 10,
+    seed: int | None = None,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Runs the Metropolis-algorithm at several temperatures at once (replica exchange).
+    Every swap_interval steps, the configurations at neighbouring temperatures are swapped
+    with probability min(1, exp((1/kT_i - 1/kT_j)(E_i - E_j))), which lets the polymers at low
+    temperatures escape the compact states they get stuck in.
+    The replicas run in parallel between the swaps.
+
+    Args:
+        pol: Polymer initial state, used for every temperature
+        N_s: Rotation attempts at every temperature
+        V: Interaction forces between two monomers
+        T_array: Temperatures (Kelvin), sorted
+        swap_interval: Number of steps between every attempt to swap
+        seed: seed of the random number streams. Seeded from np.random if None
+
+    Returns:
+        (polymers, E_array, swap_rates)
+            polymers: (len(T_array), N, 2) array with the last polymer at every temperature
+            E_array: (len(T_array), N_s) array with the simulated energies at every temperature
+            swap_rates: the fraction of accepted swaps between temperature i and i + 1
+    """
+    R = len(T_array)
+    E_0 = polymer.calculate_energy(pol, V)
+    table_0 = lattice.build_lattice(pol)
+    pols = np.empty((R,) + pol.shape, dtype=pol.dtype)
+    tables = np.empty((R,) + table_0.shape, dtype=table_0.dtype)
+    E = np.full(R, E_0)
+    if seed is None:
+        seed = np.random.randint(0, 2**62)
+    # One stream for every configuration, and the last one for the swaps
+    states = rng.seed_states(seed, R + 1)
+    for r in range(R):
+        pols[r] = pol
+        tables[r] = table_0
+    # Which configuration is at temperature r. Swapping the configurations
+    # of two temperatures is then just swapping two integers
+    config = np.arange(R)
+
+    E_array = np.zeros((R, N_s))
+    E_array[:, 0] = E_0
+    swaps_attempted = np.zeros(R - 1)
+    swaps_accepted = np.zeros(R - 1)
+
+    step = 1
+    n_exchanges = 0
+    while step < N_s:
+        n_steps = min(swap_interval, N_s - step)
+        for r in prange(R):
+            c = config[r]
+            for k in range(n_steps):
+                _, E[c] = metropolis_step(
+                    pols[c], V, T_array[r], E[c], tables[c], states[c]
+                )
+                E_array[r, step + k] = E[c]
+        step += n_steps
+
+        # Alternating between the even and the odd pairs of neighbouring temperatures
+        for r in range(n_exchanges % 2, R - 1, 2):
+            c_low = config[r]
+            c_high = config[r + 1]
+            swaps_attempted[r] += 1
+            beta_diff = 1 / (T_array[r] * Boltzmann) - 1 / (T_array[r + 1] * Boltzmann)
+            exponent = beta_diff * (E[c_low] - E[c_high])
+            if exponent >= 0 or rng.uniform(states[R]) < np.exp(exponent):
+                swaps_accepted[r] += 1
+                config[r] = c_high
+                config[r + 1] = c_low
+        n_exchanges += 1
+
+    swap_rates = swaps_accepted / np.maximum(swaps_attempted, 1)
+    return pols[config], E_array, swap_rates
+
+
+@njit(parallel=True, cache=True)
+def _temperature_sweep(
+    N: int,
+    Ns_array: np.ndarray,
+    T_array: np.ndarray,
+    V: np.ndarray | utilities.StructuredV,
+    n_replicas: int,
+    burn_in: int,
+    seed: int,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """See temperature_sweep"""
+    n_Ns = len(Ns_array)
+    n_T = len(T_array)
+    n_chains = n_Ns * n_T * n_replicas
+    # Mean and variance of every chain
+    E_means = np.zeros(n_chains)
+    E_vars = np.zeros(n_chains)
+    d_means = np.zeros(n_chains)
+    d_vars = np.zeros(n_chains)
+
+    # Ns varies fastest, so that the long and short chains are spread evenly over the threads
+    for chain in prange(n_chains):
+        i = chain % n_Ns
+        j = (chain // n_Ns) % n_T
+        acc = accumulator.new_accumulator(burn_in)
+        pol = polymer.generate_flat_polymer(N)
+        # The stream of a chain only depends on the seed and the chain, not on the thread
+        state = rng.chain_state(seed, chain)
+        E = polymer.calculate_energy(pol, V)
+        table = lattice.build_lattice(pol)
+        metropolis_segment(pol, E, table, state, 0, Ns_array[i], V, T_array[j], acc, True)
+        E_means[chain] = accumulator.mean(acc, accumulator.ENERGY)
+        E_vars[chain] = accumulator.variance(acc, accumulator.ENERGY)
+        d_means[chain] = accumulator.mean(acc, accumulator.DIAMETER)
+        d_vars[chain] = accumulator.variance(acc, accumulator.DIAMETER)
+
+    # Pooling the replicas. Every replica has the same number of samples
+    shape = (n_replicas, n_T, n_Ns)
+    E_mean = E_means.reshape(shape).sum(axis=0) / n_replicas
+    d_mean = d_means.reshape(shape).sum(axis=0) / n_replicas
+    E_var = (E_vars + E_means**2).reshape(shape).sum(axis=0) / n_replicas - E_mean**2
+    d_var = (d_vars + d_means**2).reshape(shape).sum(axis=0) / n_replicas - d_mean**2
+    return (
+        E_mean.T.copy(),
+        np.sqrt(np.maximum(E_var, 0)).T.copy(),
+        d_mean.T.copy(),
+        np.sqrt(np.maximum(d_var, 0)).T.copy(),
+    )
+
+
+def temperature_sweep(
+    N: int,
+    Ns_list,
+    T_array: np.ndarray,
+    V: np.ndarray | utilities.StructuredV,
+    n_replicas: int = 1,
+    burn_in: int = 1000,
+    seed: int | None = None,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Runs the Metropolis-algorithm from a flat polymer for every combination of
+    number of steps and temperature. The independent chains run in parallel on all cores.
+    With a seed the results are the same for any number of threads.
+
+    Args:
+        N: length of polymer
+        Ns_list: the numbers of steps to run
+        T_array: temperatures (Kelvin)
+        V: Interaction forces between two monomers
+        n_replicas: number of independent chains for every (Ns, T)
+        burn_in: number of steps discarded at the start of every chain
+        seed: seed of the random number streams. Seeded from np.random if None
+
+    Returns:
+        (E_mean, E_std, d_mean, d_std): arrays of shape (len(Ns_list), len(T_array))
+        with the mean and standard deviation of the energy and the diameter,
+        pooled over the replicas
+    """
+    Ns_array = np.asarray(Ns_list, dtype=np.int64)
+    if np.any(Ns_array <= burn_in):
+        raise ValueError(f"Every Ns must be larger than burn_in = {burn_in}")
+    if seed is None:
+        seed = np.random.randint(0, 2**62)
+    return _temperature_sweep(
+        N, Ns_array, np.asarray(T_array, dtype=np.float64), V, n_replicas, burn_in, seed
+    )
+
+
+def warmup(parallel: bool = True) -> None:
+    """Compiles the hot functions for the common argument types (int32 and int64 polymers,
+    dense and structured V) by calling them on tiny inputs.
+    The machine code is cached on disk (cache=True), so only the first warmup after
+    a change of the code compiles; later processes load the cache.
+
+    Args:
+        parallel: also compile the parallel drivers, which take longer to compile
+    """
+    N = 5
+    T = 293.0
+    for dtype in (np.int32, np.int64):
+        pol = polymer.generate_flat_polymer(N).astype(dtype)
+        table = lattice.build_lattice(pol)
+        polymer.check_if_intact(pol, N)
+        polymer.check_if_intact_rotated(pol, 3, True, table)
+        polymer.rotate_polymer(pol, 3, True)
+        utilities.calculate_shape(pol)
+        for V in (utilities.gen_V_matrix(N), utilities.gen_V_uniform(N)):
+            polymer.calculate_energy(pol, V)
+            polymer.energy_delta(pol, V, 3, True, table)
+            utilities.calculate_observables(pol, V)
+            metropolis(pol, 2, V, T)
+            metropolis_diameter(pol, 2, V, T)
+            metropolis_reduced(pol, 2, V, T)
+            if parallel:
+                metropolis_batch(pol[None], 2, V, T, 0)
+                parallel_tempering(pol, 2, V, np.array([T, 2 * T]), 1)
+    alg1(N, 2)
+    if parallel:
+        _valid_rotation_counts(np.array([N]), np.array([2]), 1, 0)
+        for V in (utilities.gen_V_matrix(N), utilities.gen_V_uniform(N)):
+            _temperature_sweep(N, np.array([2]), np.array([T]), V, 1, 1, 0)
 
 
 if __name__ == "__main__":
+    import matplotlib.pyplot as plt
+
     N = 100
     Ns = 100
+    fig, axs = plt.subplots(1, 2)
     pol, _ = alg1(N, Ns)
     visualization.illustrate_polymer(
-        pol, cmap="Greens", title=f"length: {N}, # twists: {Ns}"
+        axs[0], pol, cmap="Greens", title=f"length: {N}, # twists: {Ns}"
     )
     pol, _ = alg1(N, Ns)
     visualization.illustrate_polymer(
-        pol, cmap="Blues", title=f"length: {N}, # twists: {Ns}"
+        axs[1], pol, cmap="Blues", title=f"length: {N}, # twists: {Ns}"
     )
+    plt.show()
@@ -1,8 +1,25 @@
+import os
+import tempfile
 import polymer
 import visualization
 import numpy as np
+import matplotlib.pyplot as plt
+from scipy.constants import Boltzmann
 import simulation
 import utilities
+import lattice
+import accumulator
+import cache
+import checkpoint
+import directions
+import enumeration
+import moves
+import old_rotate_polymer
+import regression
+import reweighting
+import rng
+import trajectory
+import wang_landau
 
 """
 Tests for polymer.py
@@ -19,23 +36,36 @@ def test_generate_flat_polymer():
 
 
 def test_check_if_intact2():
-    """generates 50 random polymers of size 3.
-    If check_if_intact2 returns True one can validate this"""
+    """generates 50 random polymers of size 3,
+    and compares check_if_intact_2 against the brute force check_if_intact_4"""
     test_cases = [np.random.randint(-5, 5, (3, 2)) for _ in range(50)]
     for test_case in test_cases:
-        if polymer.check_if_intact_2(test_case, len(test_case)):
-            print(f"The polymer\n\t{test_case}\nis intact.\nPlease check")
-            visualization.illustrate_polymer(test_case)
+        assert polymer.check_if_intact_2(test_case, len(test_case)) == polymer.check_if_intact_4(
+            test_case, len(test_case)
+        ), f"Wrong result for\n{test_case}"
 
 
 def test_check_if_intact():
-    """generates 50 random polymers of size 3.
-    If check_if_intact returns True one can validate this"""
+    """generates 50 random polymers of size 3,
+    and compares check_if_intact against the brute force check_if_intact_4"""
     test_cases = [np.random.randint(-5, 5, (3, 2)) for _ in range(50)]
     for test_case in test_cases:
-        if polymer.check_if_intact(test_case, len(test_case)):
-            print(f"The polymer\n\t{test_case}\nis intact.\nPlease check")
-            visualization.illustrate_polymer(test_case)
+        assert polymer.check_if_intact(test_case, len(test_case)) == polymer.check_if_intact_4(
+            test_case, len(test_case)
+        ), f"Wrong result for\n{test_case}"
+
+
+def test_check_if_intact_stretched():
+    """checks stretched polymers, whose bounding box is too large for the bitmap"""
+    N = 2000
+    staircase = np.zeros((N, 2), dtype=np.int64)
+    staircase[:, 0] = np.arange(N) // 2 + np.arange(N) % 2
+    staircase[:, 1] = np.arange(N) // 2
+    assert polymer.check_if_intact(staircase, N)
+    # Stepping back onto the monomer before keeps the bonds, but overlaps
+    overlapping = np.vstack((staircase, staircase[-2:-1]))
+    assert not polymer.check_if_intact(overlapping, N + 1)
+    assert directions.check_if_intact(directions.to_directions(staircase))
 
 
 def test_check_if_intact_explicit():
@@ -50,22 +80,61 @@ def test_check_if_intact_explicit():
         print(f"check_if_intact2 gir {polymer.check_if_intact_2(i, len(i))}")
 
 
+def test_check_if_intact_against_check_if_intact_4():
+    """compares check_if_intact and check_if_intact_rotated against
+    the brute force check_if_intact_4 on random walks"""
+    steps = np.array([[1, 0], [-1, 0], [0, 1], [0, -1]])
+    for _ in range(200):
+        N = np.random.randint(2, 15)
+        walk = np.cumsum(steps[np.random.randint(0, 4, N)], axis=0)
+        expected = polymer.check_if_intact_4(walk, N)
+        assert polymer.check_if_intact(walk, N) == expected, f"Wrong result for\n{walk}"
+
+        if not expected or N < 3:
+            continue
+        table = lattice.build_lattice(walk)
+        rotation_center = np.random.randint(2, N)
+        direction = bool(np.random.randint(2))
+        twisted_walk = polymer.rotate_polymer(walk, rotation_center, direction)
+        assert polymer.check_if_intact_rotated(
+            walk, rotation_center, direction, table
+        ) == polymer.check_if_intact_4(twisted_walk, N), f"Wrong result for\n{walk}"
+
+
 def test_rotate_polymer():
     """does some rotations and prints the result"""
+    _, ax = plt.subplots()
     a = np.array([[i, 0] for i in range(15)])
-    visualization.illustrate_polymer(a)
+    visualization.illustrate_polymer(ax, a)
     a = polymer.rotate_polymer(a, 9)
-    visualization.illustrate_polymer(a)
+    visualization.illustrate_polymer(ax, a)
     a = polymer.rotate_polymer(a, 7, False)
-    visualization.illustrate_polymer(a)
+    visualization.illustrate_polymer(ax, a)
     a = polymer.rotate_polymer(a, 10, False)
-    visualization.illustrate_polymer(a)
+    visualization.illustrate_polymer(ax, a)
     a = polymer.rotate_polymer(a, 3, False)
-    visualization.illustrate_polymer(a)
+    visualization.illustrate_polymer(ax, a)
     a = polymer.rotate_polymer(a, 4, False)
-    visualization.illustrate_polymer(a)
+    visualization.illustrate_polymer(ax, a)
     a = polymer.rotate_polymer(a, 5)
-    visualization.illustrate_polymer(a)
+    visualization.illustrate_polymer(ax, a)
+
+
+def test_rotate_polymer_mut():
+    """compares the in place rotation against old_rotate_polymer,
+    and checks that rotating back restores the polymer"""
+    pol = polymer.generate_flat_polymer(15)
+    for _ in range(100):
+        rotation_center = np.random.randint(2, 15)
+        direction = bool(np.random.randint(2))
+        expected = old_rotate_polymer.rotate_polymer(pol, rotation_center, direction)
+        original = pol.copy()
+
+        polymer.rotate_polymer_mut(pol, rotation_center, direction)
+        assert np.all(pol == expected), f"Expected\n\t{expected}\nGot\n\t{pol}"
+        polymer.rotate_polymer_mut(pol, rotation_center, not direction)
+        assert np.all(pol == original), f"Expected\n\t{original}\nGot\n\t{pol}"
+        polymer.rotate_polymer_mut(pol, rotation_center, direction)
 
 
 def test_calculate_energy():
@@ -105,6 +174,215 @@ def test_calculate_energy():
         assert  energy == expected_energy, f"{test_case[1]} has energy {energy}, but expected {expected_energy}"
 
 
+def test_energy_delta():
+    """compares energy_delta against the difference of calculate_energy
+    for random rotations of a random walk."""
+    N = 20
+    V = utilities.gen_V_matrix(N, fill_value=(-2.0, 1.0))
+    pol = polymer.generate_flat_polymer(N)
+    table = lattice.build_lattice(pol)
+    for _ in range(500):
+        rotation_center = np.random.randint(2, N)
+        direction = bool(np.random.randint(2))
+        twisted_pol = polymer.rotate_polymer(pol, rotation_center, direction)
+        if not polymer.check_if_intact(twisted_pol, N):
+            continue
+        delta_E = polymer.energy_delta(pol, V, rotation_center, direction, table)
+        expected = polymer.calculate_energy(twisted_pol, V) - polymer.calculate_energy(pol, V)
+        assert np.isclose(delta_E, expected), f"Got {delta_E}, expected {expected}"
+
+        polymer.apply_rotation(pol, rotation_center, direction, table)
+        assert np.all(pol == twisted_pol)
+
+
+def test_structured_V():
+    """compares the structured interaction matrices against the dense ones"""
+    N = 12
+    V_uniform = utilities.gen_V_uniform(N, -2.0)
+    assert np.all(utilities.V_to_matrix(V_uniform) == utilities.gen_V_matrix(N, -2.0))
+
+    offsets = np.linspace(-1, 1, 5)
+    V_banded = utilities.gen_V_banded(N, offsets)
+    V_pairs = utilities.gen_V_pairs(V_banded, [0, 7, 0], [6, 2, 6], [-5.0, 3.0, -4.0])
+    expected = np.zeros((N, N))
+    for i in range(N):
+        for j in range(N):
+            if 1 < abs(i - j) < len(offsets):
+                expected[i, j] = offsets[abs(i - j)]
+    assert np.all(utilities.V_to_matrix(V_banded) == expected)
+    # The last of two values for the same pair is used
+    expected[0, 6] = expected[6, 0] = -4.0
+    expected[2, 7] = expected[7, 2] = 3.0
+    assert np.all(utilities.V_to_matrix(V_pairs) == expected)
+    for V in (V_uniform, V_banded, V_pairs, expected):
+        V_matrix = V if isinstance(V, np.ndarray) else utilities.V_to_matrix(V)
+        assert all(
+            utilities.interaction(V, i, j) == V_matrix[i, j] for i in range(N) for j in range(N)
+        )
+
+    pol, _ = simulation.alg1(N, 100)
+    for V in (V_uniform, V_banded, V_pairs):
+        V_matrix = utilities.V_to_matrix(V)
+        assert np.isclose(polymer.calculate_energy(pol, V), polymer.calculate_energy_2(pol, V_matrix))
+        table = lattice.build_lattice(pol)
+        for rotation_center in range(2, N):
+            if polymer.check_if_intact_rotated(pol, rotation_center, True, table):
+                assert np.isclose(
+                    polymer.energy_delta(pol, V, rotation_center, True, table),
+                    polymer.energy_delta(pol, V_matrix, rotation_center, True, table),
+                )
+
+
+def test_gen_V_matrix():
+    """checks symmetry, reproducibility, dtype and the memory-mapped output of gen_V_matrix"""
+    N = 50
+    V = utilities.gen_V_matrix(N, fill_value=(-2.0, -1.0), seed=3)
+    assert np.all(V == V.T)
+    assert np.all(V == utilities.gen_V_matrix(N, (-2.0, -1.0), np.random.default_rng(3)))
+    assert np.all(np.diag(V) == 0) and np.all(np.diag(V, 1) == 0)
+    lower_triangle = V[np.tril_indices(N, -2)]
+    assert np.all((lower_triangle >= -2) & (lower_triangle < -1))
+
+    V_32 = utilities.gen_V_matrix(N, fill_value=(-2.0, -1.0), seed=3, dtype=np.float32)
+    assert V_32.dtype == np.float32 and np.all(V_32 == V_32.T)
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "V.npy")
+        utilities.gen_V_matrix(N, fill_value=(-2.0, -1.0), seed=3, filename=filename)
+        assert np.all(np.load(filename, mmap_mode="r") == V)
+
+    # The values do not depend on the blocks of rows in which they are drawn
+    block_values = utilities.V_BLOCK_VALUES
+    try:
+        utilities.V_BLOCK_VALUES = 3 * N
+        assert np.all(utilities.gen_V_matrix(N, fill_value=(-2.0, -1.0), seed=3) == V)
+    finally:
+        utilities.V_BLOCK_VALUES = block_values
+
+
+def test_calculate_diameter():
+    """compares the rotating calipers diameter against the brute force calculate_diameter_1"""
+    for N in (3, 4, 7, 20, 60):
+        for _ in range(20):
+            pol, _ = simulation.alg1(N, 5 * N)
+            d = utilities.calculate_diameter(pol)
+            expected = utilities.calculate_diameter_1(pol)
+            assert np.isclose(d, expected), f"{pol} has diameter {d}, but expected {expected}"
+
+    # Points with empty columns between them
+    assert np.isclose(utilities.calculate_diameter(np.array([[12, 13], [15, 16]])), np.sqrt(18))
+    for _ in range(50):
+        points = np.random.randint(-20, 20, (np.random.randint(1, 10), 2))
+        assert np.isclose(
+            utilities.calculate_diameter(points), utilities.calculate_diameter_1(points)
+        ), f"Wrong diameter for\n{points}"
+
+
+def test_calculate_observables():
+    """compares the fused observables against separate calculations"""
+    N = 40
+    V = utilities.gen_V_matrix(N, fill_value=(-2.0, 1.0))
+    pol, _ = simulation.alg1(N, 500)
+    E, d, R_g, R_ee = utilities.calculate_observables(pol, V)
+    assert np.isclose(E, polymer.calculate_energy_2(pol, V))
+    assert np.isclose(d, utilities.calculate_diameter_1(pol))
+    center_of_mass = np.mean(pol, axis=0)
+    assert np.isclose(R_g, np.sqrt(np.mean(np.sum((pol - center_of_mass) ** 2, axis=1))))
+    assert np.isclose(R_ee, np.linalg.norm(pol[-1] - pol[0]))
+
+
+"""
+Tests for lattice.py
+"""
+
+
+def test_lattice():
+    """inserts and removes random sites and compares the table against a dict"""
+    pol = polymer.generate_flat_polymer(16)
+    table = lattice.build_lattice(pol)
+    expected = {(x, y): i for i, (x, y) in enumerate(pol)}
+    for i in range(2000):
+        x, y = np.random.randint(-8, 8, 2)
+        if (x, y) in expected and np.random.uniform() < 0.5:
+            lattice.remove(table, x, y)
+            del expected[(x, y)]
+        elif len(expected) < len(table) // 2:
+            lattice.insert(table, x, y, i)
+            expected[(x, y)] = i
+        for x in range(-8, 8):
+            for y in range(-8, 8):
+                assert lattice.lookup(table, x, y) == expected.get((x, y), -1)
+
+
+"""
+Tests for rng.py
+"""
+
+
+def test_rng():
+    """checks that the streams are reproducible, independent and roughly uniform"""
+    states = rng.seed_states(1, 2)
+    u = np.array([rng.uniform(states[0]) for _ in range(10_000)])
+    v = np.array([rng.uniform(states[1]) for _ in range(10_000)])
+    state = rng.seed_states(1, 2)[0]
+    assert np.all(u == [rng.uniform(state) for _ in range(10_000)])
+    assert np.all((u >= 0) & (u < 1))
+    assert abs(np.mean(u) - 0.5) < 0.02
+    assert abs(np.corrcoef(u, v)[0, 1]) < 0.05
+    counts = np.bincount([rng.randint(states[0], 2, 6) for _ in range(10_000)])
+    assert np.all(counts[:2] == 0) and np.all(np.abs(counts[2:] - 2500) < 250)
+
+    # The stream of a chain does not depend on the number of chains, and blocks
+    # give the same numbers as drawing them one by one
+    assert np.all(rng.chain_state(1, 1) == rng.seed_states(1, 5)[1])
+    assert np.all(rng.fill_uniform(rng.seed_states(1, 2)[0], np.empty(10_000)) == u)
+    state = rng.chain_state(3, 0)
+    ints = rng.fill_randint(state, 2, 6, np.empty(2 * rng.BLOCK_SIZE, dtype=np.int64))
+    state = rng.chain_state(3, 0)
+    assert np.all(ints == [rng.randint(state, 2, 6) for _ in range(2 * rng.BLOCK_SIZE)])
+
+    # The pivots, directions and acceptance uniforms are drawn a block at a time,
+    # and a copy of the state continues from the same position in the blocks
+    n = rng.BLOCK_SIZE + 10
+    state = rng.chain_state(3, 0)
+    assert np.all(ints[:n] == [rng.draw_pivot(state, 2, 6) for _ in range(n)])
+    state = rng.chain_state(1, 0)
+    assert np.all(u[:n] == [rng.draw_acceptance(state) for _ in range(n)])
+    copy = state.copy()
+    assert [rng.draw_acceptance(state) for _ in range(5)] == [
+        rng.draw_acceptance(copy) for _ in range(5)
+    ]
+    state = rng.chain_state(1, 0)
+    assert np.all((u[:n] < 0.5) == [rng.draw_direction(state) for _ in range(n)])
+
+    pol_1, counter_1 = simulation.alg1(20, 10_000, seed=5)
+    pol_2, counter_2 = simulation.alg1(20, 10_000, seed=5)
+    assert np.all(pol_1 == pol_2) and counter_1 == counter_2
+
+
+"""
+Tests for regression.py
+"""
+
+
+def test_regression():
+    """checks the regression gate on made up benchmark results"""
+
+    def result(name, N, median, spread=0.0):
+        return {"name": name, "N": N, "median": median, "p10": median, "p90": median + spread}
+
+    baseline = {"results": [result("metropolis", 100, 1.0), result("metropolis", 1000, 10.0)]}
+    noisy = {"results": [result("metropolis", 100, 1.5, spread=0.5), result("metropolis", 1000, 11.0)]}
+    slower = {"results": [result("metropolis", 100, 1.0), result("metropolis", 1000, 13.0)]}
+    assert regression.compare(baseline, noisy) == []
+    assert len(regression.compare(baseline, slower)) == 1
+
+    quadratic = {"results": [result("check_if_intact", N, 1e-9 * N**2) for N in (10, 100, 1000)]}
+    assert np.isclose(regression.scaling_exponents(quadratic)["check_if_intact"], 2)
+    assert len(regression.check_scaling(quadratic)) == 1
+    assert regression.check_scaling(baseline) == []
+
+
 """
 Tests for visualization.py
 """
@@ -125,7 +403,40 @@ def test_visualization():
 
     for p in polymers_to_test:
         print(p)
-        visualization.illustrate_polymer(p, title=str(p))
+        _, ax = plt.subplots()
+        visualization.illustrate_polymer(ax, p, title=str(p))
+    plt.close("all")
+
+
+def test_illustrate_large_polymer():
+    """checks that large polymers are drawn as a line with a limited number of points,
+    and that an animation of a trajectory can be drawn"""
+    N = 5000
+    _, ax = plt.subplots()
+    artist = visualization.illustrate_polymer(
+        ax, polymer.generate_flat_polymer(N), max_cells=1000, max_points=100
+    )
+    # 101 points: every 50th monomer, and the last one
+    assert len(artist.get_segments()) == 100
+    pol, _ = simulation.alg1(15, 100, seed=1)
+    Z = visualization.illustrate_polymer(ax, pol, numbers=True).get_array()
+    assert np.sort(Z[Z > 0]).tolist() == list(range(2, 17))
+
+    pols = np.array([simulation.alg1(30, Ns, seed=2)[0] for Ns in range(0, 200, 20)])
+    assert visualization.trajectory_bounds(pols, np.arange(0, 10, 3), block=2) == (
+        pols[::3, :, 0].min(),
+        pols[::3, :, 0].max(),
+        pols[::3, :, 1].min(),
+        pols[::3, :, 1].max(),
+    )
+    _, ax = plt.subplots()
+    animation = visualization.animate_trajectory(pols, ax, every=3)
+    with tempfile.TemporaryDirectory() as directory:
+        animation.save(os.path.join(directory, "pols.gif"), writer="pillow")
+    # The last frame drawn is frame 9
+    assert np.all(ax.lines[0].get_xydata() == pols[9] + 0.5)
+    assert ax.texts[0].get_text() == "frame 9"
+    plt.close("all")
 
 
 """
@@ -139,22 +450,499 @@ def test_metropolis():
     pol = polymer.generate_flat_polymer(11)
     N_s = 1000
     pol, E_array = simulation.metropolis(pol, N_s, V, T)
-    visualization.illustrate_polymer(pol, numbers=True)
+    _, ax = plt.subplots()
+    visualization.illustrate_polymer(ax, pol, numbers=True)
     print(E_array)
 
 
+def test_metropolis_diameter():
+    """checks that the tracked energy and diameter match a full recalculation"""
+    N = 15
+    V = utilities.gen_V_matrix(N, fill_value=-1.0)
+    pol, E_array, d_array = simulation.metropolis_diameter(
+        polymer.generate_flat_polymer(N), 1000, V, 1e23
+    )
+    assert polymer.check_if_intact(pol, N)
+    assert np.isclose(E_array[-1], polymer.calculate_energy(pol, V))
+    assert np.isclose(d_array[-1], utilities.calculate_diameter(pol))
+
+
+def test_metropolis_stream():
+    """compares the streamed statistics against the full traces"""
+    N = 15
+    V = utilities.gen_V_matrix(N, fill_value=-1.0)
+    N_s, burn_in, thinning = 2000, 500, 3
+    acc = accumulator.new_accumulator(burn_in, thinning, 10, -12.5, 0.5)
+    E_trace = np.zeros(N_s)
+    d_trace = np.zeros(N_s)
+    simulation.metropolis_stream(
+        polymer.generate_flat_polymer(N), N_s, V, 1e23, acc, True, E_trace, d_trace
+    )
+    E_samples = E_trace[burn_in::thinning]
+    d_samples = d_trace[burn_in::thinning]
+    assert accumulator.count(acc) == len(E_samples)
+    assert np.isclose(accumulator.mean(acc), np.mean(E_samples))
+    assert np.isclose(accumulator.std(acc), np.std(E_samples))
+    assert np.isclose(accumulator.mean(acc, accumulator.DIAMETER), np.mean(d_samples))
+    assert np.isclose(accumulator.std(acc, accumulator.DIAMETER), np.std(d_samples))
+    assert 0 < accumulator.acceptance_rate(acc) <= 1
+
+    counts, edges, outside = accumulator.histogram(acc)
+    expected_counts, _ = np.histogram(E_samples, edges)
+    assert np.all(counts == expected_counts)
+    assert outside == len(E_samples) - np.sum(expected_counts)
+
+
+def test_temperature_sweep():
+    """checks the shapes and the pooling of the replicas in temperature_sweep"""
+    N = 10
+    V = utilities.gen_V_matrix(N, fill_value=-1.0)
+    Ns = (150, 200)
+    T_array = np.array([1e20, 1e23])
+    E_mean, E_std, d_mean, d_std = simulation.temperature_sweep(
+        N, Ns, T_array, V, n_replicas=3, burn_in=100
+    )
+    for res in (E_mean, E_std, d_mean, d_std):
+        assert res.shape == (len(Ns), len(T_array))
+        assert np.all(np.isfinite(res))
+    assert np.all(E_mean <= 0) and np.all(E_std >= 0)
+    assert np.all(d_mean > 0) and np.all(d_mean <= N - 1)
+
+    # Seeded sweeps are reproducible, whichever thread runs each chain
+    res_1 = simulation.temperature_sweep(N, Ns, T_array, V, n_replicas=3, burn_in=100, seed=4)
+    res_2 = simulation.temperature_sweep(N, Ns, T_array, V, n_replicas=3, burn_in=100, seed=4)
+    assert all(np.all(a == b) for a, b in zip(res_1, res_2))
+
+
+def test_metropolis_batch():
+    """checks that the batched chains are reproducible and track their energies"""
+    N = 15
+    R = 4
+    V = utilities.gen_V_matrix(N, fill_value=-4e-21)
+    pols = np.repeat(polymer.generate_flat_polymer(N)[None], R, axis=0)
+    pols_1, E_array_1, accepted_1 = simulation.metropolis_batch(pols, 500, V, 150.0, 7)
+    pols_2, E_array_2, accepted_2 = simulation.metropolis_batch(pols, 500, V, 150.0, 7)
+    assert np.all(pols_1 == pols_2) and np.all(E_array_1 == E_array_2)
+    assert np.all(accepted_1 == accepted_2) and np.all(accepted_1 > 0)
+    assert E_array_1.shape == (R, 500)
+    for pol, E in zip(pols_1, E_array_1[:, -1]):
+        assert polymer.check_if_intact(pol, N)
+        assert np.isclose(E, polymer.calculate_energy(pol, V))
+
+
+def test_parallel_tempering():
+    """checks the energies of the final polymers, and that swaps between
+    equal temperatures are always accepted"""
+    N = 15
+    V = utilities.gen_V_matrix(N, fill_value=-4e-21)
+    T_array = np.array([70.0, 70.0, 200.0, 350.0])
+    pols, E_array, swap_rates = simulation.parallel_tempering(
+        polymer.generate_flat_polymer(N), 500, V, T_array, 10
+    )
+    assert E_array.shape == (len(T_array), 500)
+    for pol, E in zip(pols, E_array[:, -1]):
+        assert polymer.check_if_intact(pol, N)
+        assert np.isclose(E, polymer.calculate_energy(pol, V))
+    assert swap_rates[0] == 1
+    assert np.all((swap_rates >= 0) & (swap_rates <= 1))
+
+    pols_1, E_array_1, _ = simulation.parallel_tempering(pols[0], 500, V, T_array, 10, seed=2)
+    pols_2, E_array_2, _ = simulation.parallel_tempering(pols[0], 500, V, T_array, 10, seed=2)
+    assert np.all(pols_1 == pols_2) and np.all(E_array_1 == E_array_2)
+
+
+def test_valid_rotation_map():
+    """checks the counts at the checkpoints against alg1 with the same stream,
+    and the shapes and the confidence intervals"""
+    Ns = (5000, 10, 700)
+    mean, lower, upper = simulation.valid_rotation_map([7], Ns, seed=3)
+    # The first chain has the stream of alg1 with the same seed
+    for k, Ns_k in enumerate(Ns):
+        assert np.isclose(mean[k, 0] * Ns_k, simulation.alg1(7, Ns_k, seed=3)[1] - 1)
+    assert np.all(np.isnan(lower))
+
+    N_array = np.arange(5, 30, 4)
+    mean, lower, upper = simulation.valid_rotation_map(N_array, Ns, replicas=4, seed=1)
+    assert mean.shape == (len(Ns), len(N_array))
+    assert np.all((mean > 0) & (mean <= 1))
+    assert np.all((lower <= mean) & (mean <= upper))
+
+def test_metropolis_reduced():
+    """checks that the reduced units give the same run as metropolis_segment when the sums
+    of the energies are exact in floating point, and that the energy is tracked exactly"""
+    N = 30
+    # A power of 2, so that the sums of the energies in Joule are exact as well
+    eps = -(2.0**-70)
+    for V in (
+        utilities.gen_V_matrix(N, fill_value=eps),
+        utilities.gen_V_banded(N, np.array([0.0, 0.0, eps, 2 * eps]), extend=True),
+    ):
+        pol_1 = polymer.generate_flat_polymer(N)
+        E_1 = np.zeros(5000)
+        table = lattice.build_lattice(pol_1)
+        acc = accumulator.new_accumulator()
+        state = rng.chain_state(5, 0)
+        simulation.metropolis_segment(pol_1, 0.0, table, state, 0, 5000, V, 150.0, acc, False, E_1)
+        E_2 = np.zeros(5000, dtype=np.int64)
+        pol_2, unit = simulation.metropolis_reduced(
+            polymer.generate_flat_polymer(N), 5000, V, 150.0, seed=5, E_trace=E_2
+        )
+        assert unit == -eps
+        assert np.all(pol_1 == pol_2) and np.all(E_1 == E_2 * unit)
+
+    V = utilities.gen_V_uniform(N, -4e-21)
+    E = np.zeros(5000, dtype=np.int64)
+    acc = accumulator.new_accumulator()
+    pol, unit = simulation.metropolis_reduced(
+        polymer.generate_flat_polymer(N), 5000, V, 150.0, acc=acc, E_trace=E
+    )
+    assert np.isclose(E[-1] * unit, polymer.calculate_energy(pol, V))
+    assert np.isclose(accumulator.mean(acc), E.mean() * unit)
+    try:
+        utilities.reduced_V(utilities.gen_V_matrix(N, fill_value=(-2.0, -1.0), seed=3))
+        assert False, "Expected a ValueError for values without a common unit"
+    except ValueError:
+        pass
+
+
+"""
+Tests for directions.py
+"""
+
+
+def test_directions():
+    """checks the conversions and the rotations against the coordinate representation"""
+    for N in (3, 4, 7, 30):
+        pol, _ = simulation.alg1(N, 200, seed=N)
+        V = utilities.gen_V_matrix(N)
+        bonds = directions.to_directions(pol)
+        assert bonds.dtype == np.uint8 and len(bonds) == N - 1
+        assert np.all(directions.to_polymer(bonds, pol[0, 0], pol[0, 1]) == pol)
+        assert np.isclose(
+            directions.calculate_energy(bonds, V), polymer.calculate_energy(pol, V)
+        )
+        for rotation_center in range(1, N + 1):
+            for positive_direction in (True, False):
+                expected = polymer.rotate_polymer(pol, rotation_center, positive_direction)
+                res = directions.rotate_directions(bonds, rotation_center, positive_direction)
+                assert np.all(
+                    directions.to_polymer(res, expected[0, 0], expected[0, 1]) == expected
+                )
+                assert directions.check_if_intact(res) == polymer.check_if_intact(
+                    expected, N
+                )
+    assert not directions.check_if_intact(np.array([0, 1, 2, 3], dtype=np.uint8))
+    assert directions.check_if_intact(directions.generate_flat_directions(10))
+
+    # A seeded run is the same run as in the coordinate representation
+    bonds = directions.generate_flat_directions(10)
+    V = utilities.gen_V_matrix(10, fill_value=-4e-21)
+    res, E_1 = directions.metropolis(bonds, 1000, V, 150.0, seed=2)
+    pol, E_2 = simulation.metropolis(directions.to_polymer(bonds), 1000, V, 150.0, seed=2)
+    assert np.all(res == directions.to_directions(pol)) and np.all(E_1 == E_2)
+
+
+"""
+Tests for enumeration.py
+"""
+
+
+def test_density_of_states():
+    """checks the exact enumeration against a brute force enumeration without symmetry reduction,
+    and the number of self-avoiding walks against the known numbers"""
+    N = 7
+    V = utilities.gen_V_matrix(N, fill_value=(-2.0, 0.0), seed=5)
+    # The bonded neighbours count as in polymer.calculate_energy, if V has them
+    V_bonded = V + np.diag(np.full(N - 1, -0.5), 1) + np.diag(np.full(N - 1, -0.5), -1)
+    for V in (V, V_bonded):
+        E_brute = []
+        d_brute = []
+        for bonds in np.ndindex(*(4,) * (N - 1)):
+            bonds = np.array(bonds, dtype=np.uint8)
+            if directions.check_if_intact(bonds):
+                pol = directions.to_polymer(bonds)
+                E_brute.append(polymer.calculate_energy(pol, V))
+                d_brute.append(utilities.calculate_diameter(pol))
+        dos = enumeration.density_of_states(N, V)
+        assert dos.degeneracy.sum() == len(E_brute) == 780
+
+        T_array = np.array([1e20, 1e22])
+        E_mean, _, d_mean, _, C_v = enumeration.exact_averages(dos, T_array)
+        for T, E, d, C in zip(T_array, E_mean, d_mean, C_v):
+            boltzmann = np.exp(-(np.array(E_brute) - min(E_brute)) / (Boltzmann * T))
+            boltzmann /= boltzmann.sum()
+            assert np.isclose(E, boltzmann @ E_brute)
+            assert np.isclose(d, boltzmann @ d_brute)
+            assert np.isclose(C, (boltzmann @ np.square(E_brute) - E**2) / (Boltzmann * T**2))
+
+    dos = enumeration.density_of_states(12, utilities.gen_V_uniform(12))
+    assert dos.degeneracy.sum() == 120292
+    # The most compact conformations: 3 x 4 rectangles with 6 contacts
+    assert dos.energies.min() == -6
+
+
+"""
+Tests for wang_landau.py
+"""
+
+
+def test_wang_landau():
+    """checks the estimated density of states and thermal averages against the exact enumeration"""
+    N = 10
+    eps = -4e-21
+    V = utilities.gen_V_uniform(N, eps)
+    # Bins centred on the possible numbers of contacts, 4, 3, ..., 0
+    result = wang_landau.wang_landau(
+        N, V, 4.5 * eps, -0.5 * eps, 5, 2, log_f_final=1e-5, check_interval=1000, seed=1
+    )
+    dos = enumeration.density_of_states(N, V)
+    contacts = np.round(dos.energies / eps)
+    g = np.array([dos.degeneracy[contacts == k].sum() for k in range(4, -1, -1)])
+    assert np.allclose(np.exp(result.log_g), g / g.sum(), rtol=0.05)
+
+    T_array = np.array([50.0, 150.0, 300.0, 1000.0])
+    estimate = wang_landau.canonical_averages(result, T_array)
+    exact = enumeration.exact_averages(dos, T_array)
+    for res, expected in zip(estimate, exact):
+        assert np.allclose(res, expected, rtol=0.05)
+
+    try:
+        wang_landau.wang_landau(N, V, 4.5 * eps, -0.5 * eps, 5, 2, max_steps=0)
+        assert False, "Expected a ValueError for walkers without a common bin"
+    except ValueError:
+        pass
+
+
+"""
+Tests for reweighting.py
+"""
+
+
+def test_reweighting():
+    """checks WHAM and single histogram reweighting on histograms drawn from the exact distributions"""
+    N = 10
+    eps = -4e-21
+    dos = enumeration.density_of_states(N, utilities.gen_V_uniform(N, eps))
+    T_runs = [100.0, 300.0]
+    accs = []
+    for T in T_runs:
+        acc = accumulator.new_accumulator(0, 1, 5, 4.5 * eps, -0.5 * eps)
+        p = reweighting.canonical_weights(np.log(dos.degeneracy), dos.energies, [T])[0]
+        for E, n in zip(dos.energies, np.round(p * 20_000).astype(int)):
+            for _ in range(n):
+                accumulator.observe(acc, E, np.nan, False)
+        accs.append(acc)
+
+    T_array = np.linspace(80.0, 400.0, 5)
+    E_exact, _, _, _, C_v_exact = enumeration.exact_averages(dos, T_array)
+    E_mean, E_err, C_v, C_v_err = reweighting.wham(accs, T_runs, T_array, seed=0)
+    assert np.allclose(E_mean, E_exact, rtol=1e-3)
+    assert np.allclose(C_v, C_v_exact, rtol=1e-2)
+    assert np.all(E_err > 0) and np.all(C_v_err > 0)
+
+    T_near = np.array([90.0, 100.0, 110.0])
+    E_mean, _, _, _ = reweighting.single_histogram(accs[0], 100.0, T_near, n_bootstrap=0)
+    assert np.allclose(E_mean, enumeration.exact_averages(dos, T_near)[0], rtol=1e-3)
+
+
+"""
+Tests for checkpoint.py
+"""
+
+
+def test_checkpoint():
+    """checks that a run which is stopped and resumed from its checkpoint
+    equals a run in one go"""
+    N = 15
+    V = utilities.gen_V_matrix(N, fill_value=-4e-21)
+    pol = polymer.generate_flat_polymer(N)
+    with tempfile.TemporaryDirectory() as directory:
+        path_1 = os.path.join(directory, "once.npz")
+        path_2 = os.path.join(directory, "resumed.npz")
+        pol_1, acc_1 = checkpoint.run_metropolis(path_1, pol, 1000, V, 150.0, diameter=True, seed=3)
+        # Stopped after 400 steps, and resumed with segments of another length
+        checkpoint.run_metropolis(path_2, pol, 400, V, 150.0, diameter=True, seed=3)
+        pol_2, acc_2 = checkpoint.run_metropolis(
+            path_2, None, 1000, V, 150.0, diameter=True, segment_steps=170
+        )
+        assert np.all(pol_1 == pol_2) and np.all(acc_1 == acc_2)
+        assert checkpoint.load(path_2)["step"] == 1000
+        assert np.isclose(checkpoint.load(path_2)["E"], polymer.calculate_energy(pol_2, V))
+        # No temporary files are left behind
+        assert sorted(os.listdir(directory)) == ["once.npz", "resumed.npz"]
+        try:
+            checkpoint.run_metropolis(
+                path_2, None, 2000, utilities.gen_V_uniform(N, -4e-21), 150.0, diameter=True
+            )
+            assert False, "Expected a ValueError for another V"
+        except ValueError:
+            pass
+
+
+"""
+Tests for trajectory.py
+"""
+
+
+def test_trajectory():
+    """checks that the polymers of a trajectory are decoded exactly, and that recording
+    does not change the simulation"""
+    N = 30
+    V = utilities.gen_V_matrix(N, fill_value=-4e-21)
+    pol = polymer.generate_flat_polymer(N)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "run.traj")
+        pol_1, acc_1 = trajectory.record_metropolis(
+            path, pol, 1000, V, 150.0, every=7, seed=2, buffer_frames=10
+        )
+        pol_2, acc_2 = checkpoint.run_metropolis(
+            os.path.join(directory, "run.npz"), pol, 1000, V, 150.0, seed=2
+        )
+        assert np.all(pol_1 == pol_2) and np.all(acc_1 == acc_2)
+
+        traj = trajectory.Trajectory(path)
+        assert traj.N == N and len(traj) == 143
+        assert np.all(traj.steps == np.arange(0, 1000, 7))
+        assert np.all(traj[0] == pol)
+        pols = traj[::-1]
+        assert np.all(pols[0] == traj[-1])
+        for pol_i, E in zip(pols, traj.energies[::-1]):
+            assert polymer.check_if_intact(pol_i, N)
+            assert np.isclose(E, polymer.calculate_energy(pol_i, V))
+
+        # Appending to the trajectory, after a frame which was only partly written
+        with open(path, "ab") as file:
+            file.write(b"\x00" * 5)
+        with trajectory.TrajectoryWriter(path, N, append=True) as writer:
+            writer.write(pol_1, 1000, polymer.calculate_energy(pol_1, V))
+        traj = trajectory.Trajectory(path)
+        assert len(traj) == 144 and np.all(traj[-1] == pol_1)
+
+
+"""
+Tests for moves.py
+"""
+
+
+def test_moves():
+    """checks that every move type keeps the polymer intact and tracks the energy,
+    and that the moves sample the exact distribution"""
+    N = 8
+    eps = -4e-21
+    V = utilities.gen_V_uniform(N, eps)
+    pol = polymer.generate_flat_polymer(N)
+    for move in range(moves.N_MOVES):
+        weights = np.zeros(moves.N_MOVES)
+        weights[move] = 1
+        # Corner and crankshaft moves need pivots to bend the flat polymer first
+        weights[moves.PIVOT] = 1
+        E_trace = np.zeros(5000)
+        pol_1, stats = moves.metropolis_moves(
+            pol, 5000, V, 300.0, weights, seed=move, E_trace=E_trace
+        )
+        assert polymer.check_if_intact(pol_1, N)
+        assert np.isclose(E_trace[-1], polymer.calculate_energy(pol_1, V))
+        assert stats[move, moves.ACCEPTED] > 0
+        assert np.all(stats[:, moves.VALID] <= stats[:, moves.ATTEMPTED])
+
+    dos = enumeration.density_of_states(N, V)
+    E_exact = enumeration.exact_averages(dos, [400.0])[0][0]
+    acc = accumulator.new_accumulator(burn_in=10_000)
+    moves.metropolis_moves(pol, 1_000_000, V, 400.0, seed=0, acc=acc)
+    assert np.isclose(accumulator.mean(acc), E_exact, rtol=0.02)
+
+
+"""
+Tests for cache.py
+"""
+
+
+def test_cache():
+    """checks that seeded calls are read from the cache, that the key depends on V,
+    and that the least recently used entries are evicted"""
+    N = 15
+    V = utilities.gen_V_matrix(N, fill_value=-4e-21)
+    pol = polymer.generate_flat_polymer(N)
+    with tempfile.TemporaryDirectory() as directory:
+        results = cache.ResultCache(directory)
+        metropolis = results.cached(simulation.metropolis)
+        pol_1, E_1 = metropolis(pol, 500, V, 150.0, seed=1)
+        pol_2, E_2 = metropolis(pol, 500, V, 150, seed=1)
+        assert results.hits == 1 and results.misses == 1
+        assert np.all(pol_1 == pol_2) and np.all(E_1 == E_2) and pol_1.dtype == pol_2.dtype
+
+        # The same matrix as a structured matrix is a different input
+        V_uniform = utilities.gen_V_uniform(N, -4e-21)
+        metropolis(pol, 500, V_uniform, 150.0, seed=1)
+        # Calls without a seed are not cached
+        metropolis(pol, 500, V, 150.0)
+        assert results.misses == 2 and len(results.entries()) == 2
+
+        runs = results.map(
+            simulation.metropolis, [{"T": 100.0}, {"T": 150.0}], pol=pol, N_s=500, V=V, seed=1
+        )
+        assert results.hits == 2 and results.misses == 3
+        assert np.all(runs[1][1] == E_1)
+
+        # The entry of the structured matrix is the least recently used
+        results.max_bytes = results.size() - 1
+        results.evict()
+        keys = [key for key, _, _ in results.entries()]
+        assert len(keys) == 2
+        assert results.key(simulation.metropolis, pol, 500, V_uniform, 150.0, 1) not in keys
+
+        # Namedtuples are rebuilt when read
+        results.max_bytes = 2**30
+        V_uniform = utilities.gen_V_uniform(6, -4e-21)
+        cached_wang_landau = results.cached(wang_landau.wang_landau)
+        arguments = (6, V_uniform, -10e-21, 2e-21, 3, 1, 1e-3, 0.8, 1000, 10**9, 1)
+        result_1 = cached_wang_landau(*arguments)
+        result_2 = cached_wang_landau(*arguments)
+        assert results.hits == 3 and type(result_2) is wang_landau.WangLandauResult
+        assert np.all(result_1.log_g == result_2.log_g)
+        wang_landau.canonical_averages(result_2, np.array([150.0]))
+
+
 if __name__ == "__main__":
     tests = [
         # test_generate_flat_polymer,
         # test_check_if_intact2,
         # test_check_if_intact,
+        # test_check_if_intact_stretched,
         # test_check_if_intact_explicit,
+        # test_check_if_intact_against_check_if_intact_4,
         # test_visualization,
+        # test_illustrate_large_polymer,
         test_rotate_polymer,
+        # test_rotate_polymer_mut,
         # test_calculate_energy,
         # test_metropolis,
+        # test_metropolis_diameter,
+        # test_metropolis_stream,
+        # test_temperature_sweep,
+        # test_metropolis_batch,
+        # test_parallel_tempering,
+        # test_valid_rotation_map,
+        # test_metropolis_reduced,
+        # test_directions,
+        # test_density_of_states,
+        # test_wang_landau,
+        # test_reweighting,
+        # test_checkpoint,
+        # test_trajectory,
+        # test_moves,
+        # test_cache,
         # test_calculate_energy,
+        # test_energy_delta,
+        # test_structured_V,
+        # test_gen_V_matrix,
+        # test_calculate_diameter,
+        # test_calculate_observables,
+        # test_lattice,
+        # test_rng,
+        # test_regression,
     ]
 
     for i, test in enumerate(tests):
         test()
+
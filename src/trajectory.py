@@ -0,0 +1,298 @@
+import os
+
+import numpy as np
+import accumulator
+import directions
+import lattice
+import polymer
+import rng
+import simulation
+import utilities
+from numba import njit
+
+"""
+Compact binary trajectories: a sequence of polymers (frames) of a simulation.
+
+A polymer is stored as the coordinates of its first monomer and the direction of every bond,
+which is one of the four lattice directions, packed into 2 bits. A frame of a 500-mer takes
+149 bytes, so a million frames fit in 150 MB. The frames have a fixed size, so the file is
+read by memory-mapping it, and only the frames which are indexed are decoded.
+
+file: [
+       magic, N                    <- header
+       step, E, x_0, y_0, bonds    <- frame 0
+       step, E, x_0, y_0, bonds    <- frame 1
+       .
+       .
+       .
+       ]
+
+bonds: (N + 2) // 4 bytes, bond k (from monomer k to k + 1) in bits 2 * (k % 4) of byte k // 4
+direction: 0 = +x, 1 = +y, 2 = -x, 3 = -y, as in directions.py
+
+Usage:
+    pol, acc = trajectory.record_metropolis("run.traj", pol, 10**6, V, T, every=100)
+    traj = trajectory.Trajectory("run.traj")
+    pols = traj[1000:2000]  # (1000, N, 2) array
+"""
+
+MAGIC = b"POLYTRJ1"
+HEADER = np.dtype([("magic", "S8"), ("N", "<i8")])
+
+
+def frame_dtype(N: int) -> np.dtype:
+    """The record of one frame of a polymer of length N"""
+    return np.dtype(
+        [
+            ("step", "<i8"),
+            ("E", "<f8"),
+            ("start", "<i4", (2,)),
+            ("bonds", "u1", ((N + 2) // 4,)),
+        ]
+    )
+
+
+@njit(cache=True)
+def encode_bonds(polymer: np.ndarray, bonds: np.ndarray) -> None:
+    """Packs the bond directions of a polymer, 2 bits per bond
+
+    Args:
+        polymer: the polymer, which must be intact
+        bonds: array of (N + 2) // 4 uint8, overwritten with the packed directions
+    """
+    bonds[:] = 0
+    for k in range(len(polymer) - 1):
+        direction = directions.direction_of(
+            polymer[k + 1, 0] - polymer[k, 0], polymer[k + 1, 1] - polymer[k, 1]
+        )
+        bonds[k >> 2] |= np.uint8(direction << (2 * (k & 3)))
+
+
+def decode(frames: np.ndarray, N: int) -> np.ndarray:
+    """Decodes frames into polymers
+
+    Args:
+        frames: array of frame_dtype(N)
+        N: length of the polymers
+
+    Returns:
+        (len(frames), N, 2) array with the polymers
+    """
+    frames = np.asarray(frames)
+    shifts = np.arange(0, 8, 2, dtype=np.uint8)
+    bond_directions = (frames["bonds"][:, :, None] >> shifts) & 3
+    bond_directions = bond_directions.reshape(len(frames), -1)[:, : N - 1]
+
+    pols = np.empty((len(frames), N, 2), dtype=np.int32)
+    pols[:, 0] = frames["start"]
+    steps = directions.DIRECTIONS[bond_directions]
+    pols[:, 1:] = frames["start"][:, None] + np.cumsum(steps, axis=1)
+    return pols
+
+
+class TrajectoryWriter:
+    """Appends frames to a trajectory file. Use as a context manager, or call close.
+
+    Args:
+        path: path of the trajectory
+        N: length of the polymers
+        append: keep the frames of an existing trajectory (e.g. when resuming a run)
+    """
+
+    def __init__(self, path: str, N: int, append: bool = False):
+        self.N = N
+        self.dtype = frame_dtype(N)
+        if append and os.path.exists(path):
+            header = np.fromfile(path, dtype=HEADER, count=1)[0]
+            if header["magic"] != MAGIC or header["N"] != N:
+                raise ValueError(f"{path} is not a trajectory of polymers of length {N}")
+            self.file = open(path, "r+b")
+            # A frame which was only partly written (e.g. by a crash) is dropped
+            n_frames = (os.path.getsize(path) - HEADER.itemsize) // self.dtype.itemsize
+            self.file.truncate(HEADER.itemsize + n_frames * self.dtype.itemsize)
+            self.file.seek(0, os.SEEK_END)
+        else:
+            self.file = open(path, "wb")
+            np.array([(MAGIC, N)], dtype=HEADER).tofile(self.file)
+
+    def write(self, pol: np.ndarray, step: int = 0, E: float = np.nan) -> None:
+        """Appends a polymer
+
+        Args:
+            pol: the polymer
+            step: the Monte Carlo step of the polymer
+            E: the energy of the polymer
+        """
+        frame = np.zeros(1, dtype=self.dtype)
+        frame["step"] = step
+        frame["E"] = E
+        frame["start"] = pol[0]
+        encode_bonds(pol, frame["bonds"][0])
+        frame.tofile(self.file)
+
+    def write_frames(self, frames: np.ndarray) -> None:
+        """Appends frames which are already encoded, see frame_dtype"""
+        np.asarray(frames, dtype=self.dtype).tofile(self.file)
+
+    def close(self) -> None:
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class Trajectory:
+    """Memory-mapped trajectory. Indexing (with an int, slice or array of indices)
+    decodes only the frames which are asked for.
+
+    Args:
+        path: path of the trajectory
+
+    Attributes:
+        N: length of the polymers
+        frames: the memory-mapped frames, see frame_dtype
+        steps: Monte Carlo step of every frame
+        energies: energy of every frame
+    """
+
+    def __init__(self, path: str):
+        header = np.fromfile(path, dtype=HEADER, count=1)
+        if len(header) == 0 or header[0]["magic"] != MAGIC:
+            raise ValueError(f"{path} is not a trajectory")
+        self.N = int(header[0]["N"])
+        dtype = frame_dtype(self.N)
+        n_frames = (os.path.getsize(path) - HEADER.itemsize) // dtype.itemsize
+        if n_frames > 0:
+            self.frames = np.memmap(
+                path, dtype=dtype, mode="r", offset=HEADER.itemsize, shape=(n_frames,)
+            )
+        else:
+            # np.memmap can not map an empty file region
+            self.frames = np.zeros(0, dtype=dtype)
+        self.steps = self.frames["step"]
+        self.energies = self.frames["E"]
+
+    def __len__(self) -> int:
+        return len(self.frames)
+
+    def __getitem__(self, index) -> np.ndarray:
+        if np.isscalar(index):
+            return decode(self.frames[index : index + 1 or None], self.N)[0]
+        return decode(self.frames[index], self.N)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+@njit(cache=True)
+def _record_frames(
+    pol: np.ndarray,
+    E: float,
+    table: np.ndarray,
+    state: np.ndarray,
+    first_frame: int,
+    every: int,
+    N_s: int,
+    V: np.ndarray | utilities.StructuredV,
+    T: float,
+    acc: np.ndarray,
+    steps: np.ndarray,
+    energies: np.ndarray,
+    starts: np.ndarray,
+    bonds: np.ndarray,
+) -> tuple[float, int]:
+    """Runs the Metropolis-algorithm up to the step of every frame, from frame first_frame
+    (at step first_frame * every), and encodes the polymers until the buffers are full
+
+    Returns:
+        (energy of the polymer, number of frames encoded)
+    """
+    n = 0
+    done = first_frame * every - every + 1 if first_frame > 0 else 0
+    while n < len(steps) and (first_frame + n) * every < N_s:
+        step = (first_frame + n) * every
+        E = simulation.metropolis_segment(pol, E, table, state, done, step + 1, V, T, acc)
+        done = step + 1
+        steps[n] = step
+        energies[n] = E
+        starts[n] = pol[0]
+        encode_bonds(pol, bonds[n])
+        n += 1
+    return E, n
+
+
+def record_metropolis(
+    path: str,
+    pol: np.ndarray,
+    N_s: int,
+    V: np.ndarray | utilities.StructuredV,
+    T: float,
+    every: int = 1,
+    acc: np.ndarray | None = None,
+    seed: int | None = None,
+    buffer_frames: int = 4096,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Runs the Metropolis-algorithm and writes the polymer of every every-th step
+    (steps 0, every, 2 * every, ...) to a trajectory
+
+    Args:
+        path: path of the trajectory, which is overwritten
+        pol: Polymer initial state
+        N_s: Rotation attempts
+        V: Interaction forces between two monomers, dense or utilities.StructuredV
+        T: Temperature (Kelvin)
+        every: number of steps between the frames
+        acc: Accumulator for the observables. A new one (no burn-in, no histogram) if None
+        seed: seed of the random number stream. Not reproducible if None
+        buffer_frames: number of frames which are encoded before they are written
+
+    Returns:
+        (last polymer, accumulator)
+    """
+    N = len(pol)
+    pol = pol.copy()
+    E = polymer.calculate_energy(pol, V)
+    table = lattice.build_lattice(pol)
+    state = rng.seed_from_global() if seed is None else rng.chain_state(seed, 0)
+    if acc is None:
+        acc = accumulator.new_accumulator()
+
+    frames = np.zeros(buffer_frames, dtype=frame_dtype(N))
+    steps = np.zeros(buffer_frames, dtype=np.int64)
+    energies = np.zeros(buffer_frames)
+    starts = np.zeros((buffer_frames, 2), dtype=np.int32)
+    bonds = np.zeros((buffer_frames, frames.dtype["bonds"].shape[0]), dtype=np.uint8)
+    n_frames = 0
+    with TrajectoryWriter(path, N) as writer:
+        while n_frames * every < N_s:
+            E, n = _record_frames(
+                pol,
+                E,
+                table,
+                state,
+                n_frames,
+                every,
+                N_s,
+                V,
+                T,
+                acc,
+                steps,
+                energies,
+                starts,
+                bonds,
+            )
+            frames["step"][:n] = steps[:n]
+            frames["E"][:n] = energies[:n]
+            frames["start"][:n] = starts[:n]
+            frames["bonds"][:n] = bonds[:n]
+            writer.write_frames(frames[:n])
+            n_frames += n
+
+    # The steps after the last frame
+    done = (n_frames - 1) * every + 1 if n_frames > 0 else 0
+    simulation.metropolis_segment(pol, E, table, state, done, N_s, V, T, acc, False)
+    return pol, acc
@@ -1,10 +1,32 @@
 import numpy as np
+from collections import namedtuple
 from scipy.spatial.distance import cdist
-from numba import njit
+from numba import njit, types
+from numba.extending import overload
+import lattice
+
+"""
+Structured interaction matrices, for when the dense N x N matrix from gen_V_matrix is too large.
+
+StructuredV(size, offsets, pair_keys, pair_values):
+    V[i, j] = pair_values[k]  if pair_keys[k] == min(i, j) * size + max(i, j)
+    V[i, j] = offsets[min(|i - j|, len(offsets) - 1)]  otherwise
+
+That is, the strength depends only on |i - j| (the last value of offsets is used for all larger distances),
+except for a sorted list of custom pairs (COO).
+"""
+StructuredV = namedtuple("StructuredV", ["size", "offsets", "pair_keys", "pair_values"])
+
+# Number of values of a random V which are drawn or mirrored at a time
+V_BLOCK_VALUES = 2**22
 
 
 def gen_V_matrix(
-    size: int, fill_value: float | tuple[float, float] = -1.0
+    size: int,
+    fill_value: float | tuple[float, float] = -1.0,
+    seed: int | np.random.Generator | None = None,
+    dtype: type = np.float64,
+    filename: str | None = None,
 ) -> np.ndarray:
     """
     With fill_value = -1 gen_V_matrix generates a size*size matrix:
@@ -21,35 +43,59 @@ def gen_V_matrix(
         size: size of array
         fill_value: float | tuple[lower, upper]:
             if tuple fill_values are drawn from a uniform distribution on [lower, upper].
+        seed: seed or np.random.Generator for the random fill_values, for reproducibility
+        dtype: np.float64 or np.float32
+        filename: if given, the matrix is written to a memory-mapped .npy file
+            (open it again with np.load(filename, mmap_mode="r"))
 
     Returns:
         the matrix
     """
-    if type(fill_value) == float:
-        V = np.full((size, size), fill_value)
+    if filename is None:
+        V = np.empty((size, size), dtype=dtype)
+    else:
+        V = np.lib.format.open_memmap(filename, mode="w+", dtype=dtype, shape=(size, size))
+
+    if np.isscalar(fill_value):
+        V.fill(fill_value)
 
     else:
         assert len(fill_value) == 2, "There is an error in the type of fill_value"
-        rng = np.random.default_rng()
-        V = np.zeros((size, size))
-        for i in range(1, size):
-            for j in range(i):
-                value = rng.uniform(fill_value[0], fill_value[1])
-                V[i, j] = value
-                V[j, i] = value
+        lower, upper = fill_value
+        rng = np.random.default_rng(seed)
+        # The lower triangle is drawn row by row, one block of rows at a time, so that a
+        # memory-mapped matrix is never held in memory. The blocks are drawn one after
+        # another from the same generator, so they do not change the values
+        block = max(1, V_BLOCK_VALUES // max(size, 1))
+        for r0 in range(0, size, block):
+            r1 = min(r0 + block, size)
+            values = rng.random(r1 * (r1 - 1) // 2 - r0 * (r0 - 1) // 2, dtype=dtype)
+            values *= upper - lower
+            values += lower
+            start = 0
+            for i in range(r0, r1):
+                V[i, :i] = values[start : start + i]
+                start += i
+
+        # Mirroring the lower triangle, one block of rows at a time
+        # so that memory-mapped files are written sequentially
+        for r0 in range(0, size, block):
+            r1 = min(r0 + block, size)
+            V[r0:r1, r1:] = V[r1:, r0:r1].T
+            diagonal_block = V[r0:r1, r0:r1]
+            upper_indices = np.triu_indices(r1 - r0, 1)
+            diagonal_block[upper_indices] = diagonal_block.T[upper_indices]
 
     np.fill_diagonal(V, 0)
     np.fill_diagonal(V[:-1, 1:], 0)
     np.fill_diagonal(V[1:, :-1], 0)
-    # this can be done in the for-loops, but this is easier to read and is more foolproof
+    # this is easier to read and is more foolproof than skipping the diagonals when filling
 
     return V
 
 
-
-
-@njit  # TODO: Diameter kan kanskje regnes ut samtidig som energien, siden de deler store deler av koden
-def calculate_diameter(polymer: np.ndarray) -> float:
+@njit(cache=True)
+def calculate_diameter_1(polymer: np.ndarray) -> float:
     """Finds the diameter of a polymer
 
     Args:
@@ -65,3 +111,331 @@ def calculate_diameter(polymer: np.ndarray) -> float:
             (L[::2] - L[::2].transpose()) ** 2 + (L[1::2] - L[1::2].transpose()) ** 2
         )
     )
+
+
+@njit(cache=True)
+def _cross(o_x: int, o_y: int, a_x: int, a_y: int, b_x: int, b_y: int) -> int:
+    """z-component of (a - o) x (b - o). Positive if o -> a -> b turns counterclockwise"""
+    return (a_x - o_x) * (b_y - o_y) - (a_y - o_y) * (b_x - o_x)
+
+
+@njit(cache=True)
+def _turn(hull: np.ndarray, k: int, point: np.ndarray) -> int:
+    """Turn from the last two points of the hull under construction to point, see _cross"""
+    return _cross(
+        hull[k - 2, 0], hull[k - 2, 1], hull[k - 1, 0], hull[k - 1, 1], point[0], point[1]
+    )
+
+
+@njit(cache=True)
+def convex_hull(polymer: np.ndarray) -> np.ndarray:
+    """Finds the convex hull of a polymer, without collinear points.
+    On the lattice only the lowest and highest monomer of every column can be on the hull,
+    and the columns are already sorted, so this is O(N + width) (Andrew's monotone chain
+    without sorting).
+
+    Args:
+        polymer (np.ndarray): the polymer, or any set of lattice points
+
+    Returns:
+        np.ndarray: the corners of the hull in counterclockwise order
+    """
+    x_min = np.min(polymer[:, 0])
+    width = np.max(polymer[:, 0]) - x_min + 1
+    big = np.iinfo(np.int64).max
+    column_min = np.full(width, big, dtype=np.int64)
+    column_max = np.full(width, -big, dtype=np.int64)
+    for i in range(len(polymer)):
+        c = polymer[i, 0] - x_min
+        column_min[c] = min(column_min[c], polymer[i, 1])
+        column_max[c] = max(column_max[c], polymer[i, 1])
+
+    # Candidates sorted by x, then y. Every column of a polymer is occupied, since the bonds
+    # have length 1, but other sets of points can have empty columns, which are skipped
+    n_candidates = 0
+    candidates = np.empty((2 * width, 2), dtype=np.int64)
+    for c in range(width):
+        if column_min[c] == big:
+            continue
+        candidates[n_candidates] = (c + x_min, column_min[c])
+        n_candidates += 1
+        if column_max[c] != column_min[c]:
+            candidates[n_candidates] = (c + x_min, column_max[c])
+            n_candidates += 1
+    if n_candidates <= 2:
+        return candidates[:n_candidates].copy()
+
+    hull = np.empty((2 * n_candidates, 2), dtype=np.int64)
+    k = 0
+    # Lower hull, left to right. Points which do not turn counterclockwise are removed
+    for i in range(n_candidates):
+        while k >= 2 and _turn(hull, k, candidates[i]) <= 0:
+            k -= 1
+        hull[k] = candidates[i]
+        k += 1
+    # Upper hull, right to left
+    lower_size = k + 1
+    for i in range(n_candidates - 2, -1, -1):
+        while k >= lower_size and _turn(hull, k, candidates[i]) <= 0:
+            k -= 1
+        hull[k] = candidates[i]
+        k += 1
+    # The last point is the same as the first
+    return hull[: k - 1].copy()
+
+
+@njit(cache=True)
+def _edge_distance(hull: np.ndarray, i: int, i_next: int, j: int) -> int:
+    """Proportional to the distance from corner j to the edge i -> i_next of the hull"""
+    return _cross(
+        hull[i, 0], hull[i, 1], hull[i_next, 0], hull[i_next, 1], hull[j, 0], hull[j, 1]
+    )
+
+
+@njit(cache=True)
+def calculate_diameter(polymer: np.ndarray) -> float:
+    """Finds the diameter of a polymer, the largest distance between two monomers.
+    The farthest pair is found with rotating calipers on the convex hull, which is O(N),
+    instead of comparing all N^2 pairs as calculate_diameter_1.
+
+    Args:
+        polymer (np.ndarray): the polymer to find the diameter of
+
+    Returns:
+        float: diameter of the polymer
+    """
+    hull = convex_hull(polymer)
+    m = len(hull)
+    if m < 2:
+        return 0.0
+    if m == 2:
+        return np.sqrt((hull[0, 0] - hull[1, 0]) ** 2 + (hull[0, 1] - hull[1, 1]) ** 2)
+
+    best = 0
+    j = 1
+    for i in range(m):
+        i_next = (i + 1) % m
+        # Moves j to the corner farthest from the edge i -> i_next
+        while _edge_distance(hull, i, i_next, (j + 1) % m) > _edge_distance(
+            hull, i, i_next, j
+        ):
+            j = (j + 1) % m
+        for k in (i, i_next):
+            best = max(best, (hull[k, 0] - hull[j, 0]) ** 2 + (hull[k, 1] - hull[j, 1]) ** 2)
+    return np.sqrt(best)
+
+
+@njit(cache=True)
+def calculate_shape(polymer: np.ndarray) -> tuple[float, float, float]:
+    """Finds the structural observables of a polymer
+
+    Args:
+        polymer (np.ndarray): the polymer
+
+    Returns:
+        (diameter, radius of gyration, end-to-end distance)
+    """
+    N = len(polymer)
+    # Relative to the first monomer, to keep the sums small
+    sum_x = sum_y = sum_r2 = 0
+    for i in range(N):
+        x = polymer[i, 0] - polymer[0, 0]
+        y = polymer[i, 1] - polymer[0, 1]
+        sum_x += x
+        sum_y += y
+        sum_r2 += x * x + y * y
+    # R_g^2 = <r^2> - <r>^2
+    radius_of_gyration = np.sqrt(max(sum_r2 / N - (sum_x / N) ** 2 - (sum_y / N) ** 2, 0.0))
+    end_to_end = np.sqrt(
+        (polymer[-1, 0] - polymer[0, 0]) ** 2 + (polymer[-1, 1] - polymer[0, 1]) ** 2
+    )
+    return calculate_diameter(polymer), radius_of_gyration, end_to_end
+
+
+@njit(cache=True)
+def energy_from_table(
+    polymer: np.ndarray, V: np.ndarray | StructuredV, table: np.ndarray
+) -> float:
+    """The energy of a polymer, found from its occupancy table (see lattice.py) in O(N) time.
+    Used by polymer.calculate_energy and calculate_observables
+
+    Args:
+        polymer (np.ndarray): the polymer
+        V: the interaction matrix, dense or StructuredV
+        table: the occupancy table of the polymer
+
+    Returns:
+        the energy
+    """
+    energy = 0.0
+    for i in range(len(polymer)):
+        # Only looking to the right and upwards counts every pair of neighbours once
+        for dx, dy in ((1, 0), (0, 1)):
+            j = lattice.lookup(table, polymer[i, 0] + dx, polymer[i, 1] + dy)
+            if j != -1:
+                energy += interaction(V, i, j)
+    return energy
+
+
+@njit(cache=True)
+def calculate_observables(
+    polymer: np.ndarray, V: np.ndarray | StructuredV
+) -> tuple[float, float, float, float]:
+    """Finds the energy and the structural observables of a polymer in one kernel,
+    in O(N) time, without building any N x N matrix
+
+    Args:
+        polymer (np.ndarray): the polymer
+        V: the interaction matrix, dense or StructuredV
+
+    Returns:
+        (energy, diameter, radius of gyration, end-to-end distance)
+    """
+    energy = energy_from_table(polymer, V, lattice.build_lattice(polymer))
+    diameter, radius_of_gyration, end_to_end = calculate_shape(polymer)
+    return energy, diameter, radius_of_gyration, end_to_end
+
+
+def gen_V_uniform(size: int, fill_value: float = -1.0) -> StructuredV:
+    """The structured version of gen_V_matrix(size, fill_value). Uses O(1) memory.
+
+    Args:
+        size: size of the matrix
+        fill_value: strength between all monomers which are not neighbours in the chain
+
+    Returns:
+        the structured matrix
+    """
+    return gen_V_banded(size, np.array([0.0, 0.0, fill_value]), extend=True)
+
+
+def gen_V_banded(size: int, offsets: np.ndarray, extend: bool = False) -> StructuredV:
+    """Structured matrix where the strength only depends on the distance |i - j| in the chain
+
+    Args:
+        size: size of the matrix
+        offsets: offsets[k] is the strength between monomer i and i + k.
+            offsets[0] and offsets[1] are set to 0, as the matrix from gen_V_matrix.
+        extend: if True, offsets[-1] is used for all larger distances. If False, they are 0.
+
+    Returns:
+        the structured matrix
+    """
+    offsets = np.array(offsets, dtype=np.float64)
+    offsets[:2] = 0
+    if not extend:
+        offsets = np.append(offsets, 0.0)
+    return StructuredV(
+        size, offsets, np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+    )
+
+
+def gen_V_pairs(
+    V: StructuredV, rows: np.ndarray, cols: np.ndarray, values: np.ndarray
+) -> StructuredV:
+    """Adds custom pairs (COO) to a structured matrix, e.g. V[0, N/2] = V[N/2, 0] = value
+
+    Args:
+        V: the structured matrix
+        rows: first monomer index of every pair
+        cols: second monomer index of every pair
+        values: strength of every pair
+
+    Returns:
+        a new structured matrix with the pairs
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64)
+    assert np.all(rows != cols), "The diagonal can not be set"
+    keys = np.minimum(rows, cols) * V.size + np.maximum(rows, cols)
+    # Later pairs overwrite earlier ones, also the pairs already in V
+    all_keys = np.concatenate((keys[::-1], V.pair_keys))
+    all_values = np.concatenate((np.asarray(values, dtype=np.float64)[::-1], V.pair_values))
+    pair_keys, first = np.unique(all_keys, return_index=True)
+    return StructuredV(V.size, V.offsets, pair_keys, all_values[first])
+
+
+def V_to_matrix(V: StructuredV) -> np.ndarray:
+    """Makes the dense matrix of a structured matrix
+
+    Args:
+        V: the structured matrix
+
+    Returns:
+        the dense size x size matrix
+    """
+    distance = np.abs(np.subtract.outer(np.arange(V.size), np.arange(V.size)))
+    matrix = V.offsets[np.minimum(distance, len(V.offsets) - 1)]
+    rows, cols = np.divmod(V.pair_keys, V.size)
+    matrix[rows, cols] = V.pair_values
+    matrix[cols, rows] = V.pair_values
+    return matrix
+
+
+def reduced_V(
+    V: np.ndarray | StructuredV, max_denominator: int = 1000
+) -> tuple[np.ndarray | StructuredV, float]:
+    """Writes V as integer multiples of an energy unit (reduced units), e.g. for gen_V_uniform or
+    V with few distinct values. The energies of the polymers are then integers, which are exact
+    in floating point, so the energy does not drift when it is updated with the changes.
+
+    Args:
+        V: the interaction matrix, dense or structured
+        max_denominator: the unit is |v| / d for the smallest nonzero |v| in V and some d <= max_denominator
+
+    Returns:
+        (the matrix V / unit, with integer values and of the same kind as V, the unit)
+    """
+    if isinstance(V, StructuredV):
+        values = np.concatenate((V.offsets, V.pair_values))
+    else:
+        values = np.unique(V)
+    values = np.abs(values[values != 0])
+    if len(values) == 0:
+        return V, 1.0
+    for denominator in range(1, max_denominator + 1):
+        unit = values.min() / denominator
+        multiples = values / unit
+        if np.allclose(multiples, np.round(multiples), rtol=0, atol=1e-6):
+            break
+    else:
+        raise ValueError("The values of V are not integer multiples of a common unit")
+    if isinstance(V, StructuredV):
+        offsets = np.round(V.offsets / unit)
+        return StructuredV(V.size, offsets, V.pair_keys, np.round(V.pair_values / unit)), unit
+    return np.round(V / unit), unit
+
+
+@njit(cache=True)
+def _structured_interaction(V: StructuredV, i: int, j: int) -> float:
+    """See interaction"""
+    if len(V.pair_keys) > 0:
+        key = min(i, j) * V.size + max(i, j)
+        k = np.searchsorted(V.pair_keys, key)
+        if k < len(V.pair_keys) and V.pair_keys[k] == key:
+            return V.pair_values[k]
+    return V.offsets[min(abs(i - j), len(V.offsets) - 1)]
+
+
+def interaction(V, i: int, j: int) -> float:
+    """Strength of the interaction between monomer i and j, for both
+    dense (np.ndarray) and structured (StructuredV) matrices.
+    Callable from Python and from jitted code (through the overload below).
+
+    Args:
+        V: the interaction matrix, dense or StructuredV
+        i, j: the monomers
+
+    Returns:
+        V[i, j]
+    """
+    if isinstance(V, StructuredV):
+        return float(_structured_interaction(V, i, j))
+    return float(V[i, j])
+
+
+@overload(interaction)
+def _interaction(V, i, j):
+    if isinstance(V, types.Array):
+        return lambda V, i, j: V[i, j]
+    return lambda V, i, j: _structured_interaction(V, i, j)
@@ -1,48 +1,184 @@
 import numpy as np
 import matplotlib.pyplot as plt
+from matplotlib.animation import FuncAnimation
+from matplotlib.collections import LineCollection
+
+"""
+Drawing of polymers, and animations of trajectories.
+
+Only the bounding box of the polymer is drawn. Small polymers are drawn as a grid with the
+monomers coloured by their index (pcolormesh), which is filled with one vectorised assignment.
+When the bounding box has more than max_cells cells, the polymer is drawn as a line through
+the monomers instead (LineCollection), with at most max_points points (level of detail:
+every k-th monomer), so that even polymers of millions of monomers are drawn in about a second.
+The monomer at (x, y) is the cell [x, x + 1] x [y, y + 1] of the grid, and the point
+(x + 0.5, y + 0.5) of the line.
+"""
+
+# Largest number of cells of the bounding box which is drawn as a grid
+GRID_MAX_CELLS = 250_000
+# Largest number of points of the line of a large polymer
+LINE_MAX_POINTS = 20_000
+# Largest number of monomers which get their index written next to them
+NUMBERS_MAX = 100
+
+
+def _bounds(polymer: np.ndarray) -> tuple[int, int, int, int]:
+    """(x_min, x_max, y_min, y_max) of the monomers"""
+    x_min, y_min = polymer.min(axis=0)
+    x_max, y_max = polymer.max(axis=0)
+    return int(x_min), int(x_max), int(y_min), int(y_max)
+
+
+def _lod(polymer: np.ndarray, max_points: int) -> tuple[np.ndarray, np.ndarray]:
+    """(indices, coordinates) of the monomers of the line: every k-th monomer and the last one"""
+    stride = max(1, -(-len(polymer) // max_points))
+    indices = np.arange(0, len(polymer), stride)
+    if indices[-1] != len(polymer) - 1:
+        indices = np.append(indices, len(polymer) - 1)
+    return indices, polymer[indices] + 0.5
+
 
 def illustrate_polymer(
     ax,
     polymer: np.ndarray,
     cmap: str = "Greens",
     numbers: bool = False,
-    title: str = ""
-) -> None:
+    title: str = "",
+    max_cells: int = GRID_MAX_CELLS,
+    max_points: int = LINE_MAX_POINTS,
+):
     """
-    Uses matplotlib.pyplot.pcolormesh to illustrate a polymer.
+    Illustrates a polymer on the bounding box of its monomers, as a grid (pcolormesh)
+    or, if the bounding box has more than max_cells cells, as a line (LineCollection).
 
     Args:
         ax: the Axes to which illustrate_polymer will plot the result.
         polymer: Nx2-dimensional array containing coordinates for the N monomers
         cmap: matplotlib colormap
-        number: Defaults to False. If True the monomers will display their index
+        numbers: Defaults to False. If True the monomers will display their index.
+            For more than NUMBERS_MAX monomers only every k-th monomer is numbered
         title: Title
-        
+        max_cells: largest number of cells of the bounding box which is drawn as a grid
+        max_points: largest number of points of the line
+
     Returns:
-        None
+        the QuadMesh of the grid or the LineCollection of the line
     """
-    # Make a NxN-grid
+    polymer = np.asarray(polymer)
     N = len(polymer)
-    x = y = np.arange(N + 1)
-    Z = np.zeros((N, N))
-
-    # Placing the polymer on the grid such that the middle monomer is in the center.
-    middle_monomer = polymer[int(N / 2)]
-    for i, monomer in enumerate(polymer):
-        # Shifting by 1 if N is even and middle monomer has negative coordinates
-        shifty = (1 if N % 2 == 0 and middle_monomer[1] < 0 else 0)
-        shiftx = (1 if N % 2 == 0 and middle_monomer[0] < 0 else 0)
-        x_coord = monomer[1] + int(N / 2) - middle_monomer[1] - shifty
-        y_coord = monomer[0] + int(N / 2) - middle_monomer[0] - shiftx
-        Z[x_coord, y_coord] = i + 2
-        if numbers:
-            ax.text(y_coord + 0.5, x_coord + 0.5, i + 1, size="x-large", color='red')
-
-    ax.pcolormesh(x, y, Z, shading="flat", cmap=cmap)
-    ax.set(title=title, xticks=x, xticklabels=[], yticks=y, yticklabels=[])
+    x_min, x_max, y_min, y_max = _bounds(polymer)
+    width = x_max - x_min + 1
+    height = y_max - y_min + 1
+
+    if width * height <= max_cells:
+        Z = np.zeros((height, width))
+        # Indices from 2, so that the monomers stand out from the empty cells (0)
+        Z[polymer[:, 1] - y_min, polymer[:, 0] - x_min] = np.arange(N) + 2
+        x = np.arange(x_min, x_max + 2)
+        y = np.arange(y_min, y_max + 2)
+        artist = ax.pcolormesh(x, y, Z, shading="flat", cmap=cmap)
+        # Grid lines between the cells, as long as they are not too dense to see
+        if max(width, height) <= 100:
+            ax.set(xticks=x, yticks=y)
+            ax.grid(True)
+    else:
+        indices, points = _lod(polymer, max_points)
+        segments = np.stack((points[:-1], points[1:]), axis=1)
+        artist = LineCollection(segments, cmap=cmap)
+        artist.set_array(indices[:-1])
+        ax.add_collection(artist)
+        ax.set(xlim=(x_min, x_max + 1), ylim=(y_min, y_max + 1))
+
+    if numbers:
+        stride = max(1, -(-N // NUMBERS_MAX))
+        for i in range(0, N, stride):
+            ax.text(polymer[i, 0] + 0.5, polymer[i, 1] + 0.5, i + 1, size="x-large", color="red")
+
+    ax.set(title=title, xticklabels=[], yticklabels=[], aspect="equal")
     ax.tick_params(axis="both", left=False, right=False, bottom=False, top=False)
-    ax.grid(True)
+    return artist
+
+
+def trajectory_bounds(
+    trajectory, frames: np.ndarray, block: int = 256
+) -> tuple[int, int, int, int]:
+    """(x_min, x_max, y_min, y_max) of the monomers in some frames of a trajectory
+
+    Args:
+        trajectory: trajectory.Trajectory, or polymers which can be indexed with an array
+        frames: indices of the frames
+        block: number of frames decoded at a time
+    """
+    x_min = y_min = np.iinfo(np.int64).max
+    x_max = y_max = np.iinfo(np.int64).min
+    for start in range(0, len(frames), block):
+        polymers = np.asarray(trajectory[frames[start : start + block]])
+        x_min = min(x_min, int(polymers[..., 0].min()))
+        x_max = max(x_max, int(polymers[..., 0].max()))
+        y_min = min(y_min, int(polymers[..., 1].min()))
+        y_max = max(y_max, int(polymers[..., 1].max()))
+    return x_min, x_max, y_min, y_max
+
+
+def animate_trajectory(
+    trajectory,
+    ax=None,
+    every: int = 1,
+    interval: int = 50,
+    color: str = "green",
+    max_points: int = LINE_MAX_POINTS,
+    bounds: tuple[int, int, int, int] | None = None,
+) -> FuncAnimation:
+    """Animates the polymers of a trajectory as a line through the monomers.
+    Every frame is decoded when it is drawn, and only the line and the label are redrawn
+    (blitting), so long trajectories are not loaded into memory.
+
+    Args:
+        trajectory: trajectory.Trajectory, or a sequence of polymers (e.g. a (frames, N, 2) array)
+        ax: the Axes to draw on. A new figure if None
+        every: draw every k-th frame
+        interval: time between the frames (milliseconds)
+        color: colour of the line
+        max_points: largest number of points of the line, see illustrate_polymer
+        bounds: (x_min, x_max, y_min, y_max) of the view. Found from the drawn frames if None
+
+    Returns:
+        the animation. Show it with plt.show() or save it with .save(path)
+    """
+    if ax is None:
+        _, ax = plt.subplots()
+    frames = np.arange(0, len(trajectory), every)
+    if bounds is None:
+        bounds = trajectory_bounds(trajectory, frames)
+    x_min, x_max, y_min, y_max = bounds
+    ax.set(xlim=(x_min, x_max + 1), ylim=(y_min, y_max + 1), aspect="equal")
+    ax.set(xticklabels=[], yticklabels=[])
+    ax.tick_params(axis="both", left=False, right=False, bottom=False, top=False)
+
+    (line,) = ax.plot([], [], color=color, marker="o" if len(trajectory[0]) <= 200 else None)
+    label = ax.text(0.02, 0.98, "", transform=ax.transAxes, va="top")
+    steps = getattr(trajectory, "steps", None)
+    energies = getattr(trajectory, "energies", None)
+
+    def update(frame: int):
+        _, points = _lod(np.asarray(trajectory[frame]), max_points)
+        line.set_data(points[:, 0], points[:, 1])
+        text = f"frame {frame}"
+        if steps is not None:
+            text = f"step {steps[frame]}"
+        if energies is not None and np.isfinite(energies[frame]):
+            text += f", E = {energies[frame]:.3g}"
+        label.set_text(text)
+        return line, label
+
+    return FuncAnimation(
+        ax.figure, update, frames=frames, interval=interval, blit=True, cache_frame_data=False
+    )
+
 
 if __name__ == "__main__":
     a = np.array([[0, 0], [0, 1], [1, 1]])
-    illustrate_polymer(a, numbers=True, title=str(a))
+    fig, ax = plt.subplots()
+    illustrate_polymer(ax, a, numbers=True, title=str(a))
+    plt.show()
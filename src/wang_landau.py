@@ -0,0 +1,270 @@
+from collections import namedtuple
+
+import numpy as np
+import lattice
+import polymer
+import reweighting
+import rng
+import utilities
+from scipy.constants import Boltzmann
+from numba import njit, prange
+
+"""
+Wang-Landau sampling of the density of states g(E) of a polymer, for a given interaction matrix.
+
+A random walk in the conformations (using the rotations of polymer.py) accepts a move from
+energy E to E' with probability min(1, g(E) / g(E')), and multiplies the estimate g(E) of the
+current energy by f after every step. When the histogram of the visited energies is flat,
+f is replaced by sqrt(f). Once ln f is below n_bins / t (t: number of steps), ln f = n_bins / t
+is used instead (the 1/t algorithm of Belardinelli and Pereyra), since halving ln f makes the
+error of the estimate saturate. The walk stops when ln f is small. The estimate of g(E) then gives
+the thermal averages at any temperature (see canonical_averages), instead of a simulation per temperature.
+
+The energies are binned on [E_min, E_max]. Moves which leave the range are rejected.
+For an interaction matrix with the same value eps everywhere (e.g. utilities.gen_V_uniform),
+the energies are multiples of eps, and bins of width |eps| centred on the multiples are exact.
+
+The microcanonical averages of the diameter (and its square) are accumulated in every bin,
+so that the averages of the diameter can be found at any temperature as well.
+"""
+
+# Estimate of the density of states
+# energies: the centre of every bin
+# log_g: ln g(E), normalised such that the g(E) sum to 1. -inf for the bins that were never visited
+# d_mean, d2_mean: mean diameter and mean squared diameter of the conformations in every bin
+# steps: number of steps of every walker
+WangLandauResult = namedtuple(
+    "WangLandauResult", ["energies", "log_g", "d_mean", "d2_mean", "steps"]
+)
+
+
+@njit(cache=True)
+def _energy_bin(E: float, E_min: float, E_max: float, n_bins: int) -> int:
+    """The bin of an energy, or -1 if it is outside [E_min, E_max]"""
+    if E < E_min or E > E_max:
+        return -1
+    return min(int((E - E_min) / (E_max - E_min) * n_bins), n_bins - 1)
+
+
+@njit(cache=True)
+def _walk(
+    pol: np.ndarray,
+    V: np.ndarray | utilities.StructuredV,
+    E_min: float,
+    E_max: float,
+    n_bins: int,
+    log_f_final: float,
+    flatness: float,
+    check_interval: int,
+    max_steps: int,
+    state: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, int]:
+    """One Wang-Landau walker, see wang_landau
+
+    Returns:
+        (ln g, sum of the diameters, sum of the squared diameters, number of samples, steps) of every bin
+    """
+    N = len(pol)
+    pol = pol.copy()
+    table = lattice.build_lattice(pol)
+    E = polymer.calculate_energy(pol, V)
+    b = _energy_bin(E, E_min, E_max, n_bins)
+    d, _, _ = utilities.calculate_shape(pol)
+
+    log_g = np.zeros(n_bins)
+    histogram = np.zeros(n_bins, dtype=np.int64)
+    visited = np.zeros(n_bins, dtype=np.bool_)
+    d_sum = np.zeros(n_bins)
+    d2_sum = np.zeros(n_bins)
+    samples = np.zeros(n_bins, dtype=np.int64)
+    log_f = 1.0
+    one_over_t = False
+
+    n_visited = 1
+    step = 0
+    while log_f > log_f_final and step < max_steps:
+        step += 1
+        if one_over_t:
+            log_f = n_visited / step
+        # A rotation which breaks the polymer is rejected, instead of drawing another one,
+        # since the number of valid rotations differs between the conformations and
+        # redrawing would sample them unevenly
+        rotation_center = rng.draw_pivot(state, 2, N)
+        positive_direction = rng.draw_direction(state)
+        if polymer.check_if_intact_rotated(pol, rotation_center, positive_direction, table):
+            delta_E = polymer.energy_delta(pol, V, rotation_center, positive_direction, table)
+            new_b = _energy_bin(E + delta_E, E_min, E_max, n_bins)
+            if new_b != -1 and rng.draw_acceptance(state) < np.exp(log_g[b] - log_g[new_b]):
+                polymer.apply_rotation(pol, rotation_center, positive_direction, table)
+                E += delta_E
+                b = new_b
+                d, _, _ = utilities.calculate_shape(pol)
+
+        log_g[b] += log_f
+        histogram[b] += 1
+        visited[b] = True
+        d_sum[b] += d
+        d2_sum[b] += d * d
+        samples[b] += 1
+
+        if not one_over_t and step % check_interval == 0:
+            # The histogram is flat if every energy that has been visited is visited often enough
+            lowest = histogram.max()
+            total = 0
+            n_visited = 0
+            for i in range(n_bins):
+                if visited[i]:
+                    lowest = min(lowest, histogram[i])
+                    total += histogram[i]
+                    n_visited += 1
+            if lowest >= flatness * total / n_visited:
+                log_f /= 2
+                histogram[:] = 0
+                one_over_t = log_f < n_visited / step
+
+    for i in range(n_bins):
+        if not visited[i]:
+            log_g[i] = -np.inf
+    return log_g, d_sum, d2_sum, samples, step
+
+
+@njit(parallel=True, cache=True)
+def _walkers(
+    N: int,
+    V: np.ndarray | utilities.StructuredV,
+    E_min: float,
+    E_max: float,
+    n_bins: int,
+    n_walkers: int,
+    log_f_final: float,
+    flatness: float,
+    check_interval: int,
+    max_steps: int,
+    seed: int,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Independent walkers from a flat polymer, in parallel"""
+    states = rng.seed_states(seed, n_walkers)
+    log_g = np.zeros((n_walkers, n_bins))
+    d_sum = np.zeros((n_walkers, n_bins))
+    d2_sum = np.zeros((n_walkers, n_bins))
+    samples = np.zeros((n_walkers, n_bins), dtype=np.int64)
+    steps = np.zeros(n_walkers, dtype=np.int64)
+    for w in prange(n_walkers):
+        log_g[w], d_sum[w], d2_sum[w], samples[w], steps[w] = _walk(
+            polymer.generate_flat_polymer(N),
+            V,
+            E_min,
+            E_max,
+            n_bins,
+            log_f_final,
+            flatness,
+            check_interval,
+            max_steps,
+            states[w],
+        )
+    return log_g, d_sum, d2_sum, samples, steps
+
+
+def _log_sum_exp(values: np.ndarray) -> float:
+    """ln(sum(exp(values))), without overflow"""
+    largest = values.max()
+    return largest + np.log(np.exp(values - largest).sum())
+
+
+def wang_landau(
+    N: int,
+    V: np.ndarray | utilities.StructuredV,
+    E_min: float,
+    E_max: float,
+    n_bins: int,
+    n_walkers: int = 1,
+    log_f_final: float = 1e-6,
+    flatness: float = 0.8,
+    check_interval: int = 10_000,
+    max_steps: int = 10**9,
+    seed: int | None = None,
+) -> WangLandauResult:
+    """Estimates the density of states of a polymer of length N with Wang-Landau sampling.
+    The walkers run in parallel, and their estimates are averaged.
+
+    Args:
+        N: length of polymer
+        V: Interaction forces between two monomers, dense or utilities.StructuredV
+        E_min: lower edge of the energy range. Must be at most 0, the energy of the flat polymer
+        E_max: upper edge of the energy range. Must be at least 0
+        n_bins: number of energy bins
+        n_walkers: number of independent walkers
+        log_f_final: stop when ln f is below this
+        flatness: the histogram is flat when every visited bin has at least this fraction of the mean
+        check_interval: number of steps between the checks of the histogram
+        max_steps: largest number of steps of every walker
+        seed: seed of the random number streams. Seeded from np.random if None
+
+    Returns:
+        WangLandauResult with the estimate of g(E) and the microcanonical averages of the diameter
+    """
+    if not E_min <= 0 <= E_max:
+        raise ValueError("The energy range must contain 0, the energy of the flat polymer")
+    if seed is None:
+        seed = np.random.randint(0, 2**62)
+    log_g, d_sum, d2_sum, samples, steps = _walkers(
+        N,
+        V,
+        E_min,
+        E_max,
+        n_bins,
+        n_walkers,
+        log_f_final,
+        flatness,
+        check_interval,
+        max_steps,
+        seed,
+    )
+
+    # The estimate of every walker is only known up to a constant, which is fixed
+    # on the bins that every walker visited, before they are averaged
+    common = np.all(np.isfinite(log_g), axis=0)
+    if not common.any():
+        raise ValueError(
+            "The walkers have no visited energy bin in common, so their estimates "
+            "can not be combined. Increase max_steps"
+        )
+    log_g = np.where(np.isfinite(log_g), log_g, np.nan)
+    for w in range(n_walkers):
+        log_g[w] -= _log_sum_exp(log_g[w, common])
+    visited = samples.sum(axis=0) > 0
+    log_g = np.where(visited, np.nanmean(np.where(visited, log_g, 0), axis=0), -np.inf)
+    log_g[visited] -= _log_sum_exp(log_g[visited])
+    with np.errstate(invalid="ignore"):
+        d_mean = d_sum.sum(axis=0) / samples.sum(axis=0)
+        d2_mean = d2_sum.sum(axis=0) / samples.sum(axis=0)
+
+    width = (E_max - E_min) / n_bins
+    energies = E_min + width * (np.arange(n_bins) + 0.5)
+    return WangLandauResult(energies, log_g, d_mean, d2_mean, steps)
+
+
+def canonical_averages(
+    result: WangLandauResult, T_array: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Thermal averages from the estimated density of states
+
+    Args:
+        result: the estimate, see wang_landau
+        T_array: temperatures (Kelvin)
+
+    Returns:
+        (E_mean, E_std, d_mean, d_std, C_v): arrays with the mean and standard deviation
+        of the energy and the diameter, and the heat capacity, at every temperature
+    """
+    T_array = np.atleast_1d(np.asarray(T_array, dtype=np.float64))
+    visited = np.isfinite(result.log_g)
+    energies = result.energies[visited]
+    weights = reweighting.canonical_weights(result.log_g[visited], energies, T_array)
+
+    E_mean = weights @ energies
+    E_var = np.maximum(weights @ energies**2 - E_mean**2, 0)
+    d_mean = weights @ result.d_mean[visited]
+    d_var = np.maximum(weights @ result.d2_mean[visited] - d_mean**2, 0)
+    C_v = E_var / (Boltzmann * T_array**2)
+    return E_mean, np.sqrt(E_var), d_mean, np.sqrt(d_var), C_v